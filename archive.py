@@ -0,0 +1,172 @@
+"""
+ماژول بایگانی دفتر کل (Ledger Archival).
+
+ردیف‌های سود روزانه به اندازه (سرمایه‌گذاری فعال × روز) رشد می‌کنند و هر کوئری تجمیعی
+هزینه کل این تاریخچه را می‌پردازد. این ماژول ردیف‌های تسویه شده profit و referral_bonus
+قدیمی‌تر از افق بایگانی (LEDGER_ARCHIVE_DAYS) را به جدول transactions_archive منتقل می‌کند
+و به جای آن‌ها خلاصه ماهانه (کاربر، سرمایه‌گذاری، نوع، ماه) در ledger_summaries نگه می‌دارد،
+تا موجودی‌ها و جمع‌های حسابداری دقیق باقی بمانند.
+
+اجرا: flask archive-ledger
+"""
+
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import and_, func, insert, delete, or_
+from extensions import db
+from models import Transaction, Investment, ArchivedTransaction, LedgerSummary, ReferralBonusDetail
+from ledger import EARNING_TYPES, _quantize
+
+ARCHIVE_COLUMNS = (
+    'id', 'user_id', 'investment_id', 'type', 'amount', 'description',
+    'status', 'timestamp', 'tx_hash', 'profit_date'
+)
+# حداکثر ردیف‌های بایگانی شده در هر پاسخ API جزئیات
+ARCHIVED_ROWS_LIMIT = 1000
+
+def archive_cutoff(horizon_days, today=None):
+    """اولین روزی که بایگانی نمی‌شود: ابتدای ماهِ (امروز - افق)، تا هر ماه یا کامل بایگانی شود یا اصلاً."""
+    today = today or datetime.utcnow().date()
+    boundary = today - timedelta(days=horizon_days)
+    return boundary.replace(day=1)
+
+def archive_ledger(app, horizon_days=None, batch_size=None, dry_run=False):
+    """
+    انتقال ردیف‌های تسویه شده سود و پاداش معرف قدیمی‌تر از افق به جدول بایگانی.
+
+    هر دسته (بر اساس id) در یک تراکنش دیتابیس: درج در بایگانی، به‌روزرسانی خلاصه‌های ماهانه،
+    حذف از transactions. موجودی‌های user_balances تغییری نمی‌کنند چون مجموع درآمد ثابت می‌ماند.
+    ردیف‌هایی بایگانی نمی‌شوند که:
+      - سود روزی باشند که هنوز به last_profit_date سرمایه‌گذاری نرسیده (موتور سود به آن‌ها نیاز دارد)؛
+      - پاداش تجمیعی با ریز پاداش در referral_bonus_details باشند (کلید خارجی به transactions).
+    خروجی: دیکشنری گزارش (cutoff, rows, amount, summaries, elapsed).
+    """
+    with app.app_context():
+        if horizon_days is None:
+            horizon_days = app.config.get('LEDGER_ARCHIVE_DAYS', 365)
+        if batch_size is None:
+            batch_size = app.config.get('PROFIT_BATCH_SIZE', 500)
+        cutoff = archive_cutoff(horizon_days)
+
+        report = {
+            'dry_run': dry_run,
+            'cutoff': cutoff,
+            'rows': 0,
+            'amount': Decimal('0'),
+            'summaries_created': 0,
+            'summaries_updated': 0,
+            'elapsed': 0.0,
+        }
+        started = time.perf_counter()
+        columns = [getattr(Transaction, name) for name in ARCHIVE_COLUMNS]
+        has_details = db.session.query(ReferralBonusDetail.id).filter(
+            ReferralBonusDetail.transaction_id == Transaction.id
+        ).exists()
+
+        last_id = 0
+        while True:
+            chunk = db.session.query(*columns).outerjoin(
+                Investment, Transaction.investment_id == Investment.id
+            ).filter(
+                Transaction.id > last_id,
+                Transaction.type.in_(EARNING_TYPES),
+                Transaction.status == 'completed',
+                Transaction.profit_date < cutoff,
+                or_(Transaction.type != 'profit', Investment.last_profit_date >= Transaction.profit_date),
+                ~has_details
+            ).order_by(Transaction.id).limit(batch_size).all()
+
+            if not chunk:
+                break
+            last_id = chunk[-1].id
+            rows = [dict(zip(ARCHIVE_COLUMNS, row)) for row in chunk]
+            report['rows'] += len(rows)
+            report['amount'] += sum((row['amount'] for row in rows), Decimal('0'))
+
+            if dry_run:
+                continue
+
+            try:
+                db.session.execute(insert(ArchivedTransaction), rows)
+                created, updated = _merge_summaries(rows)
+                db.session.execute(
+                    delete(Transaction).where(Transaction.id.in_([row['id'] for row in rows]))
+                    .execution_options(synchronize_session=False)
+                )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.error(f'Ledger archival failed at transaction id {rows[0]["id"]}')
+                raise
+            report['summaries_created'] += created
+            report['summaries_updated'] += updated
+
+        report['elapsed'] = time.perf_counter() - started
+        app.logger.info(
+            f"Ledger archival {'(dry run) ' if dry_run else ''}before {cutoff}: "
+            f"{report['rows']} rows, {report['amount']} total in {report['elapsed']:.2f}s"
+        )
+        return report
+
+def _merge_summaries(rows):
+    """افزودن ردیف‌های یک دسته به خلاصه‌های ماهانه. خروجی: (تعداد ساخته شده، تعداد به‌روز شده)"""
+    groups = {}
+    for row in rows:
+        key = (row['user_id'], row['investment_id'], row['type'], row['profit_date'].replace(day=1))
+        group = groups.setdefault(key, {'row_count': 0, 'amount': Decimal('0'),
+                                        'first_day': row['profit_date'], 'last_day': row['profit_date']})
+        group['row_count'] += 1
+        group['amount'] += row['amount']
+        group['first_day'] = min(group['first_day'], row['profit_date'])
+        group['last_day'] = max(group['last_day'], row['profit_date'])
+
+    existing = {
+        (s.user_id, s.investment_id, s.type, s.month): s
+        for s in LedgerSummary.query.filter(
+            LedgerSummary.user_id.in_({key[0] for key in groups}),
+            LedgerSummary.month.in_({key[3] for key in groups})
+        )
+    }
+
+    created = 0
+    for key, group in groups.items():
+        summary = existing.get(key)
+        if summary is None:
+            user_id, investment_id, tx_type, month = key
+            db.session.add(LedgerSummary(user_id=user_id, investment_id=investment_id, type=tx_type,
+                                         month=month, **group))
+            created += 1
+        else:
+            summary.row_count += group['row_count']
+            summary.amount += group['amount']
+            summary.first_day = min(summary.first_day, group['first_day'])
+            summary.last_day = max(summary.last_day, group['last_day'])
+    db.session.flush()
+    return created, len(groups) - created
+
+# --- Readers ---
+
+def archived_investment_totals(investment_ids):
+    """مجموع سود بایگانی شده هر سرمایه‌گذاری. خروجی: {investment_id: Decimal}"""
+    if not investment_ids:
+        return {}
+    rows = db.session.query(LedgerSummary.investment_id, func.sum(LedgerSummary.amount)).filter(
+        LedgerSummary.investment_id.in_(list(investment_ids)), LedgerSummary.type == 'profit'
+    ).group_by(LedgerSummary.investment_id)
+    return {investment_id: _quantize(total) for investment_id, total in rows}
+
+def archived_rows(user_id=None, investment_id=None, day=None, month=None, limit=ARCHIVED_ROWS_LIMIT):
+    """ردیف‌های بایگانی شده برای نمای جزئیات (بارگذاری در صورت درخواست)."""
+    query = ArchivedTransaction.query
+    if user_id:
+        query = query.filter(ArchivedTransaction.user_id == user_id)
+    if investment_id:
+        query = query.filter(ArchivedTransaction.investment_id == investment_id)
+    if day:
+        query = query.filter(ArchivedTransaction.profit_date == day)
+    if month:
+        next_month = (month.replace(day=28) + timedelta(days=4)).replace(day=1)
+        query = query.filter(and_(ArchivedTransaction.profit_date >= month,
+                                  ArchivedTransaction.profit_date < next_month))
+    return query.order_by(ArchivedTransaction.profit_date.desc(), ArchivedTransaction.id.desc()).limit(limit).all()
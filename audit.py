@@ -0,0 +1,270 @@
+"""
+ماژول نوشتن ناهمگام لاگ فعالیت‌ها (Buffered Audit Writer).
+
+log_admin_activity به جای add + commit جداگانه در session درخواست (که هر اقدام ادمین و هر ورود
+کارمندان را یک commit اضافه می‌کرد و کارهای نیمه‌تمام session را هم flush می‌کرد)، ورودی را
+در یک صف درون‌پروسسی قرار می‌دهد. یک thread پس‌زمینه ورودی‌ها را به صورت دسته‌ای و با اتصال
+جداگانه خودش در audit_logs درج می‌کند:
+  - flush با رسیدن به AUDIT_LOG_BATCH_SIZE ورودی یا گذشت AUDIT_LOG_FLUSH_SECONDS ثانیه،
+  - flush نهایی هنگام خروج پروسس (atexit)،
+  - وقتی صف پر است ورودی جدید دور ریخته می‌شود (درخواست کاربر هرگز منتظر لاگ نمی‌ماند).
+آمار صف (عمق، نوشته شده، دور ریخته شده، خطا) از stats() در دسترس است.
+
+نگهداری (Retention): لاگ‌های قدیمی‌تر از AUDIT_LOG_RETENTION_DAYS در فایل‌های فشرده JSON Lines
+(gzip) در AUDIT_LOG_ARCHIVE_DIR نوشته و از جدول حذف می‌شوند تا جدول داغ کوچک بماند.
+اجرا: flask compact-audit-logs
+"""
+
+import atexit
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import insert
+from extensions import db
+from models import AuditLog
+
+class AuditWriter:
+    def __init__(self, app=None):
+        self.app = None
+        self.enabled = True
+        self.batch_size = 200
+        self.flush_interval = 2.0
+        self._queue = queue.Queue(maxsize=10000)
+        self._write_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._stats = {'written': 0, 'dropped': 0, 'failed': 0, 'batches': 0, 'last_flush': None, 'last_error': None}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.enabled = app.config.get('AUDIT_LOG_ASYNC', True)
+        self.batch_size = app.config.get('AUDIT_LOG_BATCH_SIZE', self.batch_size)
+        self.flush_interval = app.config.get('AUDIT_LOG_FLUSH_SECONDS', self.flush_interval)
+        self._queue = queue.Queue(maxsize=app.config.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+        atexit.register(self.stop)
+
+    def submit(self, user_id, action, details=None, ip_address=None):
+        """قرار دادن یک ورودی در صف (بدون انتظار). خروجی: False اگر ورودی دور ریخته شد."""
+        entry = {
+            'user_id': user_id,
+            'action': action,
+            'details': details[:500] if details else details,
+            'ip_address': ip_address,
+            'timestamp': datetime.utcnow(),
+        }
+        if not self.enabled:
+            self._write([entry])
+            return True
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._count('dropped')
+            return False
+        if self._queue.qsize() >= self.batch_size:
+            self._wakeup.set()
+        return True
+
+    def flush(self):
+        """نوشتن همه ورودی‌های صف در همین thread. خروجی: تعداد ورودی‌های نوشته شده."""
+        written = 0
+        while True:
+            batch = self._drain()
+            if not batch:
+                return written
+            written += self._write(batch)
+
+    def stop(self, timeout=5.0):
+        """توقف thread پس‌زمینه و flush نهایی (هنگام خروج پروسس)."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout)
+        self.flush()
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['queue_capacity'] = self._queue.maxsize
+        stats['async'] = self.enabled
+        stats['running'] = self._thread is not None and self._thread.is_alive() and self._pid == os.getpid()
+        return stats
+
+    def _ensure_started(self):
+        # thread بعد از fork (workerهای gunicorn) وجود ندارد؛ در هر پروسس جداگانه ساخته می‌شود
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+                return
+            self._stopping.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+
+    def _drain(self):
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        """درج یک دسته با اتصال جداگانه؛ در صورت خطا، درج تک‌تک تا فقط ورودی‌های معیوب از دست بروند."""
+        with self._write_lock, self.app.app_context():
+            try:
+                with db.engine.begin() as connection:
+                    connection.execute(insert(AuditLog), batch)
+                written = len(batch)
+            except Exception as e:
+                self.app.logger.error(f'Audit log batch of {len(batch)} failed, retrying row by row: {e}')
+                written = 0
+                for entry in batch:
+                    try:
+                        with db.engine.begin() as connection:
+                            connection.execute(insert(AuditLog), [entry])
+                        written += 1
+                    except Exception as row_error:
+                        self._count('failed', error=str(row_error))
+
+        with self._stats_lock:
+            self._stats['written'] += written
+            self._stats['batches'] += 1
+            self._stats['last_flush'] = datetime.utcnow().isoformat()
+        return written
+
+    def _count(self, key, error=None):
+        with self._stats_lock:
+            self._stats[key] += 1
+            if error:
+                self._stats['last_error'] = error
+
+audit_writer = AuditWriter()
+
+# --- Browsing ---
+
+def audit_log_query(user_id=None, action=None, ip=None, start_date=None, end_date=None):
+    """
+    فیلترهای نمای لاگ فعالیت‌ها (بدون ترتیب؛ صفحه‌بندی keyset روی (timestamp, id) اضافه می‌شود).
+    ip دقیق است یا پیشوندی که به '*' ختم می‌شود؛ هر فیلتر ایندکس (ستون، timestamp، id) متناظر دارد.
+    """
+    query = AuditLog.query
+    if user_id is not None:
+        query = query.filter(AuditLog.user_id == user_id)
+    if action:
+        query = query.filter(AuditLog.action == action)
+    if ip and ip.endswith('*'):
+        # پیشوند به صورت بازه قابل استفاده با ایندکس: '10.0.*' -> ['10.0.', '10.0/')
+        prefix = ip.rstrip('*')
+        if prefix:
+            query = query.filter(AuditLog.ip_address >= prefix,
+                                 AuditLog.ip_address < prefix[:-1] + chr(ord(prefix[-1]) + 1))
+    elif ip:
+        query = query.filter(AuditLog.ip_address == ip)
+    if start_date:
+        query = query.filter(AuditLog.timestamp >= start_date)
+    if end_date:
+        query = query.filter(AuditLog.timestamp <= end_date)
+    return query
+
+# --- Retention / Compaction ---
+
+AUDIT_ARCHIVE_COLUMNS = ('id', 'user_id', 'action', 'details', 'ip_address', 'timestamp')
+
+def compact_audit_logs(app, retention_days=None, batch_size=None, archive_dir=None, dry_run=False):
+    """
+    انتقال لاگ‌های قدیمی‌تر از افق نگهداری به یک فایل gzip (یک شیء JSON در هر خط) و حذف آن‌ها از جدول.
+
+    ابتدا کل فایل (در دسته‌های batch_size تایی) نوشته و fsync می‌شود و فقط بعد از آن ردیف‌ها تا
+    بزرگ‌ترین id نوشته شده حذف می‌شوند؛ قطع شدن کار در میانه هیچ لاگی را از بین نمی‌برد
+    (در بدترین حالت همان ردیف‌ها در اجرای بعدی دوباره در فایل جدیدی نوشته می‌شوند).
+    خروجی: {'cutoff', 'rows', 'file', 'dry_run', 'elapsed'}
+    """
+    started = time.monotonic()
+    with app.app_context():
+        retention_days = retention_days or app.config.get('AUDIT_LOG_RETENTION_DAYS', 180)
+        batch_size = batch_size or 5000
+        archive_dir = archive_dir or app.config['AUDIT_LOG_ARCHIVE_DIR']
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        report = {'cutoff': cutoff, 'rows': 0, 'file': None, 'dry_run': dry_run}
+
+        if dry_run:
+            report['rows'] = AuditLog.query.filter(AuditLog.timestamp < cutoff).count()
+            report['elapsed'] = time.monotonic() - started
+            return report
+
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, f"audit-{datetime.utcnow():%Y%m%d-%H%M%S}-before-{cutoff:%Y%m%d}.jsonl.gz")
+        partial = path + '.part'
+        columns = [getattr(AuditLog, name) for name in AUDIT_ARCHIVE_COLUMNS]
+
+        last_id = 0
+        with gzip.open(partial, 'wt', encoding='utf-8') as archive:
+            while True:
+                rows = db.session.query(*columns).filter(
+                    AuditLog.timestamp < cutoff, AuditLog.id > last_id
+                ).order_by(AuditLog.id).limit(batch_size).all()
+                if not rows:
+                    break
+                for row in rows:
+                    archive.write(json.dumps({
+                        name: value.isoformat() if isinstance(value, datetime) else value
+                        for name, value in zip(AUDIT_ARCHIVE_COLUMNS, row)
+                    }, ensure_ascii=False) + '\n')
+                last_id = rows[-1].id
+                report['rows'] += len(rows)
+
+        if not report['rows']:
+            os.remove(partial)
+            report['elapsed'] = time.monotonic() - started
+            return report
+
+        with open(partial, 'rb') as archive:
+            os.fsync(archive.fileno())
+        os.replace(partial, path)
+        report['file'] = path
+
+        lower = 0
+        while True:
+            ids = [row[0] for row in db.session.query(AuditLog.id).filter(
+                AuditLog.timestamp < cutoff, AuditLog.id > lower, AuditLog.id <= last_id
+            ).order_by(AuditLog.id).limit(batch_size)]
+            if not ids:
+                break
+            AuditLog.query.filter(AuditLog.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            lower = ids[-1]
+
+        report['elapsed'] = time.monotonic() - started
+        app.logger.info(f"Compacted {report['rows']} audit log entries before {cutoff:%Y-%m-%d} into {path}")
+        return report
+
+def audit_archives(archive_dir, limit=12):
+    """فهرست فایل‌های بایگانی لاگ (جدیدترین اول): [(نام، اندازه به بایت، زمان تغییر)]"""
+    if not os.path.isdir(archive_dir):
+        return []
+    files = [
+        (entry.name, entry.stat().st_size, datetime.utcfromtimestamp(entry.stat().st_mtime))
+        for entry in os.scandir(archive_dir) if entry.name.endswith('.jsonl.gz')
+    ]
+    return sorted(files, key=lambda f: f[2], reverse=True)[:limit]
@@ -0,0 +1,68 @@
+"""
+ماژول کش درون‌پروسسی با زمان انقضا (TTL Cache).
+
+برای خواندن‌های پرهزینه‌ای که کمی قدیمی بودنشان قابل قبول است (مثلاً شمارش تقریبی ردیف‌ها).
+هر پروسس (worker) کش مستقل خودش را دارد؛ کلیدها tuple هستند و عضو اول آن‌ها فضای نام است
+تا بتوان یک گروه از کلیدها را یکجا باطل کرد.
+"""
+
+import threading
+import time
+
+_MISSING = object()
+
+class TTLCache:
+    def __init__(self, ttl=300, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                self._evict()
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def get_or_set(self, key, factory, ttl=None):
+        """مقدار کش شده، یا اجرای factory و ذخیره نتیجه. factory خارج از قفل اجرا می‌شود."""
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            value = factory()
+            self.set(key, value, ttl)
+        return value
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, namespace):
+        """حذف تمام کلیدهای یک فضای نام (عضو اول کلید)."""
+        with self._lock:
+            for key in [k for k in self._data if isinstance(k, tuple) and k and k[0] == namespace]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def _evict(self):
+        # ابتدا ورودی‌های منقضی، در غیر این صورت قدیمی‌ترین ورودی (نزدیک‌ترین انقضا) حذف می‌شود
+        now = time.monotonic()
+        expired = [k for k, (expires_at, _) in self._data.items() if expires_at < now]
+        for key in expired:
+            del self._data[key]
+        if len(self._data) >= self.maxsize:
+            del self._data[min(self._data, key=lambda k: self._data[k][0])]
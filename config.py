@@ -43,6 +43,67 @@ class Config:
     GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
     GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 
+    # تنظیمات موتور توزیع سود (تعداد سرمایه‌گذاری در هر دسته)
+    PROFIT_BATCH_SIZE = int(os.environ.get('PROFIT_BATCH_SIZE') or 500)
+    # اجرای running بدون heartbeat در این مدت (دقیقه) از کار افتاده فرض می‌شود و ادامه داده می‌شود
+    PROFIT_RUN_STALE_MINUTES = int(os.environ.get('PROFIT_RUN_STALE_MINUTES') or 30)
+
+    # بایگانی دفتر کل: ردیف‌های سود قدیمی‌تر از این تعداد روز به جدول بایگانی منتقل می‌شوند
+    LEDGER_ARCHIVE_DAYS = int(os.environ.get('LEDGER_ARCHIVE_DAYS') or 365)
+
+    # شمارش تقریبی ردیف‌های حسابداری (ثانیه؛ 0 = غیرفعال)
+    ACCOUNTING_COUNT_CACHE_SECONDS = int(os.environ.get('ACCOUNTING_COUNT_CACHE_SECONDS') or 300)
+
+    # کش دسترسی نقش‌ها: فاصله بررسی مهر نسخه دسترسی‌ها در دیتابیس (ثانیه)
+    PERMISSIONS_VERSION_CHECK_SECONDS = float(os.environ.get('PERMISSIONS_VERSION_CHECK_SECONDS') or 5)
+
+    # هش رمز عبور در process pool: تعداد پروسس‌ها در هر worker (0 = اجرای مستقیم؛ pool فقط با workerهای
+    # threaded/async کمک می‌کند)، حداکثر عملیات همزمان در هر worker و روی کل میزبان (0 = تعداد هسته‌ها،
+    # با فایل‌های قفل در PASSWORD_HASH_SLOT_DIR) و حداکثر انتظار برای جای خالی (ثانیه).
+    # هش‌های ساخته شده با روش دیگر بعد از ورود دوباره هش می‌شوند.
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD') or 'pbkdf2:sha256'
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS') or 0)
+    PASSWORD_HASH_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_CONCURRENCY') or 0) or None
+    PASSWORD_HASH_HOST_CONCURRENCY = int(os.environ.get('PASSWORD_HASH_HOST_CONCURRENCY') or 0) or None
+    PASSWORD_HASH_SLOT_DIR = os.environ.get('PASSWORD_HASH_SLOT_DIR')
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.environ.get('PASSWORD_HASH_QUEUE_TIMEOUT') or 5)
+
+    # محدودیت تلاش (token bucket): scope -> {'ip' / 'account': (ظرفیت، ثانیه تا پر شدن کامل)}
+    RATE_LIMIT_ENABLED = os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() in ('true', 'on', '1')
+    # backend مشترک اختیاری به صورت 'module:factory' (خالی = حافظه همین پروسس)
+    RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND')
+    RATE_LIMIT_MAX_KEYS = int(os.environ.get('RATE_LIMIT_MAX_KEYS') or 100000)
+    RATE_LIMITS = {
+        'login': {'ip': (20, 300), 'account': (10, 900)},
+        'verify_email': {'ip': (20, 300), 'account': (5, 900)},
+        'verify_2fa': {'ip': (20, 300), 'account': (5, 900)},
+        'withdrawal_code': {'account': (5, 900)},
+    }
+
+    # کش هویت کاربران در user_loader (کاربر و نقش در یک کوئری و snapshot کوتاه‌مدت در کش)
+    # ابطال خودکار فقط برای تغییرات ORM است؛ update/delete دسته‌ای روی users باید identity_cache.invalidate_after_commit را صدا بزنند
+    IDENTITY_CACHE_ENABLED = os.environ.get('IDENTITY_CACHE_ENABLED', 'false').lower() in ('true', 'on', '1')
+    IDENTITY_CACHE_SECONDS = int(os.environ.get('IDENTITY_CACHE_SECONDS') or 30)
+    IDENTITY_CACHE_SIZE = int(os.environ.get('IDENTITY_CACHE_SIZE') or 10000)
+    # backend مشترک اختیاری به صورت 'module:factory' (خالی = کش محلی هر پروسس)
+    IDENTITY_CACHE_BACKEND = os.environ.get('IDENTITY_CACHE_BACKEND')
+
+    # کش شاخص‌های داشبورد ادمین (ثانیه؛ 0 = بدون کش)
+    ADMIN_KPI_CACHE_SECONDS = int(os.environ.get('ADMIN_KPI_CACHE_SECONDS') or 60)
+
+    # لاگ فعالیت‌ها: نوشتن دسته‌ای در thread پس‌زمینه (False = نوشتن همزمان)
+    AUDIT_LOG_ASYNC = os.environ.get('AUDIT_LOG_ASYNC', 'true').lower() in ('true', 'on', '1')
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get('AUDIT_LOG_BATCH_SIZE') or 200)
+    AUDIT_LOG_FLUSH_SECONDS = float(os.environ.get('AUDIT_LOG_FLUSH_SECONDS') or 2)
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE') or 10000)
+    # نگهداری لاگ فعالیت‌ها: ورودی‌های قدیمی‌تر به فایل‌های فشرده منتقل می‌شوند (flask compact-audit-logs)
+    AUDIT_LOG_RETENTION_DAYS = int(os.environ.get('AUDIT_LOG_RETENTION_DAYS') or 180)
+    AUDIT_LOG_ARCHIVE_DIR = os.environ.get('AUDIT_LOG_ARCHIVE_DIR') or os.path.join(basedir, 'logs', 'audit_archive')
+
+    # حذف کاربر در پس‌زمینه: تعداد ردیف‌های هر تراکنش حذف (False = اجرای همزمان در درخواست)
+    USER_DELETION_ASYNC = os.environ.get('USER_DELETION_ASYNC', 'true').lower() in ('true', 'on', '1')
+    USER_DELETION_BATCH_SIZE = int(os.environ.get('USER_DELETION_BATCH_SIZE') or 1000)
+
 class DevelopmentConfig(Config):
     """تنظیمات محیط توسعه"""
     DEBUG = True
@@ -54,8 +115,21 @@ class ProductionConfig(Config):
     SESSION_COOKIE_SECURE = True
     REMEMBER_COOKIE_SECURE = True
 
+class TestingConfig(Config):
+    """تنظیمات اجرای تست‌ها (tests/): دیتابیس جداگانه و اجرای همزمان کارهای پس‌زمینه"""
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or 'sqlite://'
+    WTF_CSRF_ENABLED = False
+    AUDIT_LOG_ASYNC = False
+    USER_DELETION_ASYNC = False
+    PASSWORD_HASH_WORKERS = 0
+    RATE_LIMIT_ENABLED = False
+    ADMIN_KPI_CACHE_SECONDS = 0
+    ACCOUNTING_COUNT_CACHE_SECONDS = 0
+
 config = {
     'development': DevelopmentConfig,
     'production': ProductionConfig,
+    'testing': TestingConfig,
     'default': DevelopmentConfig
 }
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+ماژول داده‌های داشبورد کاربر.
+
+خلاصه داشبورد (سرمایه فعال، موجودی، تعداد و درآمد زیرمجموعه‌ها) در یک رفت و برگشت به دیتابیس
+با چند scalar subquery خوانده می‌شود، بدون بارگذاری اشیای ORM سرمایه‌گذاری‌ها یا زیرمجموعه‌ها.
+نمودار رشد سود با یک کوئری گروه‌بندی شده (به جای یک SUM برای هر روز) محاسبه می‌شود؛
+اندازه سطل‌ها (روز/هفته/ماه) بر اساس بازه انتخابی تعیین می‌شود تا هزینه بازه‌های طولانی
+با بازه‌های کوتاه برابر باشد.
+
+شاخص‌های داشبورد ادمین (admin_kpis) هم با چند کوئری گروه‌بندی شده ساخته می‌شوند و برای مدت کوتاهی
+در کش درون‌پروسسی می‌مانند؛ اقدامات ادمین که این اعداد را تغییر می‌دهند کش را باطل می‌کنند.
+"""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func, select
+from extensions import db
+from models import (
+    User, Investment, InvestmentPlan, Transaction, LedgerSummary, UserBalance, KYCRequest, Ticket, DailyLedgerRollup
+)
+from ledger import get_user_balance, _quantize
+from cache import TTLCache
+
+# فضای نام کلیدهای کش شاخص‌های ادمین
+ADMIN_KPI_NAMESPACE = 'admin_kpis'
+kpi_cache = TTLCache(ttl=60, maxsize=16)
+
+# بازه‌های مجاز نمودار: (تعداد روز، اندازه سطل)
+GROWTH_RANGES = {
+    '7d': (7, 'day'),
+    '30d': (30, 'day'),
+    '90d': (90, 'week'),
+    '1y': (365, 'month'),
+}
+DEFAULT_GROWTH_RANGE = '7d'
+
+def scalar_sum(column, *conditions):
+    return select(func.coalesce(func.sum(column), 0)).where(*conditions).scalar_subquery()
+
+def scalar_count(column, *conditions):
+    return select(func.count(column)).where(*conditions).scalar_subquery()
+
+def dashboard_summary_statement(user_id):
+    """select تک ردیفی خلاصه داشبورد (هر ستون یک scalar subquery روی ایندکس مربوط به خودش)."""
+    return select(
+        scalar_sum(Investment.amount, Investment.user_id == user_id, Investment.status == 'active').label('invested'),
+        select(UserBalance.earnings - UserBalance.pending_withdrawals - UserBalance.completed_withdrawals)
+            .where(UserBalance.user_id == user_id).scalar_subquery().label('balance'),
+        scalar_count(User.id, User.referrer_id == user_id).label('referral_count'),
+        scalar_sum(Transaction.amount, Transaction.user_id == user_id, Transaction.type == 'referral_bonus',
+                   Transaction.status == 'completed').label('referral_live'),
+        # درآمدهای بایگانی شده (ماژول archive)
+        scalar_sum(LedgerSummary.amount, LedgerSummary.user_id == user_id,
+                   LedgerSummary.type == 'referral_bonus').label('referral_archived'),
+    )
+
+def dashboard_summary(user_id):
+    """
+    خلاصه داشبورد کاربر در یک کوئری.
+    خروجی: {'invested', 'balance', 'referral_count', 'referral_earnings'}
+    """
+    row = db.session.execute(dashboard_summary_statement(user_id)).one()
+
+    return {
+        'invested': _quantize(row.invested),
+        # کاربری که هنوز ردیف user_balances ندارد: محاسبه از دفتر کل
+        'balance': _quantize(row.balance) if row.balance is not None else get_user_balance(user_id),
+        'referral_count': row.referral_count,
+        'referral_earnings': _quantize(row.referral_live) + _quantize(row.referral_archived),
+    }
+
+def _add_months(day, months):
+    month_index = day.year * 12 + day.month - 1 + months
+    return day.replace(year=month_index // 12, month=month_index % 12 + 1, day=1)
+
+def _growth_buckets(range_key, today):
+    """لیست سطل‌های نمودار به صورت (روز شروع، برچسب) و تابع نگاشت هر تاریخ به اندیس سطل."""
+    days, bucket = GROWTH_RANGES[range_key]
+
+    if bucket == 'month':
+        first = _add_months(today.replace(day=1), -11)
+        starts = [_add_months(first, i) for i in range(12)]
+        labels = [start.strftime('%b %Y') for start in starts]
+        return starts, labels, lambda d: (d.year - first.year) * 12 + d.month - first.month
+
+    first = today - timedelta(days=days - 1)
+    step = 7 if bucket == 'week' else 1
+    starts = [first + timedelta(days=i) for i in range(0, days, step)]
+    labels = [start.strftime('%d %b') for start in starts]
+    return starts, labels, lambda d: (d - first).days // step
+
+def profit_growth(user_id, range_key=DEFAULT_GROWTH_RANGE, today=None):
+    """
+    سری سود کاربر برای نمودار رشد در بازه انتخابی (7d/30d/90d/1y).
+
+    یک کوئری گروه‌بندی شده بر اساس profit_date روی transactions؛ برای سطل‌های ماهانه،
+    یک کوئری دوم ماه‌های بایگانی شده (ledger_summaries) را هم اضافه می‌کند.
+    خروجی: {'range', 'bucket', 'labels', 'data'}
+    """
+    if range_key not in GROWTH_RANGES:
+        range_key = DEFAULT_GROWTH_RANGE
+    today = today or datetime.utcnow().date()
+    bucket = GROWTH_RANGES[range_key][1]
+    starts, labels, bucket_of = _growth_buckets(range_key, today)
+    totals = [Decimal('0')] * len(starts)
+
+    rows = db.session.query(Transaction.profit_date, func.sum(Transaction.amount)).filter(
+        Transaction.user_id == user_id,
+        Transaction.type == 'profit',
+        Transaction.profit_date >= starts[0],
+        Transaction.profit_date <= today
+    ).group_by(Transaction.profit_date)
+
+    for day, amount in rows:
+        totals[bucket_of(day)] += Decimal(str(amount or 0))
+
+    if bucket == 'month':
+        archived = db.session.query(LedgerSummary.month, func.sum(LedgerSummary.amount)).filter(
+            LedgerSummary.user_id == user_id,
+            LedgerSummary.type == 'profit',
+            LedgerSummary.month >= starts[0]
+        ).group_by(LedgerSummary.month)
+        for month, amount in archived:
+            totals[bucket_of(month)] += Decimal(str(amount or 0))
+
+    return {
+        'range': range_key,
+        'bucket': bucket,
+        'labels': labels,
+        'data': [float(total) for total in totals],
+    }
+
+# --- Admin KPIs ---
+
+def _as_date(value):
+    # func.date در SQLite رشته برمی‌گرداند و در PostgreSQL شیء date
+    return value if not isinstance(value, str) else datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+def compute_admin_kpis(today=None):
+    """
+    شاخص‌های داشبورد ادمین با چهار کوئری (مستقل از تعداد روزها):
+    ثبت‌نام‌های ۷ روز اخیر، شمارنده‌ها و صف‌های در انتظار، سود توزیع شده ۳۰ روز اخیر
+    (از daily_ledger_rollups) و تخصیص سرمایه فعال به تفکیک پلن.
+    """
+    today = today or datetime.utcnow().date()
+
+    registration_days = [today - timedelta(days=i) for i in range(6, -1, -1)]
+    created_day = func.date(User.created_at)
+    registrations = {
+        _as_date(day): count for day, count in db.session.query(created_day, func.count(User.id)).filter(
+            User.created_at >= datetime.combine(registration_days[0], datetime.min.time())
+        ).group_by(created_day)
+    }
+
+    totals = db.session.execute(select(
+        scalar_sum(Investment.amount, Investment.status == 'active').label('aum'),
+        scalar_count(Investment.id, Investment.status == 'active').label('active_investments'),
+        scalar_count(User.id).label('users'),
+        scalar_count(Transaction.id, Transaction.type == 'deposit', Transaction.status == 'pending').label('pending_deposits'),
+        scalar_sum(Transaction.amount, Transaction.type == 'deposit', Transaction.status == 'pending').label('pending_deposit_amount'),
+        scalar_count(Transaction.id, Transaction.type == 'withdrawal', Transaction.status == 'pending').label('pending_withdrawals'),
+        scalar_sum(Transaction.amount, Transaction.type == 'withdrawal', Transaction.status == 'pending').label('pending_withdrawal_amount'),
+        scalar_count(KYCRequest.id, KYCRequest.status == 'pending').label('pending_kyc'),
+        scalar_count(Ticket.id, Ticket.status == 'open').label('open_tickets'),
+    )).one()
+
+    payout_days = [today - timedelta(days=i) for i in range(29, -1, -1)]
+    payouts = {(day, tx_type): float(amount) for day, tx_type, amount in db.session.query(
+        DailyLedgerRollup.day, DailyLedgerRollup.type, DailyLedgerRollup.amount
+    ).filter(DailyLedgerRollup.day >= payout_days[0], DailyLedgerRollup.day <= today)}
+
+    allocation = db.session.query(
+        InvestmentPlan.name, func.count(Investment.id), func.sum(Investment.amount)
+    ).join(Investment, Investment.plan_id == InvestmentPlan.id).filter(
+        Investment.status == 'active'
+    ).group_by(InvestmentPlan.id, InvestmentPlan.name).order_by(func.sum(Investment.amount).desc())
+
+    return {
+        'generated_at': datetime.utcnow().isoformat(),
+        'registrations': {
+            'labels': [d.strftime('%d %b') for d in registration_days],
+            'data': [registrations.get(d, 0) for d in registration_days]
+        },
+        'totals': {
+            'aum': float(_quantize(totals.aum)),
+            'active_investments': totals.active_investments,
+            'users': totals.users,
+        },
+        'pending': {
+            'deposits': totals.pending_deposits,
+            'deposit_amount': float(_quantize(totals.pending_deposit_amount)),
+            'withdrawals': totals.pending_withdrawals,
+            'withdrawal_amount': float(_quantize(totals.pending_withdrawal_amount)),
+            'kyc': totals.pending_kyc,
+            'tickets': totals.open_tickets,
+        },
+        'payouts': {
+            'labels': [d.strftime('%d %b') for d in payout_days],
+            'profit': [payouts.get((d, 'profit'), 0) for d in payout_days],
+            'referral': [payouts.get((d, 'referral_bonus'), 0) for d in payout_days]
+        },
+        'allocation': [
+            {'plan': name, 'investments': count, 'amount': float(_quantize(amount))}
+            for name, count, amount in allocation
+        ],
+    }
+
+def admin_kpis(ttl=None):
+    """شاخص‌های ادمین از کش (ttl=0 یعنی محاسبه مستقیم بدون کش)."""
+    if ttl == 0:
+        return compute_admin_kpis()
+    return kpi_cache.get_or_set((ADMIN_KPI_NAMESPACE,), compute_admin_kpis, ttl)
+
+def invalidate_admin_kpis():
+    """باطل کردن کش شاخص‌های ادمین (بعد از commit اقدامی که آن‌ها را تغییر می‌دهد)."""
+    kpi_cache.invalidate(ADMIN_KPI_NAMESPACE)
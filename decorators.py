@@ -1,6 +1,7 @@
 from functools import wraps
-from flask import abort, flash, redirect, url_for
+from flask import abort, flash, jsonify, redirect, request, url_for
 from flask_login import current_user
+from utils import has_permission
 
 def permission_required(permission_name):
     """
@@ -13,17 +14,14 @@ def permission_required(permission_name):
             if not current_user.is_authenticated:
                 return redirect(url_for('auth.login'))
             
-            # 2. Super Admin always has access
-            if current_user.role and current_user.role.name == 'Admin':
+            # 2. Super Admin always has access, 3. Check specific permission
+            # (compiled per role and cached per process, see utils.role_permissions)
+            if has_permission(permission_name):
                 return f(*args, **kwargs)
-
-            # 3. Check specific permission
-            if current_user.role and current_user.role.permissions:
-                permissions = current_user.role.permissions.split(',')
-                if permission_name in permissions:
-                    return f(*args, **kwargs)
             
-            # 4. Access Denied
+            # 4. Access Denied (API/XHR callers get a JSON error instead of a flash and redirect)
+            if _wants_json():
+                return jsonify(error='You do not have the required permissions to perform this action.'), 403
             flash('You do not have the required permissions to perform this action.', 'danger')
             
             # Redirect logic
@@ -34,6 +32,11 @@ def permission_required(permission_name):
         return decorated_function
     return decorator
 
+def _wants_json():
+    # fetch() sends no X-Requested-With by default, so JSON endpoints are also recognised by their /api/ path
+    return (request.is_json or request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+            or '/api/' in request.path)
+
 def admin_required(f):
     """Shortcut decorator for super admin access only"""
     return permission_required('manage_roles')(f)
\ No newline at end of file
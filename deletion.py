@@ -0,0 +1,193 @@
+"""
+ماژول حذف کاربر در پس‌زمینه (Background User Deletion).
+
+حذف یک کاربر قدیمی (با سال‌ها ردیف سود روزانه) در یک درخواست و یک تراکنش دیتابیس، قفل‌های
+طولانی روی transactions نگه می‌داشت و ممکن بود از timeout ورکر عبور کند. اکنون:
+  1. درخواست ادمین فقط کاربر را pending_deletion می‌کند، سرمایه‌گذاری‌های فعالش را متوقف و
+     زیرمجموعه‌هایش را جدا می‌کند (چند UPDATE کوچک) و یک UserDeletionJob در صف می‌گذارد.
+  2. یک thread پس‌زمینه (یا flask process-user-deletions) داده‌ها را مرحله به مرحله و در دسته‌های
+     USER_DELETION_BATCH_SIZE تایی حذف می‌کند؛ هر دسته همراه با پیشرفت کار در یک تراکنش کوتاه
+     commit می‌شود، بنابراین کار قطع شده از همان مرحله ادامه پیدا می‌کند.
+"""
+
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from extensions import db
+from models import (
+    User, AuditLog, KYCRequest, Ticket, TicketMessage, Transaction, ArchivedTransaction, LedgerSummary,
+    UserBalance, Investment, ReferralBonusDetail, UserDeletionJob
+)
+from ledger import remove_user_from_rollup
+from identity import identity_cache
+
+DEFAULT_DELETION_BATCH_SIZE = 1000
+# کارهای running که این مدت به‌روزرسانی نشده‌اند (پروسس از کار افتاده) دوباره اجرا می‌شوند
+STALE_JOB_MINUTES = 15
+
+def _steps(user_id):
+    """
+    مراحل حذف به ترتیب اجرا: (نام، مدل، شرط). ترتیب به خاطر کلیدهای خارجی مهم است.
+    مرحله rollup قبل از حذف تراکنش‌ها سهم کاربر را از جمع‌های روزانه کم می‌کند.
+    ریز پاداش‌هایی که کاربر در آن‌ها زیرمجموعه است حذف نمی‌شوند (referees): مبلغشان بخشی از تراکنش
+    تجمیعی معرف است، پس فقط ارجاع به کاربر و سرمایه‌گذاری‌اش خالی می‌شود.
+    """
+    user_tx_ids = db.session.query(Transaction.id).filter(Transaction.user_id == user_id)
+    user_ticket_ids = db.session.query(Ticket.id).filter(Ticket.user_id == user_id)
+    return [
+        ('rollup', None, None),
+        ('referral_details', ReferralBonusDetail, ReferralBonusDetail.transaction_id.in_(user_tx_ids)),
+        ('referees', ReferralBonusDetail, ReferralBonusDetail.referee_id == user_id),
+        ('transactions', Transaction, Transaction.user_id == user_id),
+        ('archived_transactions', ArchivedTransaction, ArchivedTransaction.user_id == user_id),
+        ('ledger_summaries', LedgerSummary, LedgerSummary.user_id == user_id),
+        ('balance', UserBalance, UserBalance.user_id == user_id),
+        ('investments', Investment, Investment.user_id == user_id),
+        ('audit_logs', AuditLog, AuditLog.user_id == user_id),
+        ('kyc_requests', KYCRequest, KYCRequest.user_id == user_id),
+        ('ticket_messages', TicketMessage, TicketMessage.ticket_id.in_(user_ticket_ids)),
+        ('tickets', Ticket, Ticket.user_id == user_id),
+        ('user', User, User.id == user_id),
+    ]
+
+def request_user_deletion(user, requested_by=None):
+    """
+    علامت‌گذاری کاربر برای حذف و ساخت کار در صف (commit با فراخوان است).
+    سرمایه‌گذاری‌های فعال از موتور سود خارج می‌شوند و زیرمجموعه‌ها از معرف جدا می‌شوند تا بعد از
+    این لحظه ردیف جدیدی برای کاربر در دفتر کل ثبت نشود.
+    """
+    user.pending_deletion = True
+    Investment.query.filter(
+        Investment.user_id == user.id, Investment.status.in_(['active', 'pending_payment'])
+    ).update({'status': 'closed'}, synchronize_session=False)
+    referee_ids = [row[0] for row in db.session.query(User.id).filter_by(referrer_id=user.id)]
+    if referee_ids:
+        User.query.filter(User.id.in_(referee_ids)).update({'referrer_id': None}, synchronize_session=False)
+        # update دسته‌ای رویداد flush ندارد؛ snapshot زیرمجموعه‌ها در کش هویت دستی باطل می‌شود
+        identity_cache.invalidate_after_commit(*referee_ids)
+
+    job = UserDeletionJob(user_id=user.id, email=user.email, requested_by=requested_by, status='queued')
+    db.session.add(job)
+    db.session.flush()
+    return job
+
+def _delete_chunk(model, condition, batch_size):
+    key = UserBalance.user_id if model is UserBalance else model.id
+    ids = [row[0] for row in db.session.query(key).filter(condition).limit(batch_size)]
+    if ids:
+        model.query.filter(key.in_(ids)).delete(synchronize_session=False)
+        if model is User:
+            identity_cache.invalidate_after_commit(*ids)
+    return len(ids)
+
+def _detach_referee_chunk(condition, batch_size):
+    ids = [row[0] for row in db.session.query(ReferralBonusDetail.id).filter(condition).limit(batch_size)]
+    if ids:
+        ReferralBonusDetail.query.filter(ReferralBonusDetail.id.in_(ids)).update(
+            {'referee_id': None, 'source_investment_id': None}, synchronize_session=False
+        )
+    return len(ids)
+
+def _claim_job(job_id, stale_minutes):
+    """
+    گرفتن کار به صورت اتمیک (یک UPDATE شرطی) تا thread درخواست و flask process-user-deletions
+    هرگز یک کار را همزمان اجرا نکنند (مرحله rollup نباید دو بار کم شود).
+    """
+    now = datetime.utcnow()
+    claimed = UserDeletionJob.query.filter(
+        UserDeletionJob.id == job_id,
+        or_(
+            UserDeletionJob.status.in_(['queued', 'failed']),
+            (UserDeletionJob.status == 'running') & (UserDeletionJob.updated_at < now - timedelta(minutes=stale_minutes))
+        )
+    ).update({'status': 'running', 'error': None, 'updated_at': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+def run_user_deletion(app, job_id, batch_size=None, stale_minutes=STALE_JOB_MINUTES):
+    """اجرای (یا ادامه) یک کار حذف. خروجی: وضعیت نهایی کار (یا None اگر کار در دسترس نبود)."""
+    with app.app_context():
+        batch_size = batch_size or app.config.get('USER_DELETION_BATCH_SIZE', DEFAULT_DELETION_BATCH_SIZE)
+        if not _claim_job(job_id, stale_minutes):
+            return None
+        job = db.session.get(UserDeletionJob, job_id)
+        job.started_at = job.started_at or datetime.utcnow()
+        db.session.commit()
+
+        steps = _steps(job.user_id)
+        names = [name for name, _, _ in steps]
+        if job.step == 'done':
+            start = len(steps)
+        else:
+            start = names.index(job.step) if job.step in names else 0
+
+        try:
+            for index in range(start, len(steps)):
+                name, model, condition = steps[index]
+                next_step = names[index + 1] if index + 1 < len(names) else 'done'
+                while True:
+                    if name == 'rollup':
+                        remove_user_from_rollup(job.user_id)
+                        processed = deleted = 0
+                    elif name == 'referees':
+                        processed, deleted = _detach_referee_chunk(condition, batch_size), 0
+                    else:
+                        processed = deleted = _delete_chunk(model, condition, batch_size)
+                    finished = processed < batch_size
+                    # پیشرفت کار (و رفتن به مرحله بعد) در همان تراکنش دسته حذف ذخیره می‌شود
+                    job.step = next_step if finished else name
+                    job.rows_deleted += deleted
+                    job.updated_at = datetime.utcnow()
+                    db.session.commit()
+                    if finished:
+                        break
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(UserDeletionJob, job_id)
+            job.status = 'failed'
+            job.error = str(e)[:2000]
+            job.updated_at = datetime.utcnow()
+            db.session.commit()
+            app.logger.error(f'User deletion job {job_id} (user {job.user_id}) failed at {job.step}: {e}')
+            return job.status
+
+        job.status = 'completed'
+        job.finished_at = job.updated_at = datetime.utcnow()
+        db.session.commit()
+        app.logger.info(f'User deletion job {job_id}: removed user {job.user_id} ({job.rows_deleted} rows)')
+        return job.status
+
+def start_user_deletion(app, job_id):
+    """اجرای کار حذف در یک thread پس‌زمینه (بعد از commit درخواست)."""
+    if not app.config.get('USER_DELETION_ASYNC', True):
+        return run_user_deletion(app, job_id)
+    thread = threading.Thread(target=run_user_deletion, args=(app, job_id), name=f'user-deletion-{job_id}', daemon=True)
+    thread.start()
+    return 'queued'
+
+def process_user_deletions(app, batch_size=None, stale_minutes=STALE_JOB_MINUTES):
+    """اجرای کارهای صف، شکست خورده یا رها شده (running بدون پیشرفت). خروجی: [(job_id, status)]"""
+    with app.app_context():
+        job_ids = [row[0] for row in db.session.query(UserDeletionJob.id).filter(
+            UserDeletionJob.status != 'completed'
+        ).order_by(UserDeletionJob.id)]
+    results = []
+    for job_id in job_ids:
+        status = run_user_deletion(app, job_id, batch_size, stale_minutes)
+        if status:
+            results.append((job_id, status))
+    return results
+
+def deletion_progress(job):
+    """وضعیت قابل نمایش یک کار حذف (برای API پیشرفت)."""
+    return {
+        'job_id': job.id,
+        'user_id': job.user_id,
+        'email': job.email,
+        'status': job.status,
+        'step': job.step,
+        'rows_deleted': job.rows_deleted,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
@@ -0,0 +1,178 @@
+"""
+ماژول خروجی دفتر کل (Streaming Export).
+
+خروجی کامل صفحه حسابداری (جریان نقدی یا لاگ توزیع سود) با همان فیلترهای صفحه (جستجو، بازه تاریخ،
+کاربر، روز). ردیف‌ها با cursor سمت سرور (yield_per) در دسته‌های ثابت خوانده می‌شوند و هر دسته
+بلافاصله نوشته می‌شود، بنابراین مصرف حافظه به اندازه خروجی بستگی ندارد:
+  - CSV: یک generator که پاسخ HTTP (یا فایل) را تکه تکه تولید می‌کند.
+  - Parquet: هر دسته یک row group از طریق pandas/pyarrow (pyarrow وابستگی اختیاری است).
+
+اجرا: مسیر admin.export_accounting یا flask export-ledger
+"""
+
+import csv
+import io
+from sqlalchemy import literal, select, union_all
+from extensions import db
+from models import User, Transaction, ArchivedTransaction, DailyLedgerRollup
+from ledger import EARNING_TYPES
+from search import transaction_search_condition
+
+EXPORT_FORMATS = ('csv', 'parquet')
+EXPORT_TABS = ('cash_flow', 'profit_logs')
+# تعداد ردیف‌های خوانده شده از cursor در هر دسته
+EXPORT_CHUNK_SIZE = 2000
+CASH_FLOW_TYPES = ('deposit', 'withdrawal')
+# متن‌هایی که با این نویسه‌ها شروع شوند در Excel/LibreOffice فرمول اجرا می‌شوند (CSV injection)
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+# نوع ستون‌ها برای schema فایل Parquet
+_CASH_FLOW_COLUMNS = (
+    ('id', 'int'), ('timestamp', 'datetime'), ('user_id', 'int'), ('email', 'str'), ('type', 'str'),
+    ('amount', 'decimal'), ('status', 'str'), ('tx_hash', 'str'), ('description', 'str'),
+)
+_PROFIT_LOG_COLUMNS = (
+    ('id', 'int'), ('profit_date', 'date'), ('timestamp', 'datetime'), ('user_id', 'int'), ('email', 'str'),
+    ('investment_id', 'int'), ('type', 'str'), ('amount', 'decimal'), ('status', 'str'),
+    ('description', 'str'), ('archived', 'bool'),
+)
+_DAILY_COLUMNS = (
+    ('day', 'date'), ('type', 'str'), ('row_count', 'int'), ('amount', 'decimal'),
+)
+
+def cash_flow_conditions(types=CASH_FLOW_TYPES, search=None, start_date=None, end_date=None):
+    """شرط‌های تب جریان نقدی (مشترک بین صفحه حسابداری و خروجی)."""
+    conditions = [Transaction.type.in_(types)]
+    if search:
+        conditions.append(transaction_search_condition(search))
+    if start_date:
+        conditions.append(Transaction.timestamp >= start_date)
+    if end_date:
+        conditions.append(Transaction.timestamp <= end_date)
+    return conditions
+
+def profit_log_conditions(model=Transaction, user_id=None, day=None, start_date=None, end_date=None):
+    """شرط‌های نمای جزئیات لاگ سود (برای transactions یا transactions_archive)."""
+    conditions = [model.type.in_(EARNING_TYPES)]
+    if user_id:
+        conditions.append(model.user_id == user_id)
+        if start_date:
+            conditions.append(model.timestamp >= start_date)
+        if end_date:
+            conditions.append(model.timestamp <= end_date)
+    elif day:
+        conditions.append(model.profit_date == day)
+    return conditions
+
+def profit_log_query(user_id=None, day=None, start_date=None, end_date=None):
+    """ردیف‌های زنده نمای جزئیات لاگ سود (یک کاربر یا یک روز)، جدیدترین اول."""
+    return Transaction.query.filter(
+        *profit_log_conditions(user_id=user_id, day=day, start_date=start_date, end_date=end_date)
+    ).order_by(Transaction.timestamp.desc())
+
+def export_statement(tab, search=None, start_date=None, end_date=None, user_id=None, day=None, tx_type=None):
+    """
+    کوئری خروجی متناظر با نمای فعلی صفحه حسابداری.
+    خروجی: (select، ستون‌ها به صورت (نام، نوع)، پیشوند نام فایل)
+    """
+    if tab == 'cash_flow':
+        types = [tx_type] if tx_type in CASH_FLOW_TYPES else list(CASH_FLOW_TYPES)
+        stmt = select(
+            Transaction.id, Transaction.timestamp, Transaction.user_id, User.email, Transaction.type,
+            Transaction.amount, Transaction.status, Transaction.tx_hash, Transaction.description
+        ).join(User, Transaction.user_id == User.id).where(
+            *cash_flow_conditions(types, search, start_date, end_date)
+        ).order_by(Transaction.timestamp.desc(), Transaction.id.desc())
+        return stmt, _CASH_FLOW_COLUMNS, 'cash-flow'
+
+    if user_id or day:
+        # نمای جزئیات: ردیف‌های زنده و بایگانی شده با هم
+        def branch(model, archived):
+            return select(
+                model.id, model.profit_date, model.timestamp, model.user_id, User.email, model.investment_id,
+                model.type, model.amount, model.status, model.description, literal(archived).label('archived')
+            ).join(User, model.user_id == User.id).where(
+                *profit_log_conditions(model, user_id, day, start_date, end_date)
+            )
+
+        combined = union_all(branch(Transaction, False), branch(ArchivedTransaction, True)).subquery()
+        stmt = select(combined).order_by(combined.c.profit_date.desc(), combined.c.id.desc())
+        return stmt, _PROFIT_LOG_COLUMNS, f"profit-logs-{'user-' + str(user_id) if user_id else day}"
+
+    # نمای تجمیعی: جمع روزانه (O(روزها))
+    stmt = select(
+        DailyLedgerRollup.day, DailyLedgerRollup.type, DailyLedgerRollup.row_count, DailyLedgerRollup.amount
+    ).where(DailyLedgerRollup.type.in_(EARNING_TYPES))
+    if start_date:
+        stmt = stmt.where(DailyLedgerRollup.day >= start_date.date())
+    if end_date:
+        stmt = stmt.where(DailyLedgerRollup.day <= end_date.date())
+    stmt = stmt.order_by(DailyLedgerRollup.day.desc(), DailyLedgerRollup.type)
+    return stmt, _DAILY_COLUMNS, 'profit-logs-daily'
+
+def iter_chunks(stmt, chunk_size=EXPORT_CHUNK_SIZE):
+    """خواندن نتیجه با cursor سمت سرور در دسته‌های chunk_size تایی."""
+    result = db.session.execute(stmt.execution_options(yield_per=chunk_size))
+    try:
+        for partition in result.partitions():
+            yield partition
+    finally:
+        result.close()
+
+def _csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return int(value)
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        # توضیحات و TxID را کاربر وارد می‌کند؛ با ' به عنوان متن باز می‌شوند (اعداد دست نمی‌خورند)
+        return "'" + value
+    return value
+
+def stream_csv(stmt, columns, chunk_size=EXPORT_CHUNK_SIZE):
+    """Generator متن CSV: سطر عنوان و سپس یک تکه برای هر دسته."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([name for name, _ in columns])
+    yield buffer.getvalue()
+
+    for chunk in iter_chunks(stmt, chunk_size):
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([_csv_value(value) for value in row] for row in chunk)
+        yield buffer.getvalue()
+
+def parquet_available():
+    try:
+        import pyarrow  # noqa: F401
+        import pandas  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+def _arrow_schema(columns):
+    import pyarrow as pa
+
+    types = {
+        'int': pa.int64(), 'str': pa.string(), 'decimal': pa.decimal128(15, 4),
+        'datetime': pa.timestamp('us'), 'date': pa.date32(), 'bool': pa.bool_(),
+    }
+    return pa.schema([(name, types[kind]) for name, kind in columns])
+
+def write_parquet(stmt, columns, fileobj, chunk_size=EXPORT_CHUNK_SIZE):
+    """نوشتن خروجی Parquet در fileobj؛ هر دسته یک row group. خروجی: تعداد ردیف‌ها."""
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(columns)
+    names = [name for name, _ in columns]
+    rows = 0
+    with pq.ParquetWriter(fileobj, schema) as writer:
+        for chunk in iter_chunks(stmt, chunk_size):
+            frame = pd.DataFrame.from_records([tuple(row) for row in chunk], columns=names)
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
@@ -0,0 +1,314 @@
+import os
+import logging
+import click
+import requests
+from logging.handlers import RotatingFileHandler
+from datetime import timedelta
+from flask import Flask, render_template, request, session
+from flask_wtf.csrf import CSRFError
+
+from config import config
+# FIX: Added 'babel' to imports
+from extensions import db, login_manager, mail, csrf, babel, oauth
+from tasks import backfill_profits, backfill_profits_parallel
+from migrations import upgrade_database, check_query_plans
+from ledger import verify_balances, rebuild_daily_rollup
+from archive import archive_ledger
+from search import install_search_index, rebuild_search_index
+from export import EXPORT_FORMATS, EXPORT_TABS, export_statement, parquet_available, stream_csv, write_parquet
+from utils import has_permission
+from audit import audit_writer, compact_audit_logs
+from deletion import process_user_deletions
+from identity import identity_cache
+from passwords import password_hasher
+from ratelimit import rate_limiter
+
+from routes.auth import auth_bp
+from routes.main import main_bp
+from routes.user import user_bp
+from routes.admin import admin_bp
+
+def create_app(config_name='default'):
+    app = Flask(__name__)
+    
+    # Load Config
+    app.config.from_object(config[config_name])
+    app.config['CONFIG_NAME'] = config_name
+    
+    # Init Extensions
+    db.init_app(app)
+    mail.init_app(app)
+    login_manager.init_app(app)
+    csrf.init_app(app)
+    oauth.init_app(app)
+    audit_writer.init_app(app)
+    identity_cache.init_app(app)
+    password_hasher.init_app(app)
+    rate_limiter.init_app(app)
+    
+    # Register Google OAuth
+    oauth.register(
+        name='google',
+        client_id=app.config['GOOGLE_CLIENT_ID'],
+        client_secret=app.config['GOOGLE_CLIENT_SECRET'],
+        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+        client_kwargs={'scope': 'openid email profile'}
+    )
+    
+    # --- Babel Configuration ---
+    def get_locale():
+        # 1. Check URL parameter (Priority 1)
+        lang = request.args.get('lang')
+        if lang in app.config['LANGUAGES']:
+            session['lang'] = lang
+            return lang
+        
+        # 2. Check Session (Priority 2 - Persistence)
+        if session.get('lang'):
+            return session.get('lang')
+
+        # 3. IP Geolocation Check (Priority 3 - For First Time Visitors)
+        # We perform this check only if session is not set to avoid API latency on every request
+        try:
+            # Check Cloudflare Header first (Best for Production)
+            country = request.headers.get('CF-IPCountry')
+            
+            # If not behind Cloudflare, try basic API (with short timeout)
+            if not country:
+                user_ip = request.remote_addr
+                # Skip local development IPs
+                if user_ip not in ['127.0.0.1', 'localhost']:
+                    # Use a free lightweight API with 1s timeout to prevent hanging
+                    response = requests.get('http://ip-api.com/json/{}?fields=countryCode'.format(user_ip), timeout=1)
+                    if response.status_code == 200:
+                        country = response.json().get('countryCode')
+
+            # Logic for Specific Countries
+            if country == 'IR':
+                session['lang'] = 'fa'
+                return 'fa'
+            elif country == 'TR':
+                session['lang'] = 'tr'
+                return 'tr'
+                
+        except Exception:
+            # If API fails or times out, silently fall back to browser
+            pass
+
+        # 4. Check Browser Headers (Priority 4 - Fallback)
+        # This handles cases like VPN users or standard browser preferences
+        best_match = request.accept_languages.best_match(app.config['LANGUAGES'].keys())
+        if best_match:
+            session['lang'] = best_match
+            return best_match
+            
+        # 5. Default
+        return 'en'
+
+    # Initialize Babel
+    babel.init_app(app, locale_selector=get_locale)
+    
+    # Register Blueprints
+    app.register_blueprint(main_bp)
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(user_bp)
+    app.register_blueprint(admin_bp)
+    
+    # Context Processors
+    @app.context_processor
+    def inject_utilities():
+        # Inject get_locale to be used in templates (base.html)
+        return dict(has_permission=has_permission, get_locale=get_locale, languages=app.config.get('LANGUAGES', {}))
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        # کاربر و نقش در یک کوئری، یا از کش هویت (IDENTITY_CACHE_ENABLED)
+        user = identity_cache.load(int(user_id))
+        # نشست‌های باز کاربری که در صف حذف است بلافاصله باطل می‌شوند
+        if user is None or user.pending_deletion:
+            return None
+        return user
+    
+    # Error Handlers
+    @app.errorhandler(404)
+    def page_not_found(e):
+        return render_template('base.html', content="<h3>404 - Page Not Found</h3>"), 404
+
+    @app.errorhandler(CSRFError)
+    def handle_csrf_error(e):
+        return render_template('base.html', content="<h3>Security Error (400)</h3><p>{}</p>".format(e.description)), 400
+
+    @app.errorhandler(500)
+    def internal_server_error(e):
+        app.logger.error('Server Error: {}'.format(e))
+        # Note: Ensure get_locale is available or base.html handles its absence
+        return render_template('base.html', content="<h3>Internal Server Error (500)</h3><p>We are experiencing technical difficulties. Please try again later.</p>"), 500
+
+    # Logging
+    if not app.debug and not app.testing:
+        if not os.path.exists('logs'):
+            os.mkdir('logs')
+        file_handler = RotatingFileHandler('logs/vesthub.log', maxBytes=10240, backupCount=10)
+        file_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s: %(message)s'))
+        file_handler.setLevel(logging.INFO)
+        app.logger.addHandler(file_handler)
+        app.logger.setLevel(logging.INFO)
+        app.logger.info('VestHub startup')
+
+    # Register CLI Commands
+    @app.cli.command('recover-profits')
+    @click.option('--batch-size', type=int, default=None, help='Investments processed per batch.')
+    @click.option('--workers', type=int, default=1, show_default=True, help='Parallel shard processes.')
+    @click.option('--min-id', type=int, default=None, help='Only process investments with id >= MIN_ID.')
+    @click.option('--max-id', type=int, default=None, help='Only process investments with id <= MAX_ID.')
+    @click.option('--fresh', is_flag=True, help="Ignore unfinished runs from today and rescan from the start.")
+    @click.option('--dry-run', is_flag=True, help='Compute payouts in memory and report them without writing.')
+    def recover_profits_command(batch_size, workers, min_id, max_id, fresh, dry_run):
+        """Manually trigger profit backfill and recovery."""
+        print("Starting simulation..." if dry_run else "Starting recovery process...")
+        if workers > 1:
+            report = backfill_profits_parallel(app, workers, batch_size=batch_size, resume=not fresh, simulate=dry_run)
+        else:
+            report = backfill_profits(app, batch_size=batch_size, min_id=min_id, max_id=max_id,
+                                      resume=not fresh, simulate=dry_run)
+            if report['resumed_from']:
+                print(f"Resumed from checkpoint of run #{report['resumed_from']}.")
+        verb = 'would be created' if dry_run else 'created'
+        print(f"{'Simulation' if dry_run else 'Recovery'} finished. Total transactions {verb}: {report['payouts']} "
+              f"(+{report['referral_rows']} referral bonuses) across {report['investments']} investments.")
+        for name, plan in sorted(report['plans'].items()):
+            print(f"  plan {name}: {plan['payouts']} payouts, ${plan['amount']:,.4f}")
+        print(f"  profit total: ${report['profit_amount']:,.4f}, referral total: ${report['referral_amount']:,.4f}")
+        timings = report['timings']
+        print(f"Elapsed: {report['elapsed']:.2f}s ({report['rows_per_second']:.0f} rows/s; load {timings['load']:.2f}s, "
+              f"compute {timings['compute']:.2f}s, write {timings['write']:.2f}s), errors: {len(report['errors'])}")
+        for shard in report.get('shards', []):
+            status = 'FAILED' if shard['errors'] else 'ok'
+            print(f"  shard {shard['shard']} [{shard['min_id'] or 'start'}..{shard['max_id'] or 'end'}]: "
+                  f"{shard['payouts']} payouts, {shard['elapsed']:.2f}s, {status}")
+            if shard['errors']:
+                rerun = 'flask recover-profits'
+                if shard['min_id'] is not None:
+                    rerun += f" --min-id {shard['min_id']}"
+                if shard['max_id'] is not None:
+                    rerun += f" --max-id {shard['max_id']}"
+                print(f"    rerun with: {rerun}")
+        for error in report['errors']:
+            print(f"  ! {error}")
+
+    @app.cli.command('verify-balances')
+    @click.option('--fix', is_flag=True, help='Overwrite drifted balances with values recomputed from the ledger.')
+    def verify_balances_command(fix):
+        """Recompute user balances from the ledger and report drift."""
+        drift = verify_balances(fix=fix)
+        for user_id, stored, expected in drift:
+            print(f"  user {user_id}: stored={stored} ledger={expected}")
+        if fix:
+            db.session.commit()
+        print(f"{len(drift)} drifted balances{' fixed' if fix and drift else ''}.")
+
+    @app.cli.command('archive-ledger')
+    @click.option('--horizon-days', type=int, default=None, help='Archive settled profit rows older than this (default: LEDGER_ARCHIVE_DAYS).')
+    @click.option('--batch-size', type=int, default=None, help='Rows moved per database transaction.')
+    @click.option('--dry-run', is_flag=True, help='Count archivable rows without moving them.')
+    def archive_ledger_command(horizon_days, batch_size, dry_run):
+        """Move settled profit/referral rows into the archive table and roll them up by month."""
+        report = archive_ledger(app, horizon_days=horizon_days, batch_size=batch_size, dry_run=dry_run)
+        print(f"{'[DRY RUN] ' if report['dry_run'] else ''}Rows before {report['cutoff']}: "
+              f"{report['rows']} ({report['amount']} total) in {report['elapsed']:.2f}s")
+        if not report['dry_run']:
+            print(f"Summaries: {report['summaries_created']} created, {report['summaries_updated']} updated.")
+
+    @app.cli.command('compact-audit-logs')
+    @click.option('--retention-days', type=int, default=None, help='Keep this many days in the table (default: AUDIT_LOG_RETENTION_DAYS).')
+    @click.option('--batch-size', type=int, default=None, help='Rows read and deleted per query.')
+    @click.option('--dry-run', is_flag=True, help='Count compactable entries without moving them.')
+    def compact_audit_logs_command(retention_days, batch_size, dry_run):
+        """Move old audit log entries into a gzip-compressed JSON Lines archive file."""
+        report = compact_audit_logs(app, retention_days=retention_days, batch_size=batch_size, dry_run=dry_run)
+        print(f"{'[DRY RUN] ' if report['dry_run'] else ''}Audit entries before {report['cutoff']:%Y-%m-%d}: "
+              f"{report['rows']} in {report['elapsed']:.2f}s")
+        if report['file']:
+            print(f"Archived to {report['file']}")
+
+    @app.cli.command('process-user-deletions')
+    @click.option('--batch-size', type=int, default=None, help='Rows deleted per transaction (default: USER_DELETION_BATCH_SIZE).')
+    def process_user_deletions_command(batch_size):
+        """Run queued, failed or stalled background user deletion jobs."""
+        results = process_user_deletions(app, batch_size=batch_size)
+        for job_id, status in results:
+            print(f'Deletion job #{job_id}: {status}')
+        print(f'{len(results)} deletion job(s) processed.')
+
+    @app.cli.command('rebuild-ledger-rollup')
+    def rebuild_ledger_rollup_command():
+        """Recompute the daily profit/referral rollup from the ledger and archive."""
+        days = rebuild_daily_rollup()
+        db.session.commit()
+        print(f'Daily ledger rollup rebuilt ({days} day/type rows).')
+
+    @app.cli.command('export-ledger')
+    @click.option('--tab', type=click.Choice(EXPORT_TABS), default='cash_flow', help='Accounting view to export.')
+    @click.option('--format', 'export_format', type=click.Choice(EXPORT_FORMATS), default='csv')
+    @click.option('--search', default=None, help='Cash flow search term (email, TxID, description or id).')
+    @click.option('--type', 'tx_type', type=click.Choice(['deposit', 'withdrawal']), default=None)
+    @click.option('--start-date', type=click.DateTime(['%Y-%m-%d']), default=None)
+    @click.option('--end-date', type=click.DateTime(['%Y-%m-%d']), default=None, help='Inclusive.')
+    @click.option('--user-id', type=int, default=None, help='Profit logs of one user (live and archived rows).')
+    @click.option('--date', 'day', type=click.DateTime(['%Y-%m-%d']), default=None, help='Profit logs of one day.')
+    @click.option('--output', '-o', type=click.Path(dir_okay=False, allow_dash=True), default='-', help='Target file (CSV only: - for stdout).')
+    def export_ledger_command(tab, export_format, search, tx_type, start_date, end_date, user_id, day, output):
+        """Stream an accounting view to CSV or Parquet in fixed-size chunks."""
+        if end_date:
+            end_date = end_date + timedelta(hours=23, minutes=59, seconds=59)
+        stmt, columns, _ = export_statement(
+            tab, search=search, start_date=start_date, end_date=end_date,
+            user_id=user_id, day=day.date() if day else None, tx_type=tx_type
+        )
+        if export_format == 'csv':
+            target = click.get_text_stream('stdout') if output == '-' else open(output, 'w', encoding='utf-8', newline='')
+            try:
+                for chunk in stream_csv(stmt, columns):
+                    target.write(chunk)
+            finally:
+                if output != '-':
+                    target.close()
+            return
+        if output == '-':
+            raise click.UsageError('Parquet export needs --output FILE.')
+        if not parquet_available():
+            raise click.ClickException('Parquet export requires pyarrow and pandas. Install them or use --format csv.')
+        rows = write_parquet(stmt, columns, output)
+        print(f'Exported {rows} rows to {output}.')
+
+    @app.cli.command('rebuild-search-index')
+    def rebuild_search_index_command():
+        """Create the search index if missing and reindex users and cash-flow transactions."""
+        install_search_index()
+        rebuild_search_index()
+        db.session.commit()
+        print('Search index rebuilt.')
+
+    @app.cli.command('check-query-plans')
+    def check_query_plans_command():
+        """Assert that ledger hot queries use their declared indexes."""
+        results = check_query_plans(app)
+        for name, index_name, used, plan in results:
+            print(f"[{'ok' if used else 'MISSING'}] {name} -> {index_name}")
+            if not used:
+                print('    ' + plan.replace('\n', '\n    '))
+        missing = sum(1 for result in results if not result[2])
+        print(f"{len(results) - missing}/{len(results)} queries use their index.")
+        if missing:
+            raise SystemExit(1)
+
+    @app.cli.command('upgrade-db')
+    def upgrade_db_command():
+        """Create missing tables and apply pending schema migrations."""
+        applied = upgrade_database(app)
+        for version, description in applied:
+            print(f"Applied migration {version}: {description}")
+        print(f"Database is up to date ({len(applied)} migrations applied).")
+
+
+    return app
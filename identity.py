@@ -0,0 +1,128 @@
+"""
+ماژول کش هویت کاربران (Identity Cache) برای user_loader در Flask-Login.
+
+بدون کش، هر درخواست احراز هویت شده دو کوئری قبل از کد مسیر اجرا می‌کند: خواندن کاربر و بارگذاری
+lazy نقش او. با IDENTITY_CACHE_ENABLED:
+  - loader کاربر و نقش را در یک کوئری (joinedload) می‌خواند،
+  - یک snapshot سبک (ستون‌های کاربر بدون رمز و رازهای 2FA، به همراه ستون‌های نقش) برای
+    IDENTITY_CACHE_SECONDS ثانیه نگه داشته می‌شود و درخواست‌های بعدی بدون کوئری یک شیء User
+    متصل به session (merge با load=False) دریافت می‌کنند؛ تغییرات مسیرها روی آن همچنان ذخیره می‌شوند
+    و دسترسی به ستون‌های حذف شده از snapshot (مثل password) آن‌ها را از دیتابیس بارگذاری می‌کند.
+
+ابطال: هر تغییر ORM روی User (نقش، KYC، 2FA، رمز عبور، علامت حذف، ...) snapshot همان کاربر و هر تغییر
+روی Role کل کش را بعد از flush و commit باطل می‌کند. Query.update()/delete() دسته‌ای این رویدادها را
+ندارند؛ محل فراخوانی آن‌ها روی users باید invalidate_after_commit را صدا بزند. کش محلی مخصوص هر پروسس است (در سایر workerها
+حداکثر تا پایان TTL قدیمی می‌ماند)؛ با IDENTITY_CACHE_BACKEND می‌توان یک backend مشترک (مثلاً Redis)
+با متدهای get/set/delete/clear جایگزین کرد.
+"""
+
+import importlib
+from sqlalchemy import event
+from sqlalchemy.orm import joinedload, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from extensions import db
+from models import User, Role
+from cache import TTLCache
+
+# ستون‌هایی که هرگز در کش نگه داشته نمی‌شوند (در صورت نیاز از دیتابیس بارگذاری می‌شوند)
+IDENTITY_EXCLUDED_COLUMNS = ('password', 'two_factor_secret', 'email_verification_code')
+IDENTITY_KEY_PREFIX = 'identity:'
+
+class IdentityCache:
+    def __init__(self, app=None):
+        self.enabled = False
+        self.ttl = 30
+        self.backend = None
+        self._user_columns = [
+            c.key for c in User.__mapper__.column_attrs if c.key not in IDENTITY_EXCLUDED_COLUMNS
+        ]
+        self._role_columns = [c.key for c in Role.__mapper__.column_attrs]
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('IDENTITY_CACHE_ENABLED', False)
+        self.ttl = app.config.get('IDENTITY_CACHE_SECONDS', self.ttl)
+        backend = app.config.get('IDENTITY_CACHE_BACKEND')
+        if backend:
+            # 'module:factory' -> factory(app) باید شیئی با get/set(key, value, ttl)/delete/clear برگرداند
+            module_name, _, factory = backend.partition(':')
+            self.backend = getattr(importlib.import_module(module_name), factory)(app)
+        else:
+            self.backend = TTLCache(ttl=self.ttl, maxsize=app.config.get('IDENTITY_CACHE_SIZE', 10000))
+
+        if not event.contains(db.session, 'after_flush', self._collect_changes):
+            event.listen(db.session, 'after_flush', self._collect_changes)
+            event.listen(db.session, 'after_commit', self._invalidate_committed)
+
+    def load(self, user_id):
+        """کاربر برای user_loader: از کش، یا یک کوئری همراه با نقش."""
+        if not self.enabled:
+            return db.session.get(User, user_id)
+
+        snapshot = self.backend.get(f'{IDENTITY_KEY_PREFIX}{user_id}')
+        if snapshot is not None:
+            return self._restore(snapshot)
+
+        user = db.session.get(User, user_id, options=[joinedload(User.role)])
+        if user is not None:
+            self.backend.set(f'{IDENTITY_KEY_PREFIX}{user_id}', self._snapshot(user), self.ttl)
+        return user
+
+    def invalidate(self, *user_ids):
+        for user_id in user_ids:
+            self.backend.delete(f'{IDENTITY_KEY_PREFIX}{user_id}')
+
+    def invalidate_after_commit(self, *user_ids):
+        """ابطال کاربرانی که با update/delete دسته‌ای (بدون رویداد flush) تغییر کرده‌اند؛ فوراً و دوباره بعد از commit."""
+        if not self.enabled or not user_ids:
+            return
+        pending = db.session.info.setdefault('identity_invalidations', set())
+        pending.update(user_ids)
+        self.invalidate(*user_ids)
+
+    def clear(self):
+        self.backend.clear()
+
+    def _snapshot(self, user):
+        role = user.role
+        return {
+            'user': {key: getattr(user, key) for key in self._user_columns},
+            'role': {key: getattr(role, key) for key in self._role_columns} if role is not None else None,
+        }
+
+    def _restore(self, snapshot):
+        # شیء detached با کلید هویت؛ merge(load=False) آن را بدون کوئری به session متصل می‌کند
+        user = User(**snapshot['user'])
+        make_transient_to_detached(user)
+        role = None
+        if snapshot['role'] is not None:
+            role = Role(**snapshot['role'])
+            make_transient_to_detached(role)
+        set_committed_value(user, 'role', role)
+        return db.session.merge(user, load=False)
+
+    def _collect_changes(self, session, flush_context):
+        if not self.enabled:
+            return
+        pending = session.info.setdefault('identity_invalidations', set())
+        for obj in list(session.dirty) + list(session.deleted):
+            if isinstance(obj, Role):
+                pending.add(None)
+            elif isinstance(obj, User) and obj.id is not None:
+                pending.add(obj.id)
+        # ابطال فوری (همان پروسس) و دوباره بعد از commit تا درخواست همزمان نسخه قبلی را کش نکند
+        self._apply(pending)
+
+    def _invalidate_committed(self, session):
+        pending = session.info.pop('identity_invalidations', None)
+        if pending:
+            self._apply(pending)
+
+    def _apply(self, pending):
+        if None in pending:
+            self.clear()
+        else:
+            self.invalidate(*pending)
+
+identity_cache = IdentityCache()
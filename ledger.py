@@ -0,0 +1,282 @@
+"""
+ماژول نگهداری موجودی‌های تجمیعی (Materialized Balances).
+
+موجودی قابل برداشت هر کاربر به جای دو SUM روی کل جدول transactions، از جدول user_balances
+خوانده می‌شود. هر کدی که ردیفی به دفتر کل اضافه می‌کند یا وضعیت آن را تغییر می‌دهد باید
+در همان تراکنش دیتابیس (قبل از commit) یکی از توابع این ماژول را صدا بزند.
+
+جمع روزانه سودها (daily_ledger_rollups) هم به همین شکل توسط موتور سود به‌روز می‌شود و
+نمای تجمیعی حسابداری و نمودارهای داشبورد ادمین از آن خوانده می‌شوند.
+"""
+
+from decimal import Decimal
+from sqlalchemy import and_, bindparam, case, func, insert
+from extensions import db
+from models import Transaction, Investment, UserBalance, LedgerSummary, ArchivedTransaction, DailyLedgerRollup
+
+EARNING_TYPES = ('profit', 'referral_bonus')
+BALANCE_COLUMNS = ('earnings', 'pending_withdrawals', 'completed_withdrawals')
+# دقت ستون‌های مبلغ در دفتر کل (Numeric(15, 4))
+AMOUNT_PRECISION = Decimal('0.0001')
+
+def balance_deltas(tx_type, status, amount):
+    """سهم یک ردیف دفتر کل (با نوع و وضعیت مشخص) در ستون‌های موجودی."""
+    if tx_type in EARNING_TYPES and status == 'completed':
+        return {'earnings': amount}
+    if tx_type == 'withdrawal' and status == 'pending':
+        return {'pending_withdrawals': amount}
+    if tx_type == 'withdrawal' and status == 'completed':
+        return {'completed_withdrawals': amount}
+    return {}
+
+def apply_balance_deltas(deltas_by_user):
+    """
+    اعمال تغییرات موجودی برای چند کاربر: {user_id: {'earnings': Decimal, ...}}.
+
+    باید بعد از flush شدن ردیف‌های دفتر کل صدا زده شود. کاربرانی که هنوز ردیفی در
+    user_balances ندارند، ردیفشان از روی دفتر کل (که ردیف‌های جدید را هم شامل می‌شود) ساخته می‌شود.
+    """
+    deltas_by_user = {user_id: d for user_id, d in deltas_by_user.items() if any(d.values())}
+    if not deltas_by_user:
+        return
+
+    existing = {
+        user_id for (user_id,) in db.session.query(UserBalance.user_id).filter(
+            UserBalance.user_id.in_(list(deltas_by_user))
+        )
+    }
+
+    if existing:
+        table = UserBalance.__table__
+        db.session.execute(
+            table.update().where(table.c.user_id == bindparam('uid')).values(
+                **{col: table.c[col] + bindparam(f'd_{col}') for col in BALANCE_COLUMNS},
+                updated_at=func.now()
+            ),
+            [
+                {'uid': user_id, **{f'd_{col}': deltas_by_user[user_id].get(col, Decimal('0')) for col in BALANCE_COLUMNS}}
+                for user_id in existing
+            ]
+        )
+
+    missing = [user_id for user_id in deltas_by_user if user_id not in existing]
+    if missing:
+        computed = compute_balances(missing)
+        db.session.execute(insert(UserBalance), [
+            {'user_id': user_id, **computed.get(user_id, _zero_balance())} for user_id in missing
+        ])
+
+def status_change_deltas(tx, old_status):
+    """تغییر ستون‌های موجودی ناشی از تغییر وضعیت یک تراکنش از old_status به وضعیت فعلی."""
+    before = balance_deltas(tx.type, old_status, tx.amount)
+    after = balance_deltas(tx.type, tx.status, tx.amount)
+    return {col: after.get(col, Decimal('0')) - before.get(col, Decimal('0')) for col in BALANCE_COLUMNS}
+
+def record_status_change(tx, old_status):
+    """به‌روزرسانی موجودی پس از تغییر وضعیت یک تراکنش (مثلاً تایید یا رد برداشت)."""
+    if old_status == tx.status:
+        return
+    apply_balance_deltas({tx.user_id: status_change_deltas(tx, old_status)})
+
+def record_status_changes(changes):
+    """نسخه دسته‌ای record_status_change برای [(tx, old_status), ...] با یک به‌روزرسانی برای همه کاربران."""
+    deltas_by_user = {}
+    for tx, old_status in changes:
+        if old_status == tx.status:
+            continue
+        user_delta = deltas_by_user.setdefault(tx.user_id, {col: Decimal('0') for col in BALANCE_COLUMNS})
+        for col, amount in status_change_deltas(tx, old_status).items():
+            user_delta[col] += amount
+    apply_balance_deltas(deltas_by_user)
+
+def record_new_transaction(tx):
+    """به‌روزرسانی موجودی پس از افزودن یک تراکنش جدید با ORM (تراکنش flush می‌شود)."""
+    db.session.flush()
+    apply_balance_deltas({tx.user_id: balance_deltas(tx.type, tx.status, tx.amount)})
+
+def balance_sums_query(user_ids=None):
+    """جمع ستون‌های موجودی هر کاربر از دفتر کل (بدون خلاصه‌های بایگانی)، گروه‌بندی شده بر اساس user_id."""
+    query = db.session.query(
+        Transaction.user_id,
+        func.sum(case(
+            (and_(Transaction.type.in_(EARNING_TYPES), Transaction.status == 'completed'), Transaction.amount),
+            else_=0
+        )),
+        func.sum(case(
+            (and_(Transaction.type == 'withdrawal', Transaction.status == 'pending'), Transaction.amount),
+            else_=0
+        )),
+        func.sum(case(
+            (and_(Transaction.type == 'withdrawal', Transaction.status == 'completed'), Transaction.amount),
+            else_=0
+        ))
+    )
+    if user_ids is not None:
+        query = query.filter(Transaction.user_id.in_(list(user_ids)))
+    return query.group_by(Transaction.user_id)
+
+def compute_balances(user_ids=None):
+    """محاسبه موجودی‌ها مستقیماً از دفتر کل و خلاصه‌های بایگانی. خروجی: {user_id: {...}}"""
+    balances = {
+        user_id: {col: _quantize(value) for col, value in zip(BALANCE_COLUMNS, sums)}
+        for user_id, *sums in balance_sums_query(user_ids)
+    }
+
+    # ردیف‌های سود بایگانی شده (ماژول archive) فقط به صورت خلاصه ماهانه در دسترس هستند
+    archived = db.session.query(LedgerSummary.user_id, func.sum(LedgerSummary.amount)).filter(
+        LedgerSummary.type.in_(EARNING_TYPES)
+    )
+    if user_ids is not None:
+        archived = archived.filter(LedgerSummary.user_id.in_(list(user_ids)))
+    for user_id, total in archived.group_by(LedgerSummary.user_id):
+        balances.setdefault(user_id, _zero_balance())['earnings'] += _quantize(total)
+
+    return balances
+
+def get_user_balance(user_id):
+    """موجودی قابل برداشت: خواندن با کلید اصلی، یا محاسبه از دفتر کل اگر هنوز ردیفی ساخته نشده باشد."""
+    balance = db.session.get(UserBalance, user_id)
+    if balance is not None:
+        return balance.withdrawable
+    computed = compute_balances([user_id]).get(user_id, _zero_balance())
+    return computed['earnings'] - computed['pending_withdrawals'] - computed['completed_withdrawals']
+
+def verify_balances(fix=False):
+    """
+    مقایسه تمام ردیف‌های user_balances با مقدار محاسبه شده از دفتر کل.
+    خروجی: لیست (user_id, مقدار ذخیره شده, مقدار محاسبه شده) برای ردیف‌های دارای اختلاف.
+    با fix=True ردیف‌های دارای اختلاف یا ناموجود اصلاح می‌شوند (commit با فراخوان است).
+    """
+    computed = compute_balances()
+    stored = {
+        row.user_id: {col: _quantize(getattr(row, col)) for col in BALANCE_COLUMNS}
+        for row in UserBalance.query.all()
+    }
+
+    drift = []
+    for user_id in set(computed) | set(stored):
+        expected = computed.get(user_id, _zero_balance())
+        actual = stored.get(user_id)
+        if actual is None and not any(expected.values()):
+            continue
+        if actual != expected:
+            drift.append((user_id, actual, expected))
+            if fix:
+                if actual is None:
+                    db.session.add(UserBalance(user_id=user_id, **expected))
+                else:
+                    db.session.query(UserBalance).filter_by(user_id=user_id).update(expected)
+    return drift
+
+# --- Admin Review Queues ---
+
+def pending_review_query(tx_type):
+    """صف واریزها یا برداشت‌های در انتظار بررسی ادمین، جدیدترین اول."""
+    return Transaction.query.filter_by(type=tx_type, status='pending').order_by(Transaction.timestamp.desc())
+
+def payment_tx_investments_query(tx_hashes):
+    """سرمایه‌گذاری‌های متناظر با TxID واریزهایی که هنوز به سرمایه‌گذاری لینک نشده‌اند."""
+    return Investment.query.filter(Investment.payment_tx_id.in_(list(tx_hashes))).order_by(Investment.id)
+
+# --- Daily Ledger Rollup ---
+
+def rollup_deltas(rows):
+    """تغییرات جمع روزانه برای ردیف‌های درج شده در دفتر کل: {(day, type): [count, amount]}"""
+    deltas = {}
+    for row in rows:
+        delta = deltas.setdefault((row['profit_date'], row['type']), [0, Decimal('0')])
+        delta[0] += 1
+        delta[1] += row['amount']
+    return deltas
+
+def apply_rollup_deltas(deltas):
+    """
+    اعمال افزایشی تغییرات روی daily_ledger_rollups (upsert). کلیدها مرتب اعمال می‌شوند تا
+    workerهای موازی که روزهای مشترک را به‌روز می‌کنند قفل‌ها را با ترتیب یکسان بگیرند.
+    """
+    rows = [
+        {'day': day, 'type': tx_type, 'row_count': count, 'amount': amount}
+        for (day, tx_type), (count, amount) in sorted(deltas.items()) if day is not None and (count or amount)
+    ]
+    if not rows:
+        return
+
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        if dialect == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        stmt = dialect_insert(DailyLedgerRollup)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['day', 'type'],
+            set_={
+                'row_count': DailyLedgerRollup.row_count + stmt.excluded.row_count,
+                'amount': DailyLedgerRollup.amount + stmt.excluded.amount,
+                'updated_at': func.now(),
+            }
+        )
+        db.session.execute(stmt, rows)
+        return
+
+    # سایر دیتابیس‌ها: خواندن کلیدهای موجود، سپس update و insert جداگانه
+    table = DailyLedgerRollup.__table__
+    existing = {
+        (row.day, row.type) for row in db.session.query(DailyLedgerRollup.day, DailyLedgerRollup.type).filter(
+            DailyLedgerRollup.day.in_({row['day'] for row in rows})
+        )
+    }
+    updates = [row for row in rows if (row['day'], row['type']) in existing]
+    if updates:
+        db.session.execute(
+            table.update().where(and_(table.c.day == bindparam('b_day'), table.c.type == bindparam('b_type'))).values(
+                row_count=table.c.row_count + bindparam('b_count'),
+                amount=table.c.amount + bindparam('b_amount'),
+                updated_at=func.now()
+            ),
+            [{'b_day': r['day'], 'b_type': r['type'], 'b_count': r['row_count'], 'b_amount': r['amount']} for r in updates]
+        )
+    inserts = [row for row in rows if (row['day'], row['type']) not in existing]
+    if inserts:
+        db.session.execute(insert(DailyLedgerRollup), inserts)
+
+def compute_daily_rollup(user_id=None):
+    """جمع روزانه از دفتر کل و جدول بایگانی. خروجی: {(day, type): [count, amount]}"""
+    totals = {}
+    for model in (Transaction, ArchivedTransaction):
+        query = db.session.query(
+            model.profit_date, model.type, func.count(model.id), func.sum(model.amount)
+        ).filter(model.type.in_(EARNING_TYPES), model.profit_date.isnot(None))
+        if user_id is not None:
+            query = query.filter(model.user_id == user_id)
+        for day, tx_type, count, amount in query.group_by(model.profit_date, model.type):
+            total = totals.setdefault((day, tx_type), [0, Decimal('0')])
+            total[0] += count
+            total[1] += _quantize(amount)
+    return totals
+
+def remove_user_from_rollup(user_id):
+    """کسر ردیف‌های درآمد یک کاربر از جمع‌های روزانه (قبل از حذف ردیف‌های او از دفتر کل)."""
+    apply_rollup_deltas({
+        key: (-count, -amount) for key, (count, amount) in compute_daily_rollup(user_id).items()
+    })
+    # روزهایی که دیگر ردیفی ندارند از نمای تجمیعی حذف می‌شوند
+    db.session.query(DailyLedgerRollup).filter(DailyLedgerRollup.row_count <= 0).delete(synchronize_session=False)
+
+def rebuild_daily_rollup():
+    """ساخت دوباره کل daily_ledger_rollups از دفتر کل و بایگانی. خروجی: تعداد ردیف‌ها (commit با فراخوان است)."""
+    totals = compute_daily_rollup()
+    db.session.query(DailyLedgerRollup).delete()
+    if totals:
+        db.session.execute(insert(DailyLedgerRollup), [
+            {'day': day, 'type': tx_type, 'row_count': count, 'amount': amount}
+            for (day, tx_type), (count, amount) in sorted(totals.items())
+        ])
+    return len(totals)
+
+def _quantize(value):
+    # SQLite مجموع ستون‌های Numeric را به صورت float برمی‌گرداند
+    return Decimal(str(value or 0)).quantize(AMOUNT_PRECISION)
+
+def _zero_balance():
+    return {col: Decimal('0') for col in BALANCE_COLUMNS}
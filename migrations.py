@@ -0,0 +1,333 @@
+"""
+ماژول مهاجرت‌های دیتابیس (Schema Migrations).
+
+db.create_all فقط جداول جدید را می‌سازد و ستون یا ایندکس جدید را به جداول موجود اضافه نمی‌کند.
+این ماژول لیستی مرتب از مهاجرت‌ها را نگهداری می‌کند و نسخه فعلی طرح دیتابیس را
+در جدول system_settings (کلید schema_version) ذخیره می‌کند. تمام مهاجرت‌ها idempotent هستند
+تا روی دیتابیس تازه (ساخته شده با create_all) هم بدون خطا اجرا شوند.
+
+اجرا: flask upgrade-db
+"""
+
+from sqlalchemy import inspect, text, update, func
+from extensions import db
+
+SCHEMA_VERSION_KEY = 'schema_version'
+
+# --- Helpers ---
+
+def _column_exists(table_name, column_name):
+    columns = inspect(db.session.connection()).get_columns(table_name)
+    return any(col['name'] == column_name for col in columns)
+
+def _add_column(table_name, column_name, ddl_type):
+    if not _column_exists(table_name, column_name):
+        db.session.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {ddl_type}'))
+
+def _drop_not_null(model, *column_names):
+    """حذف قید NOT NULL از ستون‌های یک جدول موجود (مطابق تعریف فعلی مدل)."""
+    table_name = model.__tablename__
+    columns = {col['name']: col for col in inspect(db.session.connection()).get_columns(table_name)}
+    pending = [name for name in column_names if not columns[name]['nullable']]
+    if not pending:
+        return
+    if db.session.get_bind().dialect.name != 'sqlite':
+        for name in pending:
+            db.session.execute(text(f'ALTER TABLE {table_name} ALTER COLUMN {name} DROP NOT NULL'))
+        return
+
+    # SQLite قید ستون را تغییر نمی‌دهد: جدول با تعریف مدل دوباره ساخته و داده‌ها کپی می‌شوند
+    connection = db.session.connection()
+    names = ', '.join(columns)
+    db.session.execute(text(f'ALTER TABLE {table_name} RENAME TO {table_name}_old'))
+    for index in model.__table__.indexes:
+        db.session.execute(text(f'DROP INDEX IF EXISTS {index.name}'))
+    model.__table__.create(connection)
+    db.session.execute(text(f'INSERT INTO {table_name} ({names}) SELECT {names} FROM {table_name}_old'))
+    db.session.execute(text(f'DROP TABLE {table_name}_old'))
+
+def _create_model_index(model, index_name):
+    """ایجاد ایندکس تعریف شده در مدل (در صورت عدم وجود)."""
+    for index in model.__table__.indexes:
+        if index.name == index_name:
+            index.create(db.session.connection(), checkfirst=True)
+            return
+    raise ValueError(f'Index {index_name} is not declared on {model.__tablename__}')
+
+# --- Migrations ---
+
+def _add_transaction_profit_date(app):
+    """افزودن ستون profit_date به تراکنش‌ها، پر کردن آن از timestamp و ساخت ایندکس یکتا."""
+    from models import Transaction
+
+    _add_column('transactions', 'profit_date', 'DATE')
+
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.type.in_(['profit', 'referral_bonus']), Transaction.profit_date.is_(None))
+        .values(profit_date=func.date(Transaction.timestamp))
+        .execution_options(synchronize_session=False)
+    )
+
+    # سودهای تکراری قدیمی (یک روز، یک سرمایه‌گذاری) مانع ساخت ایندکس یکتا می‌شوند؛
+    # قدیمی‌ترین ردیف تاریخ را نگه می‌دارد و بقیه بدون profit_date باقی می‌مانند.
+    keepers = db.session.query(func.min(Transaction.id)).filter(
+        Transaction.investment_id.isnot(None),
+        Transaction.profit_date.isnot(None)
+    ).group_by(Transaction.investment_id, Transaction.profit_date)
+
+    duplicates = db.session.execute(
+        update(Transaction)
+        .where(
+            Transaction.investment_id.isnot(None),
+            Transaction.profit_date.isnot(None),
+            Transaction.id.notin_(keepers.scalar_subquery())
+        )
+        .values(profit_date=None)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if duplicates:
+        app.logger.warning(f'{duplicates} duplicate profit rows left without profit_date')
+
+    _create_model_index(Transaction, 'uq_transactions_investment_profit_date')
+
+def _backfill_user_balances(app):
+    """ساخت ردیف user_balances برای کاربرانی که هنوز ردیف ندارند، از روی دفتر کل."""
+    from models import UserBalance
+    from ledger import compute_balances
+
+    existing = {user_id for (user_id,) in db.session.query(UserBalance.user_id)}
+    rows = [
+        UserBalance(user_id=user_id, **balance)
+        for user_id, balance in compute_balances().items() if user_id not in existing
+    ]
+    db.session.add_all(rows)
+    app.logger.info(f'Backfilled {len(rows)} user balances')
+
+def _add_ledger_indexes(app):
+    """ایندکس‌های ترکیبی کوئری‌های پرتکرار دفتر کل و سرمایه‌گذاری‌ها."""
+    from models import Transaction, Investment
+
+    for name in ('ix_transactions_user_type_status', 'ix_transactions_type_status_timestamp',
+                 'ix_transactions_type_profit_date'):
+        _create_model_index(Transaction, name)
+    for name in ('ix_investments_status_id', 'ix_investments_payment_tx_id'):
+        _create_model_index(Investment, name)
+
+def _add_dashboard_indexes(app):
+    """ایندکس‌های خلاصه داشبورد کاربر (تعداد زیرمجموعه‌ها و جمع سرمایه فعال)."""
+    from models import User, Investment
+
+    _create_model_index(User, 'ix_users_referrer_id')
+    _create_model_index(Investment, 'ix_investments_user_status')
+
+def _install_search_index(app):
+    """ایندکس جستجوی زیررشته برای کاربران و تراکنش‌های جریان نقدی (FTS5 / pg_trgm)."""
+    from search import install_search_index
+
+    install_search_index()
+
+def _build_daily_rollup(app):
+    """پر کردن جدول جمع روزانه سودها (daily_ledger_rollups) از دفتر کل و بایگانی."""
+    from ledger import rebuild_daily_rollup
+
+    rebuild_daily_rollup()
+
+def _add_audit_log_indexes(app):
+    """ایندکس‌های مرور و فیلتر لاگ فعالیت‌ها (زمان، کاربر، اقدام، IP)."""
+    from models import AuditLog
+
+    for index_name in ('ix_audit_logs_timestamp_id', 'ix_audit_logs_user_timestamp',
+                       'ix_audit_logs_action_timestamp', 'ix_audit_logs_ip_timestamp'):
+        _create_model_index(AuditLog, index_name)
+
+def _add_user_pending_deletion(app):
+    """ستون users.pending_deletion برای حذف کاربر در پس‌زمینه."""
+    _add_column('users', 'pending_deletion', 'BOOLEAN NOT NULL DEFAULT FALSE')
+
+def _add_profit_run_heartbeat(app):
+    """ستون profit_runs.heartbeat_at برای تشخیص اجرای زنده از اجرای رها شده."""
+    _add_column('profit_runs', 'heartbeat_at', 'TIMESTAMP')
+
+def _add_user_search_trgm_indexes(app):
+    """ایندکس‌های trigram برای users.phone و users.referral_code در PostgreSQL (ستون‌های جستجوی کاربر)."""
+    from search import install_search_index
+
+    install_search_index()
+
+def _make_referral_detail_referee_nullable(app):
+    """referee_id و source_investment_id ریز پاداش‌ها nullable می‌شوند (ردیف‌های زیرمجموعه حذف شده)."""
+    from models import ReferralBonusDetail
+
+    _drop_not_null(ReferralBonusDetail, 'referee_id', 'source_investment_id')
+
+def _add_aggregated_referral_index(app):
+    """
+    ستون transactions.aggregated و ایندکس یکتای جزئی (user_id, profit_date) ردیف‌های تجمیعی پاداش معرف.
+    ردیف‌های تجمیعی موجود از روی توضیحشان علامت می‌خورند و ردیف‌های تکراری یک (معرف، روز) در
+    قدیمی‌ترین ردیف ادغام می‌شوند (ریز پاداش‌ها به آن منتقل و مبلغ‌ها جمع می‌شوند).
+    """
+    from models import Transaction, ReferralBonusDetail
+    from tasks import AGGREGATED_REFERRAL_DESCRIPTION
+    from ledger import rebuild_daily_rollup
+
+    _add_column('transactions', 'aggregated', 'BOOLEAN NOT NULL DEFAULT FALSE')
+    db.session.execute(
+        update(Transaction)
+        .where(Transaction.type == 'referral_bonus', Transaction.investment_id.is_(None),
+               Transaction.description.like(AGGREGATED_REFERRAL_DESCRIPTION.format(day='%')))
+        .values(aggregated=True)
+        .execution_options(synchronize_session=False)
+    )
+
+    groups = db.session.query(
+        Transaction.user_id, Transaction.profit_date, func.min(Transaction.id), func.sum(Transaction.amount)
+    ).filter(Transaction.type == 'referral_bonus', Transaction.aggregated.is_(True)).group_by(
+        Transaction.user_id, Transaction.profit_date
+    ).having(func.count(Transaction.id) > 1).all()
+    for user_id, day, keeper_id, amount in groups:
+        duplicate_ids = [row_id for (row_id,) in db.session.query(Transaction.id).filter(
+            Transaction.type == 'referral_bonus', Transaction.aggregated.is_(True),
+            Transaction.user_id == user_id, Transaction.profit_date == day, Transaction.id != keeper_id
+        )]
+        db.session.execute(
+            update(ReferralBonusDetail).where(ReferralBonusDetail.transaction_id.in_(duplicate_ids))
+            .values(transaction_id=keeper_id).execution_options(synchronize_session=False)
+        )
+        Transaction.query.filter(Transaction.id.in_(duplicate_ids)).delete(synchronize_session=False)
+        Transaction.query.filter_by(id=keeper_id).update({'amount': amount}, synchronize_session=False)
+    if groups:
+        # مجموع مبالغ ثابت است ولی تعداد ردیف‌های روزهای ادغام شده در rollup تغییر می‌کند
+        rebuild_daily_rollup()
+        app.logger.warning(f'Merged duplicate aggregated referral rows for {len(groups)} referrer-days')
+
+    _create_model_index(Transaction, 'uq_transactions_aggregated_referral')
+
+def _index_user_full_name(app):
+    """جدول FTS کاربران در SQLite با ستون full_name دوباره ساخته می‌شود (جستجوی عبارت‌های شامل نام و نام خانوادگی)."""
+    from search import drop_user_search_index, install_search_index
+
+    drop_user_search_index()
+    install_search_index()
+
+MIGRATIONS = [
+    (1, 'Add transactions.profit_date and unique (investment_id, profit_date) index', _add_transaction_profit_date),
+    (2, 'Backfill materialized user_balances from the ledger', _backfill_user_balances),
+    (3, 'Add composite indexes for ledger hot queries', _add_ledger_indexes),
+    (4, 'Add indexes for the user dashboard summary', _add_dashboard_indexes),
+    (5, 'Install full-text search index for users and cash-flow transactions', _install_search_index),
+    (6, 'Build the daily ledger rollup from the ledger and archive', _build_daily_rollup),
+    (7, 'Add indexes for the audit log viewer', _add_audit_log_indexes),
+    (8, 'Add users.pending_deletion for background user deletion', _add_user_pending_deletion),
+    (9, 'Add profit_runs.heartbeat_at for stale run detection', _add_profit_run_heartbeat),
+    (10, 'Add trigram search indexes for users.phone and users.referral_code', _add_user_search_trgm_indexes),
+    (11, 'Keep referral bonus details of deleted referees with a nulled referee', _make_referral_detail_referee_nullable),
+    (12, 'Add a unique index on aggregated referral bonus rows', _add_aggregated_referral_index),
+    (13, 'Index the full user name in the SQLite search index', _index_user_full_name),
+]
+
+def get_schema_version():
+    from models import SystemSetting
+    setting = db.session.get(SystemSetting, SCHEMA_VERSION_KEY)
+    return int(setting.value) if setting else 0
+
+def upgrade_database(app):
+    """ساخت جداول جدید و اجرای مهاجرت‌های اجرا نشده به ترتیب. خروجی: لیست مهاجرت‌های اعمال شده."""
+    from models import SystemSetting
+
+    with app.app_context():
+        db.create_all()
+        current = get_schema_version()
+        applied = []
+
+        for version, description, migrate in MIGRATIONS:
+            if version <= current:
+                continue
+            try:
+                migrate(app)
+                setting = db.session.get(SystemSetting, SCHEMA_VERSION_KEY)
+                if not setting:
+                    setting = SystemSetting(key=SCHEMA_VERSION_KEY)
+                    db.session.add(setting)
+                setting.value = str(version)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                app.logger.error(f'Migration {version} failed: {description}')
+                raise
+            app.logger.info(f'Applied migration {version}: {description}')
+            applied.append((version, description))
+
+        return applied
+
+# --- Query Plan Checks ---
+
+def _hot_queries():
+    """
+    کوئری‌های پرتکرار به همراه ایندکسی که انتظار می‌رود planner از آن استفاده کند.
+    هر مورد همان سازنده‌ای را صدا می‌زند که کد اصلی اجرا می‌کند (با پارامترهای نمونه).
+    """
+    from datetime import date
+    from models import AuditLog
+    from ledger import balance_sums_query, pending_review_query, payment_tx_investments_query
+    from export import profit_log_query
+    from dashboard import dashboard_summary_statement
+    from tasks import _active_chunk_query, _paid_days_query
+    from audit import audit_log_query
+    from utils import keyset_page_query
+
+    summary = dashboard_summary_statement(1)
+    audit_order = (AuditLog.timestamp, AuditLog.id)
+    return [
+        ('get_user_balance fallback', 'ix_transactions_user_type_status', balance_sums_query([1])),
+        ('dashboard referral earnings', 'ix_transactions_user_type_status', summary),
+        ('dashboard invested total', 'ix_investments_user_status', summary),
+        ('dashboard referral count', 'ix_users_referrer_id', summary),
+        ('admin.payments queue', 'ix_transactions_type_status_timestamp', pending_review_query('deposit')),
+        ('admin.withdrawals queue', 'ix_transactions_type_status_timestamp', pending_review_query('withdrawal')),
+        ('payment TxID fallback', 'ix_investments_payment_tx_id', payment_tx_investments_query(['TX'])),
+        ('accounting profit logs by user', 'ix_transactions_user_type_status', profit_log_query(user_id=1)),
+        ('accounting profit logs by day', 'ix_transactions_type_profit_date', profit_log_query(day=date(2020, 1, 1))),
+        ('profit engine paid-days check', 'uq_transactions_investment_profit_date',
+         _paid_days_query([1, 2, 3], date(2020, 1, 1))),
+        ('profit engine active chunk', 'ix_investments_status_id', _active_chunk_query(0, None, 500)),
+        ('admin.logs browse', 'ix_audit_logs_timestamp_id', keyset_page_query(audit_log_query(), audit_order)),
+        ('admin.logs by user', 'ix_audit_logs_user_timestamp',
+         keyset_page_query(audit_log_query(user_id=1), audit_order)),
+        ('admin.logs by action', 'ix_audit_logs_action_timestamp',
+         keyset_page_query(audit_log_query(action='Login'), audit_order)),
+        ('admin.logs by IP', 'ix_audit_logs_ip_timestamp',
+         keyset_page_query(audit_log_query(ip='127.0.0.1'), audit_order)),
+    ]
+
+def explain(query):
+    """متن query plan یک Query یا select در دیتابیس فعلی (SQLite یا PostgreSQL)."""
+    connection = db.session.connection()
+    dialect = connection.dialect
+    statement = getattr(query, 'statement', query)
+    compiled = statement.compile(dialect=dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+
+    if dialect.name == 'sqlite':
+        rows = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}', params).fetchall()
+        return '\n'.join(str(row[-1]) for row in rows)
+
+    # روی جداول کوچک، PostgreSQL اسکن ترتیبی را ترجیح می‌دهد؛ برای بررسی آن را غیرفعال می‌کنیم
+    connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+    rows = connection.exec_driver_sql(f'EXPLAIN {compiled}', params).fetchall()
+    return '\n'.join(str(row[0]) for row in rows)
+
+def check_query_plans(app):
+    """
+    بررسی اینکه کوئری‌های پرتکرار واقعاً از ایندکس مورد انتظار استفاده می‌کنند.
+    خروجی: لیست (نام کوئری، ایندکس مورد انتظار، استفاده شده؟، query plan).
+    """
+    with app.app_context():
+        results = []
+        for name, index_name, query in _hot_queries():
+            plan = explain(query)
+            results.append((name, index_name, index_name in plan, plan))
+        db.session.rollback()
+        return results
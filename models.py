@@ -9,6 +9,9 @@ from datetime import datetime
 from flask_login import UserMixin
 from extensions import db
 
+# شرط ایندکس یکتای جزئی ردیف‌های تجمیعی پاداش معرف (در ON CONFLICT موتور سود هم عیناً تکرار می‌شود)
+AGGREGATED_REFERRAL_WHERE = "type = 'referral_bonus' AND aggregated"
+
 class SystemSetting(db.Model):
     """مدل برای ذخیره تنظیمات کلی سیستم به صورت زوج‌های کلید-مقدار."""
     __tablename__ = 'system_settings'
@@ -48,12 +51,14 @@ class User(UserMixin, db.Model):
     wallet_address = db.Column(db.String(200))
     referral_code = db.Column(db.String(20), unique=True)
     # کلید خارجی برای ارتباط با معرف (خود جدول کاربران)
-    referrer_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    referrer_id = db.Column(db.Integer, db.ForeignKey('users.id'), index=True)
     is_email_verified = db.Column(db.Boolean, default=False)
     email_verification_code = db.Column(db.String(6))
     is_2fa_enabled = db.Column(db.Boolean, default=False)
     two_factor_secret = db.Column(db.String(32))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # حذف در صف (ماژول deletion): کاربر دیگر نمی‌تواند وارد شود و داده‌هایش در پس‌زمینه حذف می‌شوند
+    pending_deletion = db.Column(db.Boolean, nullable=False, default=False)
 
     # تعریف روابط (Relationships)
     referrals = db.relationship('User', backref=db.backref('referrer', remote_side=[id]), lazy=True)
@@ -63,6 +68,11 @@ class User(UserMixin, db.Model):
     kyc_requests = db.relationship('KYCRequest', backref='user', lazy=True)
     logs = db.relationship('AuditLog', backref='user', lazy=True)
 
+    @property
+    def is_active(self):
+        # Flask-Login ورود کاربر غیرفعال را رد می‌کند (login_user خروجی False می‌دهد)
+        return not self.pending_deletion
+
 # ==========================================
 # 4. Investment Plans
 # ==========================================
@@ -101,6 +111,15 @@ class Investment(db.Model):
     payment_tx_id = db.Column(db.String(100))
     last_profit_date = db.Column(db.Date)
 
+    __table_args__ = (
+        # پیمایش دسته‌ای سرمایه‌گذاری‌های فعال در موتور سود (status = 'active' AND id > ?)
+        db.Index('ix_investments_status_id', 'status', 'id'),
+        # جستجوی سرمایه‌گذاری بر اساس TxID پرداخت هنگام تایید واریز
+        db.Index('ix_investments_payment_tx_id', 'payment_tx_id'),
+        # جمع سرمایه فعال هر کاربر در داشبورد (covering index)
+        db.Index('ix_investments_user_status', 'user_id', 'status', 'amount'),
+    )
+
 # ==========================================
 # 6. Transactions (Ledger)
 # ==========================================
@@ -121,6 +140,26 @@ class Transaction(db.Model):
     status = db.Column(db.String(20), default='pending')
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     tx_hash = db.Column(db.String(100))
+    # تاریخ تعلق سود (فقط برای ردیف‌های profit و referral_bonus)
+    profit_date = db.Column(db.Date)
+    # ردیف تجمیعی پاداش معرف (یک ردیف برای هر معرف در هر روز، با ریز پاداش در referral_bonus_details)
+    aggregated = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+
+    __table_args__ = (
+        # تضمین یکتایی سود روزانه هر سرمایه‌گذاری (ردیف‌های بدون investment_id شامل نمی‌شوند)؛
+        # همچنین جستجوهای investment_id و بررسی روزهای پرداخت شده از همین ایندکس استفاده می‌کنند
+        db.Index('uq_transactions_investment_profit_date', 'investment_id', 'profit_date', unique=True),
+        # حداکثر یک ردیف تجمیعی پاداش برای هر (معرف، روز)؛ هدف ON CONFLICT موتور سود
+        db.Index('uq_transactions_aggregated_referral', 'user_id', 'profit_date', unique=True,
+                 postgresql_where=db.text(AGGREGATED_REFERRAL_WHERE),
+                 sqlite_where=db.text(AGGREGATED_REFERRAL_WHERE)),
+        # جمع‌های هر کاربر (موجودی، درآمد معرف، تاریخچه برداشت) - amount برای covering index
+        db.Index('ix_transactions_user_type_status', 'user_id', 'type', 'status', 'amount'),
+        # صف‌های واریز/برداشت ادمین و تب جریان نقدی حسابداری (مرتب شده بر اساس زمان)
+        db.Index('ix_transactions_type_status_timestamp', 'type', 'status', 'timestamp'),
+        # نمای تجمیعی روزانه سودها در حسابداری
+        db.Index('ix_transactions_type_profit_date', 'type', 'profit_date', 'amount'),
+    )
 
 # ==========================================
 # 7. Tickets & Messages
@@ -172,4 +211,184 @@ class AuditLog(db.Model):
     action = db.Column(db.String(100), nullable=False)
     details = db.Column(db.String(500))
     ip_address = db.Column(db.String(50))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
\ No newline at end of file
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # مرور صفحه‌بندی شده لاگ‌ها (keyset روی timestamp, id) با و بدون فیلتر کاربر/اقدام/IP
+        db.Index('ix_audit_logs_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_user_timestamp', 'user_id', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_action_timestamp', 'action', 'timestamp', 'id'),
+        db.Index('ix_audit_logs_ip_timestamp', 'ip_address', 'timestamp', 'id'),
+    )
+
+# ==========================================
+# 10. Profit Run Journal
+# ==========================================
+class ProfitRun(db.Model):
+    """مدل برای ثبت هر اجرای موتور توزیع سود (ژورنال اجرا و نقطه بازیابی/checkpoint)."""
+    __tablename__ = 'profit_runs'
+    id = db.Column(db.Integer, primary_key=True)
+    run_date = db.Column(db.Date, nullable=False)  # روزی که سودها تا آن محاسبه می‌شوند
+    status = db.Column(db.String(20), default='running')  # running, completed, failed, resumed
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
+    # با commit هر دسته به‌روز می‌شود؛ اجرای running بدون heartbeat تازه از کار افتاده فرض می‌شود
+    heartbeat_at = db.Column(db.DateTime)
+    # بازه شناسه سرمایه‌گذاری‌ها (None یعنی بدون محدودیت) و شماره shard در اجرای موازی
+    min_investment_id = db.Column(db.Integer)
+    max_investment_id = db.Column(db.Integer)
+    shard = db.Column(db.Integer)
+    resumed_from_id = db.Column(db.Integer, db.ForeignKey('profit_runs.id'))
+    # تمام سرمایه‌گذاری‌های با id کوچکتر یا مساوی این مقدار با موفقیت پردازش شده‌اند
+    last_investment_id = db.Column(db.Integer)
+    investments_processed = db.Column(db.Integer, default=0)
+    payouts = db.Column(db.Integer, default=0)
+    referral_rows = db.Column(db.Integer, default=0)
+    error_count = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+
+    @property
+    def rows_written(self):
+        return (self.payouts or 0) + (self.referral_rows or 0)
+
+    @property
+    def duration_seconds(self):
+        if not self.started_at:
+            return 0.0
+        return ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+
+    @property
+    def rows_per_second(self):
+        duration = self.duration_seconds
+        return self.rows_written / duration if duration else 0.0
+
+# ==========================================
+# 11. Aggregated Referral Bonus Breakdown
+# ==========================================
+class ReferralBonusDetail(db.Model):
+    """مدل برای ریز پاداش‌های معرف که در حالت تجمیعی در یک تراکنش روزانه ثبت شده‌اند."""
+    __tablename__ = 'referral_bonus_details'
+    id = db.Column(db.Integer, primary_key=True)
+    # تراکنش تجمیعی referral_bonus معرف برای این روز
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transactions.id'), nullable=False, index=True)
+    # بعد از حذف زیرمجموعه خالی می‌شوند؛ ردیف باقی می‌ماند تا جمع ریز پاداش‌ها با تراکنش تجمیعی برابر بماند
+    source_investment_id = db.Column(db.Integer, db.ForeignKey('investments.id'), nullable=True)
+    referee_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    profit_date = db.Column(db.Date, nullable=False)
+    amount = db.Column(db.Numeric(15, 4), nullable=False)
+
+    transaction = db.relationship('Transaction', backref=db.backref('referral_details', lazy=True))
+
+    __table_args__ = (
+        # هر سرمایه‌گذاری در هر روز فقط یک پاداش معرف ایجاد می‌کند
+        db.Index('uq_referral_details_investment_date', 'source_investment_id', 'profit_date', unique=True),
+    )
+
+# ==========================================
+# 12. Materialized User Balances
+# ==========================================
+class UserBalance(db.Model):
+    """
+    مدل برای نگهداری موجودی تجمیعی هر کاربر.
+    این جدول در همان تراکنشِ هر ثبت یا تغییر وضعیت در دفتر کل به‌روزرسانی می‌شود (ماژول ledger).
+    """
+    __tablename__ = 'user_balances'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    earnings = db.Column(db.Numeric(15, 4), nullable=False, default=0)  # سود و پاداش معرف تکمیل شده
+    pending_withdrawals = db.Column(db.Numeric(15, 4), nullable=False, default=0)
+    completed_withdrawals = db.Column(db.Numeric(15, 4), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    @property
+    def withdrawable(self):
+        return self.earnings - self.pending_withdrawals - self.completed_withdrawals
+
+# ==========================================
+# 13. Ledger Archive (Cold Partition)
+# ==========================================
+class ArchivedTransaction(db.Model):
+    """
+    مدل برای ردیف‌های سود و پاداش معرف تسویه شده که از جدول transactions بایگانی شده‌اند.
+    شناسه اصلی تراکنش حفظ می‌شود؛ مجموع این ردیف‌ها در ledger_summaries نگهداری می‌شود.
+    """
+    __tablename__ = 'transactions_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    investment_id = db.Column(db.Integer, nullable=True)
+    type = db.Column(db.String(20), nullable=False)
+    amount = db.Column(db.Numeric(15, 4), nullable=False)
+    description = db.Column(db.String(200))
+    status = db.Column(db.String(20))
+    timestamp = db.Column(db.DateTime)
+    tx_hash = db.Column(db.String(100))
+    profit_date = db.Column(db.Date)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    user = db.relationship('User', backref=db.backref('archived_transactions', lazy='dynamic'))
+
+    __table_args__ = (
+        db.Index('ix_transactions_archive_user_date', 'user_id', 'profit_date'),
+        db.Index('ix_transactions_archive_date', 'profit_date'),
+    )
+
+class LedgerSummary(db.Model):
+    """
+    مدل برای خلاصه ماهانه ردیف‌های بایگانی شده (به ازای کاربر، سرمایه‌گذاری، نوع و ماه).
+    فقط ردیف‌های completed بایگانی می‌شوند، پس مبلغ این جدول مستقیماً جزو درآمد کاربر است.
+    """
+    __tablename__ = 'ledger_summaries'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    investment_id = db.Column(db.Integer, nullable=True)  # برای پاداش معرف خالی است
+    type = db.Column(db.String(20), nullable=False)
+    month = db.Column(db.Date, nullable=False)  # روز اول ماه
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(15, 4), nullable=False, default=0)
+    first_day = db.Column(db.Date)
+    last_day = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_ledger_summaries_user_type_month', 'user_id', 'type', 'month', 'investment_id'),
+        db.Index('ix_ledger_summaries_month', 'month'),
+    )
+
+# ==========================================
+# 14. Daily Ledger Rollup
+# ==========================================
+class DailyLedgerRollup(db.Model):
+    """
+    مدل برای جمع روزانه ردیف‌های سود و پاداش معرف (بر اساس profit_date).
+    موتور سود در همان تراکنش ثبت ردیف‌ها این جدول را به‌روز می‌کند (ماژول ledger)؛
+    ردیف‌های بایگانی شده همچنان در این جمع‌ها حساب می‌شوند.
+    """
+    __tablename__ = 'daily_ledger_rollups'
+    day = db.Column(db.Date, primary_key=True)
+    type = db.Column(db.String(20), primary_key=True)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    amount = db.Column(db.Numeric(15, 4), nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# ==========================================
+# 15. User Deletion Jobs
+# ==========================================
+class UserDeletionJob(db.Model):
+    """
+    مدل برای کارهای حذف کاربر در پس‌زمینه (ماژول deletion).
+    step مرحله فعلی و rows_deleted پیشرفت کار است؛ هر دسته حذف همراه با به‌روزرسانی
+    این ردیف commit می‌شود، بنابراین کار قطع شده از همان نقطه ادامه پیدا می‌کند.
+    """
+    __tablename__ = 'user_deletion_jobs'
+    id = db.Column(db.Integer, primary_key=True)
+    # بدون کلید خارجی: ردیف کاربر در مرحله آخر حذف می‌شود ولی سابقه کار باقی می‌ماند
+    user_id = db.Column(db.Integer, nullable=False, index=True)
+    email = db.Column(db.String(150))
+    requested_by = db.Column(db.Integer)
+    status = db.Column(db.String(20), nullable=False, default='queued')  # queued, running, completed, failed
+    step = db.Column(db.String(40))
+    rows_deleted = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+    finished_at = db.Column(db.DateTime)
@@ -0,0 +1,248 @@
+"""
+ماژول هش رمز عبور در process pool (Password Hashing Offload).
+
+PBKDF2 با صدها هزار تکرار برای هر ورود/ثبت‌نام/بازیابی رمز چند صد میلی‌ثانیه CPU مصرف می‌کند؛
+اجرای آن داخل worker همگام gunicorn باعث می‌شد موجی از ورودها همه workerها را اشغال کند.
+اکنون هش و بررسی رمز می‌تواند در یک ProcessPoolExecutor محدود اجرا شود:
+  - PASSWORD_HASH_WORKERS پروسس در هر worker وب (پیش‌فرض 0 = اجرای مستقیم در همان پروسس). pool فقط
+    با workerهای threaded/async (gthread، gevent و ...) کمک می‌کند که در زمان انتظار درخواست‌های دیگر
+    را جواب می‌دهند؛ worker همگام به هر حال منتظر نتیجه می‌ماند و pool فقط هزینه IPC اضافه می‌کند،
+  - حداکثر PASSWORD_HASH_CONCURRENCY عملیات همزمان در هر worker و حداکثر PASSWORD_HASH_HOST_CONCURRENCY
+    عملیات همزمان روی کل میزبان (قفل flock روی فایل‌های PASSWORD_HASH_SLOT_DIR، مشترک بین همه workerها
+    تا poolهای جداگانه هر worker هسته‌ها را بیش از حد اشغال نکنند)؛ درخواستی که بیش از
+    PASSWORD_HASH_QUEUE_TIMEOUT ثانیه منتظر جای خالی بماند با PasswordHasherBusy رد می‌شود
+    (مسیر پیام «دوباره تلاش کنید» می‌دهد)،
+  - هش‌هایی که با پارامترهای قدیمی‌تر از PASSWORD_HASH_METHOD ساخته شده‌اند بعد از ورود موفق
+    دوباره هش می‌شوند (needs_rehash)،
+  - آمار زمان هش و زمان انتظار در صف از stats() در دسترس است (برای تعیین اندازه pool).
+
+این ماژول عمداً به مدل‌ها و Flask وابسته نیست تا پروسس‌های pool سبک بمانند.
+"""
+
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+try:
+    import fcntl
+except ImportError:  # ویندوز: فقط سقف همزمانی هر worker اعمال می‌شود
+    fcntl = None
+
+# تعداد نمونه‌های اخیر برای محاسبه صدک‌ها
+PASSWORD_METRICS_WINDOW = 500
+# فاصله تلاش دوباره برای گرفتن جای خالی میزبان (ثانیه)
+HOST_SLOT_POLL_SECONDS = 0.01
+
+class PasswordHasherBusy(RuntimeError):
+    """جای خالی در pool هش رمز در زمان PASSWORD_HASH_QUEUE_TIMEOUT پیدا نشد."""
+
+def _hash_task(password, method):
+    started = time.time()
+    result = generate_password_hash(password, method=method)
+    return result, started, time.time() - started
+
+def _verify_task(pwhash, password):
+    started = time.time()
+    result = check_password_hash(pwhash, password)
+    return result, started, time.time() - started
+
+class HostSlots:
+    """
+    سقف همزمانی مشترک بین همه پروسس‌های یک میزبان: هر جای خالی یک فایل در directory است که با
+    flock گرفته می‌شود. قفل با بسته شدن فایل (حتی اگر پروسس از کار بیفتد) آزاد می‌شود.
+    """
+
+    def __init__(self, directory, count):
+        self.directory = directory
+        self.count = count
+        os.makedirs(directory, exist_ok=True)
+
+    def acquire(self, timeout):
+        """خروجی: توصیفگر فایل جای گرفته شده یا None اگر تا timeout جای خالی پیدا نشد."""
+        deadline = time.time() + timeout
+        offset = os.getpid()
+        while True:
+            for i in range(self.count):
+                path = os.path.join(self.directory, f'slot-{(offset + i) % self.count}.lock')
+                fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    os.close(fd)
+                    continue
+                return fd
+            if time.time() >= deadline:
+                return None
+            time.sleep(HOST_SLOT_POLL_SECONDS)
+
+    @staticmethod
+    def release(fd):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+def _normalize_method(method):
+    """شکل کامل پارامترها همان‌طور که در ابتدای هش ذخیره می‌شود (مثلاً pbkdf2:sha256:1000000)."""
+    name, _, args = method.partition(':')
+    if name == 'pbkdf2':
+        parts = args.split(':') if args else []
+        hash_name = parts[0] if parts else 'sha256'
+        iterations = parts[1] if len(parts) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    if name == 'scrypt':
+        parts = args.split(':') if args else []
+        n, r, p = (parts + ['32768', '8', '1'][len(parts):])[:3]
+        return f'scrypt:{n}:{r}:{p}'
+    return method
+
+class PasswordHasher:
+    def __init__(self, app=None):
+        self.method = 'pbkdf2:sha256'
+        self.workers = 0
+        self.queue_timeout = 5.0
+        self._target = _normalize_method(self.method)
+        self._slots = threading.BoundedSemaphore(1)
+        self._concurrency = None
+        self._host_slots = None
+        self._pool = None
+        self._pid = None
+        self._pool_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._samples = {'hash': deque(maxlen=PASSWORD_METRICS_WINDOW), 'verify': deque(maxlen=PASSWORD_METRICS_WINDOW)}
+        self._counts = {'hash': 0, 'verify': 0, 'rehash': 0, 'busy': 0, 'pool_errors': 0}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+        self._target = _normalize_method(self.method)
+        concurrency = app.config.get('PASSWORD_HASH_CONCURRENCY') or max(self.workers, 1)
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._concurrency = concurrency if self.workers else None
+        host_concurrency = app.config.get('PASSWORD_HASH_HOST_CONCURRENCY') or os.cpu_count() or 1
+        if self.workers and fcntl is not None:
+            directory = app.config.get('PASSWORD_HASH_SLOT_DIR') or os.path.join(
+                tempfile.gettempdir(), 'vesthub-password-slots')
+            self._host_slots = HostSlots(directory, host_concurrency)
+        else:
+            self._host_slots = None
+
+    def hash(self, password):
+        """هش رمز با پارامترهای فعلی PASSWORD_HASH_METHOD."""
+        return self._run('hash', _hash_task, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run('verify', _verify_task, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        """آیا هش با روش یا پارامترهایی غیر از PASSWORD_HASH_METHOD ساخته شده است؟"""
+        method = pwhash.split('$', 1)[0]
+        return _normalize_method(method) != self._target
+
+    def upgrade(self, user, password):
+        """بعد از ورود موفق: هش دوباره با پارامترهای فعلی (commit با فراخوان است). خروجی: True اگر عوض شد."""
+        if not self.needs_rehash(user.password):
+            return False
+        try:
+            user.password = self.hash(password)
+        except PasswordHasherBusy:
+            # در ورود بعدی دوباره تلاش می‌شود
+            return False
+        with self._stats_lock:
+            self._counts['rehash'] += 1
+        return True
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._counts)
+            samples = {op: list(values) for op, values in self._samples.items()}
+        stats.update({
+            'method': self._target,
+            'workers': self.workers,
+            'concurrency': self._concurrency,
+            'host_concurrency': self._host_slots.count if self._host_slots else None,
+            'queue_timeout': self.queue_timeout,
+        })
+        for op, values in samples.items():
+            waits = sorted(wait for wait, _ in values)
+            durations = sorted(duration for _, duration in values)
+            stats[op + '_latency_ms'] = self._summary(durations)
+            stats[op + '_queue_wait_ms'] = self._summary(waits)
+        return stats
+
+    def _run(self, op, task, *args):
+        submitted = time.time()
+        if not self.workers:
+            result, started, duration = task(*args)
+            self._record(op, started - submitted, duration)
+            return result
+
+        deadline = submitted + self.queue_timeout
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._busy()
+        host_slot = None
+        if self._host_slots is not None:
+            host_slot = self._host_slots.acquire(max(deadline - time.time(), 0))
+            if host_slot is None:
+                self._slots.release()
+                self._busy()
+        try:
+            try:
+                result, started, duration = self._executor().submit(task, *args).result()
+            except BrokenProcessPool:
+                # پروسس pool از کار افتاده (مثلاً OOM)؛ pool جدید در فراخوانی بعدی ساخته می‌شود
+                with self._pool_lock:
+                    self._pool = None
+                with self._stats_lock:
+                    self._counts['pool_errors'] += 1
+                result, started, duration = task(*args)
+        finally:
+            if host_slot is not None:
+                self._host_slots.release(host_slot)
+            self._slots.release()
+        self._record(op, started - submitted, duration)
+        return result
+
+    def _busy(self):
+        with self._stats_lock:
+            self._counts['busy'] += 1
+        raise PasswordHasherBusy(f'No password hashing slot free within {self.queue_timeout}s')
+
+    def _executor(self):
+        # pool بعد از fork (workerهای gunicorn) در هر پروسس جداگانه ساخته می‌شود. پروسس‌های pool با spawn
+        # ساخته می‌شوند (مثل tasks.py): fork بعد از شروع thread لاگ فعالیت‌ها ممکن است قفل گرفته شده را کپی کند
+        if self._pool is not None and self._pid == os.getpid():
+            return self._pool
+        with self._pool_lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _record(self, op, wait, duration):
+        with self._stats_lock:
+            self._counts[op] += 1
+            self._samples[op].append((max(wait, 0.0), duration))
+
+    @staticmethod
+    def _summary(values):
+        if not values:
+            return None
+        def percentile(p):
+            return round(values[min(len(values) - 1, int(p * len(values)))] * 1000, 2)
+        return {
+            'samples': len(values),
+            'avg': round(sum(values) / len(values) * 1000, 2),
+            'p50': percentile(0.50),
+            'p95': percentile(0.95),
+            'max': round(values[-1] * 1000, 2),
+        }
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,111 @@
+"""
+ماژول محدودیت تعداد تلاش (Token Bucket Rate Limiter).
+
+ورود، تأیید ایمیل، کد 2FA ورود و کد تأیید برداشت قبل از هر کار دیتابیس یا هش رمز بررسی می‌شوند.
+هر قانون (RATE_LIMITS) برای هر محدوده دو سطل دارد: یکی بر اساس IP و یکی بر اساس حساب
+(ایمیل یا شناسه کاربر). هر سطل حداکثر capacity توکن دارد و در هر per_seconds ثانیه دوباره پر می‌شود؛
+هر تلاش یک توکن مصرف می‌کند و با خالی بودن هر کدام از دو سطل، درخواست با 429 رد می‌شود.
+
+backend پیش‌فرض درون‌پروسسی است (برای یک سرور)؛ با RATE_LIMIT_BACKEND = 'module:factory' یک backend
+مشترک (مثلاً Redis) با متد consume(key, capacity, rate) جایگزین می‌شود. LocalRateLimitBackend همان
+قرارداد را دارد و در تست‌ها به جای backend مشترک استفاده می‌شود.
+"""
+
+import importlib
+import threading
+import time
+from flask import request, flash, render_template
+
+class LocalRateLimitBackend:
+    """سطل‌ها در حافظه همین پروسس: key -> [توکن‌های باقی‌مانده، زمان آخرین به‌روزرسانی]"""
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate, cost=1):
+        """مصرف cost توکن. خروجی: 0 اگر مجاز است، در غیر این صورت ثانیه‌های لازم تا توکن بعدی."""
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.maxsize:
+                    self._evict(now)
+                bucket = self._buckets[key] = [capacity, now]
+            else:
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return 0
+            return (cost - bucket[0]) / rate
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+    def _evict(self, now):
+        # سطل‌هایی که تا الان دوباره پر شده‌اند اطلاعاتی ندارند؛ در غیر این صورت قدیمی‌ترین نیمه حذف می‌شود
+        # (حداکثر ظرفیت قوانین برای تشخیص سطل پر در دسترس نیست؛ یک ساعت بیکاری کافی فرض می‌شود)
+        idle = [key for key, (_, updated) in self._buckets.items() if now - updated > 3600]
+        for key in idle:
+            del self._buckets[key]
+        if len(self._buckets) >= self.maxsize:
+            for key in sorted(self._buckets, key=lambda k: self._buckets[k][1])[:len(self._buckets) // 2]:
+                del self._buckets[key]
+
+class RateLimiter:
+    def __init__(self, app=None):
+        self.enabled = True
+        self.rules = {}
+        self.backend = LocalRateLimitBackend()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.enabled = app.config.get('RATE_LIMIT_ENABLED', True)
+        # scope -> {'ip' یا 'account': (capacity، rate بر حسب توکن در ثانیه)}
+        self.rules = {
+            scope: {kind: (capacity, capacity / per_seconds) for kind, (capacity, per_seconds) in limits.items()}
+            for scope, limits in app.config.get('RATE_LIMITS', {}).items()
+        }
+        backend = app.config.get('RATE_LIMIT_BACKEND')
+        if backend:
+            module_name, _, factory = backend.partition(':')
+            self.backend = getattr(importlib.import_module(module_name), factory)(app)
+        else:
+            self.backend = LocalRateLimitBackend(app.config.get('RATE_LIMIT_MAX_KEYS', 100000))
+
+    def check(self, scope, account=None):
+        """
+        ثبت یک تلاش برای scope از IP درخواست و (در صورت وجود) حساب.
+        خروجی: 0 اگر مجاز است، در غیر این صورت ثانیه‌های لازم تا تلاش بعدی.
+        """
+        rules = self.rules.get(scope)
+        if not self.enabled or not rules:
+            return 0
+
+        # سطل IP اول بررسی می‌شود تا تلاش‌های رد شده یک IP از سهمیه حساب کم نکنند
+        ip_rule = rules.get('ip')
+        if ip_rule:
+            retry_after = self.backend.consume(f'{scope}:ip:{request.remote_addr}', *ip_rule)
+            if retry_after:
+                return retry_after
+        account_rule = rules.get('account')
+        if account_rule and account is not None:
+            key = account.strip().lower() if isinstance(account, str) else account
+            return self.backend.consume(f'{scope}:account:{key}', *account_rule)
+        return 0
+
+rate_limiter = RateLimiter()
+
+def too_many_attempts(template, retry_after, **context):
+    """پاسخ 429 با پیام و هدر Retry-After برای مسیری که محدود شده است."""
+    seconds = max(1, int(retry_after + 0.999))
+    flash(f'Too many attempts. Please try again in {seconds} seconds.', 'danger')
+    return render_template(template, **context), 429, {'Retry-After': str(seconds)}
@@ -1,16 +1,32 @@
+import tempfile
 from decimal import Decimal
-from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify, current_app, Response, stream_with_context, send_file
 from flask_login import login_required, current_user
-from sqlalchemy import func, or_, case, desc
+from sqlalchemy import func, or_, and_, case, desc, select
+from sqlalchemy.orm import joinedload, selectinload, contains_eager
 from datetime import datetime, timedelta
 from extensions import db
-from models import User, Role, Transaction, KYCRequest, Ticket, TicketMessage, SystemSetting, InvestmentPlan, AuditLog, Investment
+from models import User, Role, Transaction, KYCRequest, Ticket, TicketMessage, SystemSetting, InvestmentPlan, AuditLog, Investment, ProfitRun, ReferralBonusDetail, UserBalance, LedgerSummary, DailyLedgerRollup, UserDeletionJob
 from decorators import permission_required
-from utils import log_admin_activity, set_setting, get_withdrawable_balance
-from tasks import run_profit_distribution
+from utils import log_admin_activity, set_setting, invalidate_role_permissions, keyset_paginate, approximate_count, count_cache
+from ledger import record_status_change, record_status_changes, compute_balances, pending_review_query, payment_tx_investments_query
+from tasks import run_profit_distribution, backfill_profits
+from search import search_users
+from dashboard import admin_kpis, invalidate_admin_kpis
+from audit import audit_writer, audit_archives, audit_log_query
+from passwords import password_hasher
+from deletion import request_user_deletion, start_user_deletion, deletion_progress
+from archive import ARCHIVED_ROWS_LIMIT, archived_investment_totals, archived_rows
+from export import EXPORT_FORMATS, EXPORT_TABS, cash_flow_conditions, profit_log_query, export_statement, stream_csv, write_parquet, parquet_available
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
+USERS_PER_PAGE = 50
+PROFIT_HISTORY_PER_PAGE = 100
+LOGS_PER_PAGE = 50
+# Upper bound on transaction ids accepted by one bulk review request
+BULK_REVIEW_LIMIT = 500
+
 @admin_bp.route('/dashboard')
 @login_required
 def dashboard():
@@ -45,6 +61,7 @@ def roles():
             
             db.session.add(Role(name=name, description=desc, permissions=perms_str))
             db.session.commit()
+            invalidate_role_permissions()
             
             log_admin_activity('Create Role', f'Created role: {name}')
             flash('New role created successfully.', 'success')
@@ -69,6 +86,7 @@ def edit_role(role_id):
     role.permissions = ",".join(request.form.getlist('permissions'))
     
     db.session.commit()
+    invalidate_role_permissions()
     log_admin_activity('Edit Role', f'Edited role: {role.name}')
     flash('Role updated successfully.', 'success')
     return redirect(url_for('admin.roles'))
@@ -83,6 +101,7 @@ def delete_role(role_id):
     else:
         db.session.delete(role)
         db.session.commit()
+        invalidate_role_permissions()
         log_admin_activity('Delete Role', f'Deleted role: {role.name}')
         flash('Role deleted successfully.', 'success')
     return redirect(url_for('admin.roles'))
@@ -92,26 +111,104 @@ def delete_role(role_id):
 @login_required
 @permission_required('manage_users')
 def users():
-    users_list = User.query.order_by(User.created_at.desc()).all()
+    base_query = User.query.options(joinedload(User.role), selectinload(User.investments).joinedload(Investment.plan))
+    q = request.args.get('q', '').strip()
+
+    if q:
+        # Ranked search through the search index, paginated by page number
+        search_page = request.args.get('page', 1, type=int)
+        ranked_ids, has_next = search_users(q, page=search_page, per_page=USERS_PER_PAGE)
+        by_id = {user.id: user for user in base_query.filter(User.id.in_(ranked_ids))}
+        users_list = [by_id[user_id] for user_id in ranked_ids if user_id in by_id]
+        page = None
+        search_pages = {'page': search_page, 'has_prev': search_page > 1, 'has_next': has_next}
+    else:
+        # Keyset pagination (newest first) instead of loading every user
+        page = keyset_paginate(
+            base_query,
+            (User.id,),
+            cursor=request.args.get('cursor'),
+            direction=request.args.get('direction', 'next'),
+            per_page=USERS_PER_PAGE
+        )
+        users_list = page.items
+        search_pages = None
+    user_ids = [user.id for user in users_list]
+
+    # Per-user totals: one grouped subquery joined to the page of users
+    invested = db.session.query(
+        Investment.user_id.label('user_id'),
+        func.sum(Investment.amount).label('total_invested')
+    ).filter(Investment.user_id.in_(user_ids), Investment.status == 'active').group_by(Investment.user_id).subquery()
+
+    totals = {
+        row.id: row for row in db.session.query(
+            User.id,
+            func.coalesce(invested.c.total_invested, 0).label('total_invested'),
+            (UserBalance.earnings - UserBalance.pending_withdrawals - UserBalance.completed_withdrawals).label('total_benefit'),
+            select(LedgerSummary.id).where(LedgerSummary.user_id == User.id).exists().label('has_archived_history')
+        ).outerjoin(invested, invested.c.user_id == User.id)
+         .outerjoin(UserBalance, UserBalance.user_id == User.id)
+         .filter(User.id.in_(user_ids))
+    }
+
+    # Profit earned per investment (live + archived) in one grouped query
+    investment_ids = [inv.id for user in users_list for inv in user.investments]
+    earned = dict(db.session.query(Transaction.investment_id, func.sum(Transaction.amount)).filter(
+        Transaction.investment_id.in_(investment_ids), Transaction.type == 'profit'
+    ).group_by(Transaction.investment_id).all()) if investment_ids else {}
+    archived_earned = archived_investment_totals(investment_ids)
+
+    # Users without a materialized balance row yet fall back to the ledger (one grouped query)
+    missing_balances = [uid for uid, row in totals.items() if row.total_benefit is None]
+    unmaterialized = compute_balances(missing_balances) if missing_balances else {}
+
+    now = datetime.utcnow()
     for user in users_list:
-        user.total_invested = sum(inv.amount for inv in user.investments if inv.status == 'active')
-        user.total_benefit = get_withdrawable_balance(user.id)
-        
-        # دریافت تاریخچه سودها برای نمایش در مودال
-        user.profit_history = Transaction.query.filter(
-            Transaction.user_id == user.id,
-            Transaction.type.in_(['profit', 'referral_bonus'])
-        ).order_by(Transaction.timestamp.desc()).all()
-        
-        # محاسبه سود کل کسب شده برای هر سرمایه‌گذاری خاص
+        row = totals[user.id]
+        user.total_invested = row.total_invested
+        if row.total_benefit is not None:
+            user.total_benefit = row.total_benefit
+        else:
+            balance = unmaterialized.get(user.id)
+            user.total_benefit = (balance['earnings'] - balance['pending_withdrawals'] - balance['completed_withdrawals']) \
+                if balance else Decimal('0')
+        user.has_archived_history = row.has_archived_history
+
         for inv in user.investments:
-            inv.total_earned = sum(t.amount for t in user.profit_history if t.investment_id == inv.id and t.type == 'profit')
-            if inv.start_date:
-                inv.days_elapsed = (datetime.utcnow() - inv.start_date).days
-            else:
-                inv.days_elapsed = 0
+            inv.total_earned = Decimal(str(earned.get(inv.id) or 0)) + archived_earned.get(inv.id, Decimal('0'))
+            inv.days_elapsed = (now - inv.start_date).days if inv.start_date else 0
             
-    return render_template('admin_users.html', users=users_list, roles=Role.query.all())
+    return render_template('admin_users.html', users=users_list, page=page, q=q, search_pages=search_pages,
+                           roles=Role.query.all())
+
+@admin_bp.route('/api/users/<int:user_id>/profit-history')
+@login_required
+@permission_required('manage_users')
+def api_user_profit_history(user_id):
+    # Lazily loaded by the user details modal; newest first, cursor-paginated
+    User.query.get_or_404(user_id)
+    page = keyset_paginate(
+        Transaction.query.filter(
+            Transaction.user_id == user_id,
+            Transaction.type.in_(['profit', 'referral_bonus'])
+        ),
+        (Transaction.timestamp, Transaction.id),
+        cursor=request.args.get('cursor'),
+        per_page=PROFIT_HISTORY_PER_PAGE
+    )
+
+    return jsonify({
+        'user_id': user_id,
+        'next_cursor': page.next_cursor,
+        'rows': [{
+            'id': tx.id,
+            'timestamp': tx.timestamp.strftime('%Y-%m-%d %H:%M') if tx.timestamp else None,
+            'type': tx.type,
+            'amount': float(tx.amount),
+            'description': tx.description
+        } for tx in page.items]
+    })
 
 @admin_bp.route('/users/change-role/<int:user_id>', methods=['POST'])
 @login_required
@@ -137,38 +234,33 @@ def delete_user(user_id):
         flash('You cannot delete your own account.', 'danger')
         return redirect(url_for('admin.users'))
 
+    if user.pending_deletion:
+        flash('This user is already being deleted.', 'info')
+        return redirect(url_for('admin.users'))
+
     try:
-        # 1. Delete AuditLogs
-        AuditLog.query.filter_by(user_id=user.id).delete()
-        
-        # 2. Delete KYCRequests
-        KYCRequest.query.filter_by(user_id=user.id).delete()
-        
-        # 3. Delete Tickets & Messages
-        user_tickets = Ticket.query.filter_by(user_id=user.id).all()
-        ticket_ids = [t.id for t in user_tickets]
-        if ticket_ids:
-            TicketMessage.query.filter(TicketMessage.ticket_id.in_(ticket_ids)).delete(synchronize_session=False)
-            Ticket.query.filter(Ticket.id.in_(ticket_ids)).delete(synchronize_session=False)
-            
-        # 4. Delete Transactions
-        Transaction.query.filter_by(user_id=user.id).delete()
-        
-        # 5. Delete Investments
-        Investment.query.filter_by(user_id=user.id).delete()
-        
-        # 6. Handle Referrals
-        User.query.filter_by(referrer_id=user.id).update({'referrer_id': None})
-        
-        db.session.delete(user)
+        # Lock the account and stop its payouts now; the rows are removed in chunks by a background job
+        job = request_user_deletion(user, requested_by=current_user.id)
         db.session.commit()
-        log_admin_activity('Delete User', f'Deleted user: {user.email}')
-        flash('User deleted successfully.', 'success')
     except Exception as e:
         db.session.rollback()
         flash(f'Error deleting user: {str(e)}', 'danger')
+        return redirect(url_for('admin.users'))
+
+    log_admin_activity('Delete User', f'Queued deletion of user: {user.email} (job #{job.id})')
+    invalidate_admin_kpis()
+    start_user_deletion(current_app._get_current_object(), job.id)
+    flash('User deletion started. The account is locked and its data is being removed in the background.', 'success')
     return redirect(url_for('admin.users'))
 
+@admin_bp.route('/api/users/<int:user_id>/deletion')
+@login_required
+@permission_required('manage_users')
+def api_user_deletion_status(user_id):
+    # Progress of the latest background deletion job for this user
+    job = UserDeletionJob.query.filter_by(user_id=user_id).order_by(UserDeletionJob.id.desc()).first_or_404()
+    return jsonify(deletion_progress(job))
+
 # --- Plans Management ---
 @admin_bp.route('/plans', methods=['GET', 'POST'])
 @login_required
@@ -212,6 +304,7 @@ def edit_plan(plan_id):
         plan.risk_level = request.form.get('risk_level')
         db.session.commit()
         log_admin_activity('Edit Plan', f'Edited plan: {plan.name}')
+        invalidate_admin_kpis()
         flash('Plan updated successfully.', 'success')
     except Exception as e:
         flash(f'Error updating plan: {str(e)}', 'danger')
@@ -228,6 +321,7 @@ def delete_plan(plan_id):
         db.session.delete(plan)
         db.session.commit()
         log_admin_activity('Delete Plan', f'Deleted plan: {plan.name}')
+        invalidate_admin_kpis()
         flash('Plan deleted successfully.', 'success')
     return redirect(url_for('admin.plans'))
 
@@ -256,7 +350,7 @@ def activate_plan(plan_id):
 @login_required
 @permission_required('manage_payments')
 def payments():
-    pending_payments = Transaction.query.filter_by(type='deposit', status='pending').order_by(Transaction.timestamp.desc()).all()
+    pending_payments = pending_review_query('deposit').all()
     return render_template('admin_payments.html', payments=pending_payments)
 
 @admin_bp.route('/payments/approve/<int:tx_id>', methods=['POST'])
@@ -266,6 +360,7 @@ def approve_payment(tx_id):
     tx = db.session.get(Transaction, tx_id)
     if tx and tx.status == 'pending':
         tx.status = 'completed'
+        record_status_change(tx, 'pending')
         
         # Activate associated investment if exists
         if tx.investment:
@@ -273,7 +368,7 @@ def approve_payment(tx_id):
             tx.investment.start_date = datetime.utcnow()
         else:
             # Fallback: Try to find investment by TxID if not directly linked
-            inv = Investment.query.filter_by(payment_tx_id=tx.tx_hash).first()
+            inv = payment_tx_investments_query([tx.tx_hash]).first()
             if inv and inv.status == 'pending_payment':
                 inv.status = 'active'
                 inv.start_date = datetime.utcnow()
@@ -281,6 +376,7 @@ def approve_payment(tx_id):
         
         db.session.commit()
         log_admin_activity('Approve Payment', f'Approved TX {tx.id}')
+        invalidate_admin_kpis()
         flash('Payment approved successfully.', 'success')
     return redirect(url_for('admin.payments'))
 
@@ -291,26 +387,145 @@ def reject_payment(tx_id):
     tx = db.session.get(Transaction, tx_id)
     if tx and tx.status == 'pending':
         tx.status = 'rejected'
+        record_status_change(tx, 'pending')
 
         # Reject associated investment if it exists
         if tx.investment:
             tx.investment.status = 'rejected'
         else:
             # Fallback for older, unlinked transactions
-            inv = Investment.query.filter_by(payment_tx_id=tx.tx_hash).first()
+            inv = payment_tx_investments_query([tx.tx_hash]).first()
             if inv and inv.status == 'pending_payment':
                 inv.status = 'rejected'
 
         db.session.commit()
         log_admin_activity('Reject Payment', f'Rejected TX {tx.id}')
+        invalidate_admin_kpis()
         flash('Payment rejected.', 'warning')
     return redirect(url_for('admin.payments'))
 
+def _bulk_review_ids():
+    # Ids from a JSON body ({"ids": [...], "action": ...}) or repeated `tx_ids` form fields
+    payload = request.get_json(silent=True) or {}
+    raw_ids = payload.get('ids') if payload else request.form.getlist('tx_ids')
+    action = payload.get('action') if payload else request.form.get('action')
+    ids = []
+    for raw_id in raw_ids or []:
+        try:
+            tx_id = int(raw_id)
+        except (TypeError, ValueError):
+            continue
+        if tx_id not in ids:
+            ids.append(tx_id)
+    return ids, action
+
+def _review_transactions(tx_type, tx_ids, approve):
+    """
+    Approve or reject pending deposits/withdrawals in one database transaction.
+    Rows are locked with a single SELECT ... FOR UPDATE; balances and linked investments are
+    updated in batches. Returns per-id outcomes; the caller commits.
+    """
+    new_status = 'completed' if approve else 'rejected'
+    locked = {
+        tx.id: tx for tx in Transaction.query.filter(
+            Transaction.id.in_(tx_ids), Transaction.type == tx_type
+        ).order_by(Transaction.id).with_for_update().all()
+    }
+    pending = [locked[tx_id] for tx_id in tx_ids if tx_id in locked and locked[tx_id].status == 'pending']
+
+    fallback = {}
+    if tx_type == 'deposit':
+        # Linked investments plus the payment_tx_id fallback for older, unlinked deposits (one query each)
+        linked_ids = {tx.investment_id for tx in pending if tx.investment_id}
+        hashes = {tx.tx_hash for tx in pending if not tx.investment_id and tx.tx_hash}
+        conditions = []
+        if linked_ids:
+            conditions.append(Investment.id.in_(linked_ids))
+        if hashes:
+            conditions.append(Investment.payment_tx_id.in_(hashes))
+        if conditions:
+            for inv in Investment.query.filter(or_(*conditions)).order_by(Investment.id).with_for_update().all():
+                if inv.payment_tx_id in hashes:
+                    fallback.setdefault(inv.payment_tx_id, inv)
+
+    outcomes = []
+    changes = []
+    now = datetime.utcnow()
+    for tx_id in tx_ids:
+        tx = locked.get(tx_id)
+        if tx is None:
+            outcomes.append({'id': tx_id, 'outcome': 'not_found'})
+            continue
+        if tx.status != 'pending':
+            outcomes.append({'id': tx_id, 'outcome': 'skipped', 'status': tx.status})
+            continue
+
+        tx.status = new_status
+        changes.append((tx, 'pending'))
+        outcome = {'id': tx_id, 'outcome': 'approved' if approve else 'rejected', 'status': new_status}
+
+        if tx_type == 'deposit':
+            inv = tx.investment
+            if inv is None:
+                candidate = fallback.get(tx.tx_hash) if tx.tx_hash else None
+                if candidate is not None and candidate.status == 'pending_payment':
+                    inv = candidate
+                    if approve:
+                        tx.investment = inv  # Link them for future
+            if inv is not None:
+                inv.status = 'active' if approve else 'rejected'
+                if approve:
+                    inv.start_date = now
+                outcome['investment_id'] = inv.id
+        outcomes.append(outcome)
+
+    record_status_changes(changes)
+    return outcomes
+
+def _bulk_review_response(tx_type, label, redirect_endpoint):
+    tx_ids, action = _bulk_review_ids()
+    if action not in ('approve', 'reject') or not tx_ids or len(tx_ids) > BULK_REVIEW_LIMIT:
+        error = f'Select between 1 and {BULK_REVIEW_LIMIT} items and an action (approve or reject).'
+        if request.is_json:
+            return jsonify({'error': error}), 400
+        flash(error, 'danger')
+        return redirect(url_for(redirect_endpoint))
+
+    try:
+        outcomes = _review_transactions(tx_type, tx_ids, approve=action == 'approve')
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f'Bulk {action} of {label} failed: {e}')
+        if request.is_json:
+            return jsonify({'error': str(e)}), 500
+        flash(f'Bulk {action} failed, nothing was changed: {e}', 'danger')
+        return redirect(url_for(redirect_endpoint))
+
+    done = [o['id'] for o in outcomes if o['outcome'] in ('approved', 'rejected')]
+    if done:
+        invalidate_admin_kpis()
+        log_admin_activity(f'Bulk {action.title()} {label}', f"{len(done)} {label.lower()}: {', '.join(map(str, done))}")
+
+    summary = {key: sum(1 for o in outcomes if o['outcome'] == key) for key in ('approved', 'rejected', 'skipped', 'not_found')}
+    if request.is_json:
+        return jsonify({'action': action, 'summary': summary, 'results': outcomes})
+    flash(f"Bulk {action}: {len(done)} {label.lower()} {'approved' if action == 'approve' else 'rejected'}, "
+          f"{summary['skipped']} skipped (no longer pending), {summary['not_found']} not found.",
+          'success' if done else 'warning')
+    return redirect(url_for(redirect_endpoint))
+
+@admin_bp.route('/payments/bulk', methods=['POST'])
+@login_required
+@permission_required('manage_payments')
+def bulk_review_payments():
+    return _bulk_review_response('deposit', 'Payments', 'admin.payments')
+
 @admin_bp.route('/withdrawals')
 @login_required
 @permission_required('manage_withdrawals')
 def withdrawals():
-    pending_withdrawals = Transaction.query.filter_by(type='withdrawal', status='pending').order_by(Transaction.timestamp.desc()).all()
+    pending_withdrawals = pending_review_query('withdrawal').all()
     return render_template('admin_withdrawals.html', requests=pending_withdrawals)
 
 @admin_bp.route('/withdrawals/approve/<int:tx_id>', methods=['POST'])
@@ -319,9 +534,12 @@ def withdrawals():
 def approve_withdrawal(tx_id):
     tx = db.session.get(Transaction, tx_id)
     if tx:
+        old_status = tx.status
         tx.status = 'completed'
+        record_status_change(tx, old_status)
         db.session.commit()
         log_admin_activity('Approve Withdrawal', f'Approved WD {tx.id}')
+        invalidate_admin_kpis()
         flash('Withdrawal approved.', 'success')
     return redirect(url_for('admin.withdrawals'))
 
@@ -331,12 +549,21 @@ def approve_withdrawal(tx_id):
 def reject_withdrawal(tx_id):
     tx = db.session.get(Transaction, tx_id)
     if tx:
+        old_status = tx.status
         tx.status = 'rejected'
+        record_status_change(tx, old_status)
         db.session.commit()
         log_admin_activity('Reject Withdrawal', f'Rejected WD {tx.id}')
+        invalidate_admin_kpis()
         flash('Withdrawal rejected.', 'warning')
     return redirect(url_for('admin.withdrawals'))
 
+@admin_bp.route('/withdrawals/bulk', methods=['POST'])
+@login_required
+@permission_required('manage_withdrawals')
+def bulk_review_withdrawals():
+    return _bulk_review_response('withdrawal', 'Withdrawals', 'admin.withdrawals')
+
 # --- KYC Management ---
 @admin_bp.route('/kyc')
 @login_required
@@ -355,6 +582,7 @@ def approve_kyc(req_id):
     req.user.kyc_status = 'verified'
     db.session.commit()
     log_admin_activity('Approve KYC', f'Approved KYC for {req.user.email}')
+    invalidate_admin_kpis()
     return redirect(url_for('admin.kyc'))
 
 @admin_bp.route('/kyc/reject/<int:req_id>', methods=['POST'])
@@ -366,6 +594,7 @@ def reject_kyc(req_id):
     req.user.kyc_status = 'rejected'
     db.session.commit()
     log_admin_activity('Reject KYC', f'Rejected KYC for {req.user.email}')
+    invalidate_admin_kpis()
     return redirect(url_for('admin.kyc'))
 
 # --- Support ---
@@ -390,6 +619,7 @@ def ticket_view(ticket_id):
         ticket.status = 'answered'
         ticket.updated_at = datetime.utcnow()
         db.session.commit()
+        invalidate_admin_kpis()
         return redirect(url_for('admin.ticket_view', ticket_id=ticket.id))
     return render_template('admin_support_view.html', ticket=ticket)
 
@@ -409,6 +639,7 @@ def settings():
         ]
         for k in keys:
             set_setting(k, request.form.get(k))
+        set_setting('referral_aggregation', '1' if request.form.get('referral_aggregation') else '0')
             
         log_admin_activity('Update Settings', 'Updated system settings')
         flash('Settings saved successfully.', 'success')
@@ -420,7 +651,8 @@ def settings():
         'wallet_bep20': db.session.get(SystemSetting, 'wallet_bep20'),
         'wallet_polygon': db.session.get(SystemSetting, 'wallet_polygon'),
         'bank_details': db.session.get(SystemSetting, 'bank_details'),
-        'referral_percentage': db.session.get(SystemSetting, 'referral_percentage')
+        'referral_percentage': db.session.get(SystemSetting, 'referral_percentage'),
+        'referral_aggregation': db.session.get(SystemSetting, 'referral_aggregation')
     }
     # تبدیل آبجکت‌ها به مقدار (value)
     config = {k: (v.value if v else '') for k, v in current_settings.items()}
@@ -428,12 +660,75 @@ def settings():
     return render_template('admin_settings.html', config=config)
 
 # --- Logs & Accounting ---
+def _date_range_args():
+    # Date range filters shared by the logs, accounting and export views (end date is inclusive)
+    start_date_str = request.args.get('start_date')
+    end_date_str = request.args.get('end_date')
+    start_date = datetime.strptime(start_date_str, '%Y-%m-%d') if start_date_str else None
+    end_date = None
+    if end_date_str:
+        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
+    return start_date_str, end_date_str, start_date, end_date
+
 @admin_bp.route('/logs')
 @login_required
 @permission_required('view_logs')
 def logs():
-    logs = AuditLog.query.order_by(AuditLog.timestamp.desc()).limit(100).all()
-    return render_template('admin_logs.html', logs=logs)
+    # Filters: user (id or exact email), action, IP (exact, or prefix ending in '*') and date range.
+    # Each filter has a matching (column, timestamp, id) index for the keyset order below.
+    user_filter = request.args.get('user', '').strip()
+    action = request.args.get('action', '').strip()
+    ip = request.args.get('ip', '').strip()
+    start_date_str, end_date_str, start_date, end_date = _date_range_args()
+
+    user_id = None
+    if user_filter:
+        if user_filter.isdigit():
+            user_id = int(user_filter)
+        else:
+            # Unknown email matches no entries
+            user_id = db.session.query(User.id).filter(User.email == user_filter).scalar() or 0
+    query = audit_log_query(user_id=user_id, action=action, ip=ip, start_date=start_date, end_date=end_date)
+
+    pagination = keyset_paginate(
+        query.options(joinedload(AuditLog.user)),
+        (AuditLog.timestamp, AuditLog.id),
+        cursor=request.args.get('cursor'),
+        direction=request.args.get('direction', 'next'),
+        per_page=LOGS_PER_PAGE
+    )
+    # Known actions for the filter dropdown (distinct over the action index, cached)
+    actions = count_cache.get_or_set(
+        ('audit_actions',),
+        lambda: [row[0] for row in db.session.query(AuditLog.action).distinct().order_by(AuditLog.action)],
+        ttl=300
+    )
+
+    filters = {'user': user_filter, 'action': action, 'ip': ip, 'start_date': start_date_str, 'end_date': end_date_str}
+    return render_template(
+        'admin_logs.html',
+        logs=pagination.items,
+        pagination=pagination,
+        actions=actions,
+        filters=filters,
+        page_args={k: v for k, v in filters.items() if v},
+        archives=audit_archives(current_app.config['AUDIT_LOG_ARCHIVE_DIR']),
+        audit_stats=audit_writer.stats()
+    )
+
+@admin_bp.route('/api/audit-writer')
+@login_required
+@permission_required('view_logs')
+def api_audit_writer():
+    # Queue depth, written / dropped / failed counters of this worker's background audit writer
+    return jsonify(audit_writer.stats())
+
+@admin_bp.route('/api/password-hasher')
+@login_required
+@permission_required('view_logs')
+def api_password_hasher():
+    # Hash latency and queue wait of this worker's password hashing pool (for sizing PASSWORD_HASH_WORKERS)
+    return jsonify(password_hasher.stats())
 
 @admin_bp.route('/accounting')
 @login_required
@@ -443,16 +738,7 @@ def accounting():
     
     # Common Filters
     search = request.args.get('search')
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    
-    start_date = None
-    end_date = None
-    
-    if start_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-    if end_date_str:
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(hours=23, minutes=59, seconds=59)
+    start_date_str, end_date_str, start_date, end_date = _date_range_args()
 
     # Initialize variables
     pagination = None
@@ -463,83 +749,74 @@ def accounting():
     is_detailed_view = False
     users = User.query.with_entities(User.id, User.email).order_by(User.email.asc()).all()
     date_filter = None
+    profit_runs = []
+    approx_count = None
 
     if tab == 'cash_flow':
         # Mode 1: Cash Flow (Deposits & Withdrawals)
-        query = Transaction.query.join(User).filter(Transaction.type.in_(['deposit', 'withdrawal']))
+        tx_type = request.args.get('type')
+        types = [tx_type] if tx_type in ('deposit', 'withdrawal') else ['deposit', 'withdrawal']
+        # Search uses the FTS5 / pg_trgm index instead of leading-wildcard LIKE scans
+        query = Transaction.query.join(User).filter(*cash_flow_conditions(types, search, start_date, end_date))
         
-        if search:
-            search_condition = or_(
-                User.email.ilike(f'%{search}%'),
-                Transaction.tx_hash.ilike(f'%{search}%'),
-                Transaction.description.ilike(f'%{search}%')
+        # Calculate Totals (one conditional-aggregate query)
+        total_deposits, total_withdrawals = query.with_entities(
+            func.coalesce(func.sum(case(
+                (and_(Transaction.type == 'deposit', Transaction.status == 'completed'), Transaction.amount), else_=0
+            )), 0),
+            func.coalesce(func.sum(case(
+                (and_(Transaction.type == 'withdrawal', Transaction.status == 'completed'), Transaction.amount), else_=0
+            )), 0)
+        ).one()
+
+        count_ttl = current_app.config.get('ACCOUNTING_COUNT_CACHE_SECONDS', 0)
+        if count_ttl:
+            approx_count = approximate_count(
+                query, ('cash_flow', tuple(types), search, start_date_str, end_date_str), count_ttl
             )
-            if search.isdigit():
-                search_condition = or_(search_condition, Transaction.id == int(search))
-            query = query.filter(search_condition)
-        
-        if start_date:
-            query = query.filter(Transaction.timestamp >= start_date)
-        if end_date:
-            query = query.filter(Transaction.timestamp <= end_date)
-            
-        # Calculate Totals
-        total_deposits = query.with_entities(func.sum(Transaction.amount)).filter(
-            Transaction.type == 'deposit', Transaction.status == 'completed'
-        ).scalar() or 0
-        
-        total_withdrawals = query.with_entities(func.sum(Transaction.amount)).filter(
-            Transaction.type == 'withdrawal', Transaction.status == 'completed'
-        ).scalar() or 0
-        
-        page = request.args.get('page', 1, type=int)
-        pagination = query.order_by(Transaction.timestamp.desc()).paginate(page=page, per_page=20, error_out=False)
+
+        # Keyset pagination on (timestamp, id): no OFFSET and no COUNT(*) per page
+        pagination = keyset_paginate(
+            query.options(contains_eager(Transaction.user)),
+            (Transaction.timestamp, Transaction.id),
+            cursor=request.args.get('cursor'),
+            direction=request.args.get('direction', 'next'),
+            per_page=20
+        )
         transactions = pagination.items
 
     elif tab == 'profit_logs':
         user_id = request.args.get('user_id')
         date_filter = request.args.get('date')
+        profit_runs = ProfitRun.query.order_by(ProfitRun.id.desc()).limit(10).all()
         
         if user_id:
             # Scenario A: Detailed View for specific user
             is_detailed_view = True
-            query = Transaction.query.filter(
-                Transaction.user_id == user_id,
-                Transaction.type.in_(['profit', 'referral_bonus'])
-            )
-            
-            if start_date:
-                query = query.filter(Transaction.timestamp >= start_date)
-            if end_date:
-                query = query.filter(Transaction.timestamp <= end_date)
-                
-            profit_logs = query.order_by(Transaction.timestamp.desc()).all()
+            profit_logs = profit_log_query(user_id=user_id, start_date=start_date, end_date=end_date).all()
         elif date_filter:
             # Scenario B: Detailed View for specific date
             is_detailed_view = True
-            query = Transaction.query.filter(
-                Transaction.type.in_(['profit', 'referral_bonus']),
-                func.date(Transaction.timestamp) == date_filter
-            )
-            profit_logs = query.order_by(Transaction.timestamp.desc()).all()
+            profit_logs = profit_log_query(day=datetime.strptime(date_filter, '%Y-%m-%d').date()).all()
         else:
             # Scenario C: Aggregate View (Default)
+            # Read from the daily rollup (one row per day and type, archived days included)
             query = db.session.query(
-                func.date(Transaction.timestamp).label('day'),
-                func.count(Transaction.id).label('daily_count'),
-                func.sum(Transaction.amount).label('daily_total'),
-                func.sum(case((Transaction.type == 'profit', Transaction.amount), else_=0)).label('profit_sum'),
-                func.sum(case((Transaction.type == 'referral_bonus', Transaction.amount), else_=0)).label('ref_sum')
+                DailyLedgerRollup.day.label('day'),
+                func.sum(DailyLedgerRollup.row_count).label('daily_count'),
+                func.sum(DailyLedgerRollup.amount).label('daily_total'),
+                func.sum(case((DailyLedgerRollup.type == 'profit', DailyLedgerRollup.amount), else_=0)).label('profit_sum'),
+                func.sum(case((DailyLedgerRollup.type == 'referral_bonus', DailyLedgerRollup.amount), else_=0)).label('ref_sum')
             ).filter(
-                Transaction.type.in_(['profit', 'referral_bonus'])
+                DailyLedgerRollup.type.in_(['profit', 'referral_bonus'])
             )
             
             if start_date:
-                query = query.filter(Transaction.timestamp >= start_date)
+                query = query.filter(DailyLedgerRollup.day >= start_date.date())
             if end_date:
-                query = query.filter(Transaction.timestamp <= end_date)
+                query = query.filter(DailyLedgerRollup.day <= end_date.date())
                 
-            profit_logs = query.group_by(func.date(Transaction.timestamp))\
+            profit_logs = query.group_by(DailyLedgerRollup.day)\
                                .order_by(desc('day')).all()
 
     return render_template(
@@ -555,37 +832,137 @@ def accounting():
         end_date=end_date_str,
         users=users,
         is_detailed_view=is_detailed_view,
-        date_filter=date_filter
+        date_filter=date_filter,
+        profit_runs=profit_runs,
+        approx_count=approx_count,
+        export_args={k: v for k, v in request.args.items() if k not in ('cursor', 'direction')}
+    )
+
+@admin_bp.route('/accounting/export')
+@login_required
+@permission_required('view_ledger')
+def export_accounting():
+    # Full export of the current accounting view (same filters), read and written in fixed-size chunks
+    tab = request.args.get('tab', 'cash_flow')
+    export_format = request.args.get('format', 'csv')
+    if tab not in EXPORT_TABS or export_format not in EXPORT_FORMATS:
+        flash('Unsupported export.', 'danger')
+        return redirect(url_for('admin.accounting'))
+    if export_format == 'parquet' and not parquet_available():
+        flash('Parquet export requires pyarrow on the server. Use CSV instead.', 'warning')
+        return redirect(url_for('admin.accounting', tab=tab))
+
+    _, _, start_date, end_date = _date_range_args()
+    date_filter = request.args.get('date')
+    stmt, columns, name = export_statement(
+        tab,
+        search=request.args.get('search'),
+        start_date=start_date,
+        end_date=end_date,
+        user_id=request.args.get('user_id', type=int),
+        day=datetime.strptime(date_filter, '%Y-%m-%d').date() if date_filter else None,
+        tx_type=request.args.get('type')
+    )
+    filename = f"vesthub-{name}-{datetime.utcnow():%Y%m%d}.{export_format}"
+    log_admin_activity('Export Ledger', f'{filename} ({request.query_string.decode()})')
+
+    if export_format == 'csv':
+        return Response(
+            stream_with_context(stream_csv(stmt, columns)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename={filename}'}
+        )
+
+    # Parquet needs a seekable target: row groups are spooled to a temp file, then streamed from disk
+    spool = tempfile.TemporaryFile()
+    write_parquet(stmt, columns, spool)
+    spool.seek(0)
+    return send_file(spool, mimetype='application/vnd.apache.parquet', as_attachment=True, download_name=filename)
+
+@admin_bp.route('/api/archived-ledger')
+@login_required
+@permission_required('view_ledger')
+def api_archived_ledger():
+    # On-demand fetch of archived profit/referral rows for the detail views
+    day = request.args.get('date')
+    month = request.args.get('month')
+    rows = archived_rows(
+        user_id=request.args.get('user_id', type=int),
+        investment_id=request.args.get('investment_id', type=int),
+        day=datetime.strptime(day, '%Y-%m-%d').date() if day else None,
+        month=datetime.strptime(month, '%Y-%m').date() if month else None
     )
 
+    return jsonify({
+        'count': len(rows),
+        'truncated': len(rows) >= ARCHIVED_ROWS_LIMIT,
+        'rows': [{
+            'id': tx.id,
+            'user_id': tx.user_id,
+            'investment_id': tx.investment_id,
+            'type': tx.type,
+            'amount': float(tx.amount),
+            'profit_date': tx.profit_date.isoformat() if tx.profit_date else None,
+            'description': tx.description
+        } for tx in rows]
+    })
+
+@admin_bp.route('/api/referral-breakdown/<int:tx_id>')
+@login_required
+@permission_required('view_ledger')
+def api_referral_breakdown(tx_id):
+    # Per-source breakdown of an aggregated referral bonus posting
+    tx = Transaction.query.get_or_404(tx_id)
+    # Outer join: rows of deleted referees keep their amount with a nulled referee
+    details = db.session.query(ReferralBonusDetail, User.email).outerjoin(
+        User, ReferralBonusDetail.referee_id == User.id
+    ).filter(ReferralBonusDetail.transaction_id == tx.id).order_by(ReferralBonusDetail.source_investment_id).all()
+
+    return jsonify({
+        'transaction_id': tx.id,
+        'profit_date': tx.profit_date.isoformat() if tx.profit_date else None,
+        'amount': float(tx.amount),
+        'sources': [{
+            'investment_id': d.source_investment_id,
+            'referee_id': d.referee_id,
+            'referee_email': email,
+            'amount': float(d.amount)
+        } for d, email in details]
+    })
+
 # --- Test Route ---
 @admin_bp.route('/test/distribute-profit', methods=['POST'])
 @login_required
 @permission_required('manage_settings')
 def distribute_test_profit():
-    count = run_profit_distribution(current_app._get_current_object())
+    app = current_app._get_current_object()
+    if request.form.get('simulate'):
+        # Dry run: compute every payout in memory without touching the ledger
+        report = backfill_profits(app, simulate=True)
+        plans = ', '.join(
+            f"{name}: {plan['payouts']} / ${plan['amount']:,.2f}" for name, plan in sorted(report['plans'].items())
+        )
+        timings = report['timings']
+        log_admin_activity('Simulate Profit', f"Dry run: {report['payouts']} payouts")
+        flash(
+            f"Simulation: {report['payouts']} payouts (${report['profit_amount']:,.2f}) and "
+            f"{report['referral_rows']} referral bonuses (${report['referral_amount']:,.2f}) would be written. "
+            f"Per plan: {plans or '-'}. Timings: load {timings['load']:.2f}s, compute {timings['compute']:.2f}s, "
+            f"write {timings['write']:.2f}s ({report['rows_per_second']:,.0f} rows/s).",
+            'info'
+        )
+        return redirect(url_for('admin.accounting', tab='profit_logs'))
+
+    count = run_profit_distribution(app)
+    invalidate_admin_kpis()
     log_admin_activity('Distribute Profit', f'Manual run: {count} payouts')
     flash(f'Manual profit distribution completed. {count} payouts.', 'success')
     return redirect(url_for('admin.accounting'))
 
 @admin_bp.route('/api/chart/admin-stats')
 @login_required
+@permission_required('view_ledger')
 def api_admin_stats():
-    # آمار ثبت‌نام کاربران در ۷ روز گذشته
-    today = datetime.utcnow().date()
-    labels = []
-    data_users = []
-    
-    for i in range(6, -1, -1):
-        d = today - timedelta(days=i)
-        # شمارش کاربران ثبت‌نام شده در آن روز
-        count = User.query.filter(db.func.date(User.created_at) == d).count()
-        labels.append(d.strftime('%d %b'))
-        data_users.append(count)
-        
-    return jsonify({
-        'registrations': {
-            'labels': labels,
-            'data': data_users
-        }
-    })
\ No newline at end of file
+    # Dashboard KPIs (registrations, AUM, payouts, pending queues, plan allocation) from grouped
+    # queries, cached in process for ADMIN_KPI_CACHE_SECONDS; admin actions above invalidate it
+    return jsonify(admin_kpis(ttl=current_app.config.get('ADMIN_KPI_CACHE_SECONDS', 60)))
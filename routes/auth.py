@@ -4,10 +4,11 @@ import secrets
 import pyotp
 from flask import Blueprint, render_template, redirect, url_for, flash, request, session, current_app
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 from extensions import db, oauth
 from models import User, Role
+from passwords import password_hasher, PasswordHasherBusy
+from ratelimit import rate_limiter, too_many_attempts
 from utils import is_strong_password, generate_referral_code, send_system_email, log_admin_activity
 
 auth_bp = Blueprint('auth', __name__)
@@ -24,9 +25,25 @@ def login():
     if request.method == 'POST':
         email = request.form.get('email')
         password = request.form.get('password')
+
+        # Rejected before the user lookup and password verification
+        retry_after = rate_limiter.check('login', account=email)
+        if retry_after:
+            return too_many_attempts('login.html', retry_after)
+
         user = User.query.filter_by(email=email).first()
         
-        if user and check_password_hash(user.password, password):
+        try:
+            valid = user and user.is_active and password_hasher.verify(user.password, password)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return render_template('login.html'), 503
+
+        if valid:
+            # Hashes made with older parameters are upgraded on the next successful login
+            if password_hasher.upgrade(user, password):
+                db.session.commit()
+
             if not user.is_email_verified:
                 session['unverified_user_id'] = user.id
                 return redirect(url_for('auth.verify_email'))
@@ -74,12 +91,19 @@ def signup():
         ref_code = request.form.get('referral_code') or session.get('ref_code')
         referrer_id = None
         if ref_code:
-            ref_user = User.query.filter_by(referral_code=ref_code).first()
+            # Codes of users being deleted are ignored like unknown codes
+            ref_user = User.query.filter_by(referral_code=ref_code, pending_deletion=False).first()
             if ref_user: referrer_id = ref_user.id
 
+        try:
+            password_hash = password_hasher.hash(password)
+        except PasswordHasherBusy:
+            flash('The server is busy. Please try again in a moment.', 'warning')
+            return redirect(url_for('auth.signup'))
+
         new_user = User(
             email=email, 
-            password=generate_password_hash(password, method='pbkdf2:sha256'),
+            password=password_hash,
             first_name=first_name, 
             last_name=last_name,
             phone=request.form.get('phone'), 
@@ -105,6 +129,10 @@ def verify_email():
         return redirect(url_for('auth.login'))
     
     if request.method == 'POST':
+        retry_after = rate_limiter.check('verify_email', account=session['unverified_user_id'])
+        if retry_after:
+            return too_many_attempts('verify_email.html', retry_after)
+
         user = db.session.get(User, session['unverified_user_id'])
         if user and user.email_verification_code == request.form.get('code'):
             user.is_email_verified = True
@@ -122,6 +150,10 @@ def verify_2fa_login():
         return redirect(url_for('auth.login'))
     
     if request.method == 'POST':
+        retry_after = rate_limiter.check('verify_2fa', account=session['2fa_user_id'])
+        if retry_after:
+            return too_many_attempts('two_factor_verify.html', retry_after)
+
         user = db.session.get(User, session['2fa_user_id'])
         if user.two_factor_secret and pyotp.TOTP(user.two_factor_secret).verify(request.form.get('code')):
             login_user(user)
@@ -186,12 +218,18 @@ def social_auth_callback(provider):
             ref_code = session.get('ref_code')
             referrer_id = None
             if ref_code:
-                ref_user = User.query.filter_by(referral_code=ref_code).first()
+                ref_user = User.query.filter_by(referral_code=ref_code, pending_deletion=False).first()
                 if ref_user: referrer_id = ref_user.id
 
+            try:
+                password_hash = password_hasher.hash(random_pw)
+            except PasswordHasherBusy:
+                flash('The server is busy. Please try again in a moment.', 'warning')
+                return redirect(url_for('auth.login'))
+
             user = User(
                 email=email,
-                password=generate_password_hash(random_pw, method='pbkdf2:sha256'),
+                password=password_hash,
                 first_name=first_name,
                 last_name=last_name,
                 role=role_investor,
@@ -268,7 +306,11 @@ def reset_password(token):
             
         user = User.query.filter_by(email=email).first()
         if user:
-            user.password = generate_password_hash(password, method='pbkdf2:sha256')
+            try:
+                user.password = password_hasher.hash(password)
+            except PasswordHasherBusy:
+                flash('The server is busy. Please try again in a moment.', 'warning')
+                return render_template('reset_password.html', token=token)
             db.session.commit()
             flash('Your password has been updated! Please log in.', 'success')
             return redirect(url_for('auth.login'))
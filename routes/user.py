@@ -8,26 +8,23 @@ from flask_login import login_required, current_user
 from extensions import db
 from models import Investment, InvestmentPlan, Transaction, Ticket, TicketMessage, KYCRequest, User
 from utils import get_withdrawable_balance, get_setting, save_uploaded_file, send_system_email
+from ledger import record_new_transaction
+from dashboard import dashboard_summary, profit_growth, DEFAULT_GROWTH_RANGE
+from ratelimit import rate_limiter, too_many_attempts
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/dashboard')
 @login_required
 def dashboard():
-    total_invested = sum(inv.amount for inv in current_user.investments if inv.status == 'active')
-    total_profit = get_withdrawable_balance(current_user.id)
-    referral_count = len(current_user.referrals)
-    
-    referral_earnings = db.session.query(db.func.sum(Transaction.amount)).filter_by(
-        user_id=current_user.id, type='referral_bonus', status='completed'
-    ).scalar() or Decimal('0.0')
-    
+    summary = dashboard_summary(current_user.id)
+
     return render_template('dashboard.html', 
                            user=current_user, 
-                           total_invested=total_invested, 
-                           total_profit=total_profit, 
-                           referral_count=referral_count, 
-                           referral_earnings=referral_earnings, 
+                           total_invested=summary['invested'], 
+                           total_profit=summary['balance'], 
+                           referral_count=summary['referral_count'], 
+                           referral_earnings=summary['referral_earnings'], 
                            active_investments=current_user.investments)
 
 @user_bp.route('/invest-plans')
@@ -188,16 +185,23 @@ def withdrawal():
         flash('Please enable Two-Factor Authentication (2FA) in Settings to request withdrawals.', 'warning')
         return redirect(url_for('user.settings'))
     
+    verifying = request.method == 'POST' and 'verify_withdrawal' in request.form
+    if verifying:
+        # Throttled attempts are rejected before the history query; the balance is a primary-key read
+        retry_after = rate_limiter.check('withdrawal_code', account=current_user.id)
+        if retry_after:
+            return too_many_attempts('withdrawal.html', retry_after, available_balance=get_withdrawable_balance(current_user.id), locked_balance=Decimal('0'), history=[], verify_mode=True)
+
     available = get_withdrawable_balance(current_user.id)
     history = Transaction.query.filter_by(user_id=current_user.id, type='withdrawal').order_by(Transaction.timestamp.desc()).all()
     
     # --- STEP 2: VERIFICATION & CONFIRMATION ---
-    if request.method == 'POST' and 'verify_withdrawal' in request.form:
+    if verifying:
         pending_data = session.get('pending_withdrawal')
         if not pending_data:
             flash('Withdrawal session expired. Please try again.', 'danger')
             return redirect(url_for('user.withdrawal'))
-            
+
         email_code_input = request.form.get('email_code')
         ga_code_input = request.form.get('ga_code')
         
@@ -219,7 +223,9 @@ def withdrawal():
             current_available = get_withdrawable_balance(user.id)
             
             if amt <= current_available:
-                db.session.add(Transaction(user_id=user.id, type='withdrawal', amount=amt, status='pending', description='User withdrawal request'))
+                wd_tx = Transaction(user_id=user.id, type='withdrawal', amount=amt, status='pending', description='User withdrawal request')
+                db.session.add(wd_tx)
+                record_new_transaction(wd_tx)
                 db.session.commit()
                 session.pop('pending_withdrawal', None) # Clear session
                 flash('Withdrawal request submitted successfully.', 'success')
@@ -396,42 +402,17 @@ def ticket_view(ticket_id):
 @user_bp.route('/api/chart/user-data')
 @login_required
 def api_user_data():
-    # محاسبه مجموع سرمایه‌گذاری‌های فعال
-    total_invested = sum(inv.amount for inv in current_user.investments if inv.status == 'active')
-    
-    # محاسبه سود قابل برداشت
-    total_profit = get_withdrawable_balance(current_user.id)
-    
-    # محاسبه درآمد حاصل از رفرال
-    referral_earnings = db.session.query(db.func.sum(Transaction.amount)).filter_by(
-        user_id=current_user.id, type='referral_bonus', status='completed'
-    ).scalar() or Decimal('0.0')
-
-    # داده‌های نمودار رشد (۷ روز گذشته)
-    today = datetime.utcnow().date()
-    growth_labels = []
-    growth_data = []
-    
-    for i in range(6, -1, -1):
-        d = today - timedelta(days=i)
-        # محاسبه سود روزانه
-        daily_sum = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.user_id == current_user.id,
-            Transaction.type == 'profit',
-            db.func.date(Transaction.timestamp) == d
-        ).scalar() or Decimal('0.0')
-        
-        growth_labels.append(d.strftime('%d %b')) # نمونه: 12 Dec
-        growth_data.append(float(daily_sum))
+    # سرمایه فعال، سود قابل برداشت و درآمد رفرال در یک کوئری
+    summary = dashboard_summary(current_user.id)
+
+    # داده‌های نمودار رشد: یک کوئری گروه‌بندی شده برای کل بازه (?range=7d|30d|90d|1y)
+    growth = profit_growth(current_user.id, request.args.get('range', DEFAULT_GROWTH_RANGE))
 
     return jsonify({
         'assets': {
-            'invested': float(total_invested), 
-            'profit': float(total_profit), 
-            'referral': float(referral_earnings)
+            'invested': float(summary['invested']), 
+            'profit': float(summary['balance']), 
+            'referral': float(summary['referral_earnings'])
         },
-        'growth': {
-            'labels': growth_labels,
-            'data': growth_data
-        }
+        'growth': growth
     })
\ No newline at end of file
@@ -19,7 +19,15 @@ source "$VENV_ACTIVATE"
 export FLASK_APP=app.py
 
 # 5. Run Command & Append to Log
-echo "[$(date)] Starting Profit Recovery..." >> "$LOG_FILE"
-flask recover-profits >> "$LOG_FILE" 2>&1
+# PROFIT_WORKERS > 1 splits active investments into id-range shards processed in parallel
+PROFIT_WORKERS="${PROFIT_WORKERS:-1}"
+echo "[$(date)] Starting Profit Recovery (workers: $PROFIT_WORKERS)..." >> "$LOG_FILE"
+flask recover-profits --workers "$PROFIT_WORKERS" >> "$LOG_FILE" 2>&1
+# Move settled profit rows older than LEDGER_ARCHIVE_DAYS into the archive table (no-op most days)
+flask archive-ledger >> "$LOG_FILE" 2>&1
+# Move audit log entries older than AUDIT_LOG_RETENTION_DAYS into compressed archive files
+flask compact-audit-logs >> "$LOG_FILE" 2>&1
+# Resume user deletion jobs interrupted by a worker restart
+flask process-user-deletions >> "$LOG_FILE" 2>&1
 echo "[$(date)] Finished." >> "$LOG_FILE"
 echo "----------------------------------------" >> "$LOG_FILE"
\ No newline at end of file
@@ -0,0 +1,214 @@
+"""
+ماژول ایندکس جستجو (Full-Text Search).
+
+جستجوی ilike('%term%') با wildcard ابتدایی از هیچ ایندکس B-tree استفاده نمی‌کند و کل دفتر کل را
+اسکن می‌کند. این ماژول بسته به دیتابیس یک ایندکس جستجوی زیررشته نگه می‌دارد:
+  - SQLite: جداول مجازی FTS5 با tokenizer سه‌حرفی (trigram) روی users و تراکنش‌های واریز/برداشت،
+    که با trigger در هر INSERT/UPDATE/DELETE همگام می‌شوند (شامل درج‌های دسته‌ای Core).
+  - PostgreSQL: ایندکس‌های GIN با gin_trgm_ops (افزونه pg_trgm) که خود دیتابیس همگام نگه می‌دارد.
+عبارت‌های کوتاه‌تر از SEARCH_MIN_LENGTH (یا دیتابیس بدون ایندکس) به ilike ساده برمی‌گردند.
+
+نصب/بازسازی: flask upgrade-db (مهاجرت ۵) یا flask rebuild-search-index
+"""
+
+from sqlalchemy import Integer, column, func, literal_column, or_, select, text, union
+from extensions import db
+from models import User, Transaction
+
+# حداقل طول عبارت برای استفاده از ایندکس trigram
+SEARCH_MIN_LENGTH = 3
+# فقط تراکنش‌های جریان نقدی در جستجوی حسابداری نمایش داده می‌شوند
+SEARCHABLE_TX_TYPES = ('deposit', 'withdrawal')
+
+_TX_TYPES_SQL = ', '.join(f"'{t}'" for t in SEARCHABLE_TX_TYPES)
+
+_SQLITE_SCHEMA = [
+    # --- users ---
+    # full_name ستون جدول users نیست (عبارت first_name || ' ' || last_name مثل ix_users_name_trgm)؛
+    # به همین دلیل rebuild داخلی FTS5 استفاده نمی‌شود و rebuild_search_index ردیف‌ها را خودش درج می‌کند
+    """CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+        email, full_name, phone, referral_code,
+        content='users', content_rowid='id', tokenize='trigram')""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, email, full_name, phone, referral_code)
+        VALUES (new.id, new.email, new.first_name || ' ' || new.last_name, new.phone, new.referral_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, full_name, phone, referral_code)
+        VALUES ('delete', old.id, old.email, old.first_name || ' ' || old.last_name, old.phone, old.referral_code);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF email, first_name, last_name, phone, referral_code ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, email, full_name, phone, referral_code)
+        VALUES ('delete', old.id, old.email, old.first_name || ' ' || old.last_name, old.phone, old.referral_code);
+        INSERT INTO users_fts(rowid, email, full_name, phone, referral_code)
+        VALUES (new.id, new.email, new.first_name || ' ' || new.last_name, new.phone, new.referral_code);
+    END""",
+    # --- transactions (فقط واریز و برداشت؛ ردیف‌های سود روزانه ایندکس نمی‌شوند) ---
+    """CREATE VIRTUAL TABLE IF NOT EXISTS transactions_fts USING fts5(
+        tx_hash, description,
+        content='transactions', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_ai AFTER INSERT ON transactions
+        WHEN new.type IN ({_TX_TYPES_SQL}) BEGIN
+        INSERT INTO transactions_fts(rowid, tx_hash, description) VALUES (new.id, new.tx_hash, new.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_ad AFTER DELETE ON transactions
+        WHEN old.type IN ({_TX_TYPES_SQL}) BEGIN
+        INSERT INTO transactions_fts(transactions_fts, rowid, tx_hash, description)
+        VALUES ('delete', old.id, old.tx_hash, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_au_old AFTER UPDATE OF type, tx_hash, description ON transactions
+        WHEN old.type IN ({_TX_TYPES_SQL}) BEGIN
+        INSERT INTO transactions_fts(transactions_fts, rowid, tx_hash, description)
+        VALUES ('delete', old.id, old.tx_hash, old.description);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS transactions_fts_au_new AFTER UPDATE OF type, tx_hash, description ON transactions
+        WHEN new.type IN ({_TX_TYPES_SQL}) BEGIN
+        INSERT INTO transactions_fts(rowid, tx_hash, description) VALUES (new.id, new.tx_hash, new.description);
+    END""",
+]
+
+_POSTGRES_SCHEMA = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_users_email_trgm ON users USING gin (email gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_name_trgm ON users USING gin ((first_name || ' ' || last_name) gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_phone_trgm ON users USING gin (phone gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_users_referral_code_trgm ON users USING gin (referral_code gin_trgm_ops)",
+    f"""CREATE INDEX IF NOT EXISTS ix_transactions_tx_hash_trgm ON transactions
+        USING gin (tx_hash gin_trgm_ops) WHERE type IN ({_TX_TYPES_SQL})""",
+    f"""CREATE INDEX IF NOT EXISTS ix_transactions_description_trgm ON transactions
+        USING gin (description gin_trgm_ops) WHERE type IN ({_TX_TYPES_SQL})""",
+]
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+def drop_user_search_index():
+    """حذف جدول FTS کاربران و triggerهای آن در SQLite (برای ساخت دوباره با install_search_index)."""
+    if _dialect() != 'sqlite':
+        return
+    for trigger in ('users_fts_ai', 'users_fts_ad', 'users_fts_au'):
+        db.session.execute(text(f'DROP TRIGGER IF EXISTS {trigger}'))
+    db.session.execute(text('DROP TABLE IF EXISTS users_fts'))
+
+def install_search_index():
+    """ساخت ایندکس جستجو (idempotent). در SQLite جداول FTS از روی داده‌های فعلی پر می‌شوند."""
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        existed = search_index_available()
+        for statement in _SQLITE_SCHEMA:
+            db.session.execute(text(statement))
+        if not existed:
+            rebuild_search_index()
+    elif dialect == 'postgresql':
+        for statement in _POSTGRES_SCHEMA:
+            db.session.execute(text(statement))
+
+def rebuild_search_index():
+    """بازسازی کامل جداول FTS در SQLite (در PostgreSQL ایندکس‌ها همیشه همگام هستند)."""
+    if _dialect() != 'sqlite':
+        return
+    db.session.execute(text("INSERT INTO users_fts(users_fts) VALUES ('delete-all')"))
+    db.session.execute(text(
+        "INSERT INTO users_fts(rowid, email, full_name, phone, referral_code) "
+        "SELECT id, email, first_name || ' ' || last_name, phone, referral_code FROM users"
+    ))
+    db.session.execute(text("INSERT INTO transactions_fts(transactions_fts) VALUES ('delete-all')"))
+    db.session.execute(text(
+        f"INSERT INTO transactions_fts(rowid, tx_hash, description) "
+        f"SELECT id, tx_hash, description FROM transactions WHERE type IN ({_TX_TYPES_SQL})"
+    ))
+
+def search_index_available():
+    dialect = _dialect()
+    if dialect == 'sqlite':
+        return db.session.execute(text(
+            "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN ('users_fts', 'transactions_fts')"
+        )).scalar() == 2
+    # PostgreSQL: ilike از ایندکس trigram (در صورت وجود) استفاده می‌کند
+    return dialect == 'postgresql'
+
+def _use_fts(term):
+    return _dialect() == 'sqlite' and len(term) >= SEARCH_MIN_LENGTH and search_index_available()
+
+def _fts_phrase(term):
+    # عبارت به صورت phrase در FTS5 (نقل قول داخلی دوبل می‌شود)
+    return '"' + term.replace('"', '""') + '"'
+
+def _fts_rowids(table, param, term):
+    return text(f"SELECT rowid FROM {table} WHERE {table} MATCH :{param}").bindparams(
+        **{param: _fts_phrase(term)}
+    ).columns(column('rowid', Integer))
+
+def _full_name():
+    # باید دقیقاً با عبارت ایندکس ix_users_name_trgm (و ستون full_name در users_fts) یکسان باشد
+    return User.first_name + literal_column("' '") + User.last_name
+
+def _user_match_ids(term):
+    # همه ستون‌های این شرط در PostgreSQL ایندکس trigram دارند (_POSTGRES_SCHEMA)؛ ستون بدون ایندکس
+    # کل OR را به اسکن کامل users برمی‌گرداند
+    if _use_fts(term):
+        return _fts_rowids('users_fts', 'users_fts_term', term)
+    pattern = f'%{term}%'
+    return select(User.id).where(or_(
+        User.email.ilike(pattern),
+        _full_name().ilike(pattern),
+        User.phone.ilike(pattern),
+        User.referral_code.ilike(pattern)
+    ))
+
+def transaction_search_condition(term):
+    """
+    شرط جستجوی تراکنش‌های حسابداری (ایمیل کاربر، TxID، توضیحات، یا شناسه عددی).
+    هر شاخه جداگانه از ایندکس خودش استفاده می‌کند و نتیجه با UNION ترکیب می‌شود.
+    نتیجه عمداً رتبه‌بندی نمی‌شود: دفتر جریان نقدی به ترتیب زمان (keyset روی timestamp و id) مرور می‌شود،
+    جمع واریز/برداشت و خروجی CSV/Parquet همان ترتیب را دارند و یک تراکنش با هر شاخه‌ای که پیدا شده باشد
+    (کاربر، TxID یا توضیحات) به یک اندازه مرتبط است.
+    """
+    term = term.strip()
+    if _use_fts(term):
+        by_text = _fts_rowids('transactions_fts', 'transactions_fts_term', term)
+    else:
+        pattern = f'%{term}%'
+        by_text = union(
+            select(Transaction.id).where(Transaction.type.in_(SEARCHABLE_TX_TYPES), Transaction.tx_hash.ilike(pattern)),
+            select(Transaction.id).where(Transaction.type.in_(SEARCHABLE_TX_TYPES), Transaction.description.ilike(pattern))
+        )
+    by_user = select(Transaction.id).where(Transaction.user_id.in_(_user_match_ids(term)))
+
+    condition = or_(Transaction.id.in_(by_text), Transaction.id.in_(by_user))
+    if term.isdigit():
+        condition = or_(condition, Transaction.id == int(term))
+    return condition
+
+def search_users(term, page=1, per_page=50):
+    """
+    جستجوی رتبه‌بندی شده کاربران. خروجی: (شناسه‌های کاربران به ترتیب رتبه، آیا صفحه بعد وجود دارد)
+    SQLite: رتبه bm25 در FTS5؛ PostgreSQL: شباهت trigram؛ عبارت کوتاه: جدیدترین کاربران.
+    """
+    term = term.strip()
+    offset = (max(page, 1) - 1) * per_page
+    dialect = _dialect()
+
+    if _use_fts(term):
+        ids = [row[0] for row in db.session.execute(
+            text("SELECT rowid FROM users_fts WHERE users_fts MATCH :term ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {'term': _fts_phrase(term), 'limit': per_page + 1, 'offset': offset}
+        )]
+    else:
+        query = select(User.id).where(User.id.in_(_user_match_ids(term)))
+        if dialect == 'postgresql' and len(term) >= SEARCH_MIN_LENGTH:
+            query = query.order_by(func.greatest(
+                func.similarity(User.email, term),
+                func.similarity(_full_name(), term),
+                func.similarity(User.phone, term),
+                func.similarity(User.referral_code, term)
+            ).desc(), User.id.desc())
+        else:
+            query = query.order_by(User.id.desc())
+        ids = list(db.session.execute(query.limit(per_page + 1).offset(offset)).scalars())
+
+    has_next = len(ids) > per_page
+    ids = ids[:per_page]
+    if term.isdigit() and page == 1 and int(term) not in ids and db.session.get(User, int(term)):
+        ids.insert(0, int(term))
+    return ids, has_next
@@ -9,7 +9,7 @@
 """
 
 import os
-from app import create_app
+from factory import create_app
 from extensions import db
 from models import Role, User, InvestmentPlan, SystemSetting
 from werkzeug.security import generate_password_hash
@@ -3,11 +3,25 @@
 شامل توزیع سود روزانه و سیستم بازیابی سودهای عقب‌افتاده.
 """
 
-from datetime import datetime, timedelta, date
+import time
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
 from decimal import Decimal
-from sqlalchemy import func
+from sqlalchemy import and_, false, func, insert, or_, text, update
 from extensions import db
 
+# تعداد سرمایه‌گذاری‌هایی که در هر دسته (chunk) پردازش و با یک commit ثبت می‌شوند
+DEFAULT_PROFIT_BATCH_SIZE = 500
+# اجرای running که این مدت heartbeat نداشته از کار افتاده فرض و قابل ادامه می‌شود
+DEFAULT_RUN_STALE_MINUTES = 30
+
+# توضیح تراکنش تجمیعی پاداش معرف (یک ردیف برای هر معرف در هر روز)
+AGGREGATED_REFERRAL_DESCRIPTION = "Aggregated referral bonus for {day}"
+
+# کلیدهای کمکی ردیف‌های پاداش معرف که ستون جدول transactions نیستند
+_REFERRAL_SOURCE_KEYS = ('source_investment_id', 'referee_id')
+
 def run_profit_distribution(app):
     """وظیفه توزیع سود روزانه (اجرا توسط Scheduler)."""
     # تغییر استراتژی: استفاده از تابع Backfill برای اطمینان از محاسبه روزهای از قلم افتاده
@@ -15,96 +29,609 @@ def run_profit_distribution(app):
     app.logger.info("--- Scheduler Triggered: Delegating to process_missed_profits ---")
     return process_missed_profits(app)
 
-def process_missed_profits(app):
+def process_missed_profits(app, batch_size=None, simulate=False):
     """
     سیستم بازیابی و جبران سودهای پرداخت نشده (Backfill).
+    خروجی: تعداد سودهای روزانه ثبت شده (برای سازگاری با فراخوان‌های قبلی).
+    در حالت simulate فقط محاسبه انجام می‌شود و تعداد سودهایی که ثبت می‌شدند برگردانده می‌شود.
+    """
+    report = backfill_profits(app, batch_size=batch_size, simulate=simulate)
+    return report['payouts']
+
+def backfill_profits(app, batch_size=None, min_id=None, max_id=None, shard=None, resume=True, simulate=False):
+    """
+    موتور دسته‌ای (set-based) محاسبه سودهای عقب‌افتاده.
+
+    به جای یک کوئری، یک INSERT و یک commit برای هر (سرمایه‌گذاری، روز)،
+    سرمایه‌گذاری‌های فعال به صورت دسته‌ای بر اساس id خوانده می‌شوند، روزهای پرداخت شده
+    با یک کوئری برای کل دسته استخراج می‌شوند و ردیف‌های سود، پاداش معرف و آپدیت
+    last_profit_date با چند دستور executemany و یک commit در هر دسته ثبت می‌شوند.
+    نتیجه دقیقاً مشابه حلقه قبلی (ردیف به ردیف) است.
+
+    با min_id/max_id (شامل) فقط یک بازه از شناسه‌های سرمایه‌گذاری پردازش می‌شود (اجرای shard).
+
+    هر اجرا در جدول profit_runs ثبت می‌شود و checkpoint (آخرین id پردازش شده) در همان
+    تراکنشِ commit هر دسته ذخیره می‌شود. اگر اجرای ناتمامی برای همین روز و همین بازه وجود
+    داشته باشد (و resume=True)، پردازش از checkpoint آن ادامه پیدا می‌کند.
+
+    در حالت simulate هیچ چیزی در دیتابیس نوشته نمی‌شود (نه دفتر کل، نه ژورنال)؛ تمام
+    پرداخت‌ها در حافظه محاسبه و در گزارش (جمع به تفکیک پلن، جمع پاداش معرف) برگردانده می‌شوند.
+
+    خروجی: دیکشنری گزارش اجرا شامل تعداد ردیف‌ها، مبالغ، خطاها، زمان هر مرحله
+    (load, compute, write) و سرعت (ردیف در ثانیه).
     """
     with app.app_context():
-        from models import Investment, Transaction, SystemSetting
-        
-        app.logger.info("--- Starting Profit Backfill & Recovery ---")
-        
+        from models import SystemSetting, ProfitRun
+
+        mode = 'Simulation' if simulate else 'Backfill & Recovery'
+        app.logger.info(f"--- Starting Profit {mode} ---")
+        batch_size = batch_size or app.config.get('PROFIT_BATCH_SIZE', DEFAULT_PROFIT_BATCH_SIZE)
+
         ref_setting = db.session.get(SystemSetting, 'referral_percentage')
         ref_percent = Decimal(ref_setting.value) if ref_setting else Decimal('2.0')
-        
-        active_investments = Investment.query.filter_by(status='active').all()
+        # حالت تجمیعی: یک ردیف پاداش برای هر معرف در هر روز + جدول ریز پاداش‌ها
+        aggregation_setting = db.session.get(SystemSetting, 'referral_aggregation')
+        aggregate_referrals = bool(aggregation_setting and aggregation_setting.value == '1')
+
         today = datetime.utcnow().date()
-        total_recovered = 0
-        
-        for inv in active_investments:
+        run = None
+        previous = None
+        if not simulate:
+            stale_before = _stale_before(app)
+            live = find_live_run(today, min_id, max_id, stale_before)
+            if live:
+                # اجرای همزمان (مثلاً cron و scheduler) همان بازه را دو بار پردازش می‌کرد
+                message = f"Profit run #{live.id} is still running for this id range; not starting another run"
+                app.logger.warning(message)
+                report = _new_report(min_id, max_id, simulate)
+                report['errors'].append(message)
+                return report
+            previous = find_resumable_run(today, min_id, max_id, stale_before) if resume else None
+            run = ProfitRun(
+                run_date=today,
+                status='running',
+                min_investment_id=min_id,
+                max_investment_id=max_id,
+                shard=shard,
+                resumed_from_id=previous.id if previous else None,
+                last_investment_id=previous.last_investment_id if previous else None
+            )
+            run.heartbeat_at = datetime.utcnow()
+            db.session.add(run)
+            if previous:
+                # اجرای قبلی با این اجرا ادامه پیدا می‌کند و دیگر قابل ادامه نیست
+                previous.status = 'resumed'
+            db.session.commit()
+
+        report = _new_report(min_id, max_id, simulate)
+        report['run_id'] = run.id if run else None
+        report['resumed_from'] = previous.id if previous else None
+        timings = report['timings']
+        started = time.perf_counter()
+        last_id = min_id - 1 if min_id else 0
+        if previous and previous.last_investment_id is not None:
+            last_id = max(last_id, previous.last_investment_id)
+            app.logger.info(f"Resuming run #{previous.id} from investment {last_id}")
+        # پس از اولین خطا checkpoint جلو نمی‌رود تا ادامه اجرا دسته ناموفق را دوباره امتحان کند
+        checkpoint_frozen = False
+
+        while True:
+            phase_started = time.perf_counter()
+            # قفل کردن رکوردهای دسته (جز در شبیه‌سازی) برای جلوگیری از تداخل با اجرای همزمان
+            chunk = _active_chunk_query(last_id, max_id, batch_size, lock=not simulate).all()
+            timings['load'] += time.perf_counter() - phase_started
+
+            if not chunk:
+                db.session.commit()
+                break
+            last_id = chunk[-1].id
+
             try:
-                # قفل کردن رکورد برای جلوگیری از تداخل (اضافه شده برای امنیت بیشتر)
-                locked_inv = db.session.query(Investment).filter_by(id=inv.id).with_for_update().first()
-                if not locked_inv or locked_inv.status != 'active':
-                    db.session.commit()
-                    continue
+                phase_started = time.perf_counter()
+                profit_rows, referral_rows = _compute_chunk_payouts(chunk, today, ref_percent)
+                timings['compute'] += time.perf_counter() - phase_started
 
-                # تعیین تاریخ شروع بررسی: یک روز بعد از آخرین سود، یا تاریخ شروع سرمایه‌گذاری
-                if locked_inv.last_profit_date:
-                    current_date = locked_inv.last_profit_date + timedelta(days=1)
+                phase_started = time.perf_counter()
+                if simulate:
+                    referral_ledger_rows = _count_referral_ledger_rows(referral_rows, aggregate_referrals)
+                    db.session.rollback()
                 else:
-                    current_date = locked_inv.start_date.date()
-                
-                # حلقه برای تک تک روزهای عقب افتاده تا امروز
-                while current_date <= today:
-                    # 1. چک کردن اینکه آیا برای این روز خاص قبلاً سود واریز شده؟ (بسیار مهم)
-                    existing_tx = Transaction.query.filter(
-                        Transaction.investment_id == locked_inv.id,
-                        Transaction.type == 'profit',
-                        func.date(Transaction.timestamp) == current_date
-                    ).first()
-                    
-                    if existing_tx:
-                        # اگر قبلاً واریز شده، برو به روز بعد
-                        current_date += timedelta(days=1)
-                        continue
-                    
-                    # 2. محاسبه سود
-                    daily_profit = (locked_inv.amount * (locked_inv.plan.annual_return_rate / Decimal('100.0'))) / Decimal('365.0')
-                    daily_profit = daily_profit.quantize(Decimal('0.0001'))
-                    
-                    # تنظیم ساعت واریز به ۱۲ ظهر همان روز تاریخی
-                    payout_timestamp = datetime.combine(current_date, datetime.min.time()) + timedelta(hours=12)
-                    
-                    # 3. ثبت تراکنش
-                    user_tx = Transaction(
-                        user_id=locked_inv.user_id,
-                        investment_id=locked_inv.id,
-                        type='profit',
-                        amount=daily_profit,
-                        description=f"Recovered profit for {current_date}",
-                        status='completed',
-                        timestamp=payout_timestamp
+                    profit_rows, referral_rows, referral_ledger_rows = _write_chunk_payouts(
+                        profit_rows, referral_rows, aggregate_referrals
                     )
-                    db.session.add(user_tx)
-                    
-                    # 4. پاداش معرف
-                    if locked_inv.user.referrer_id:
-                        bonus = (daily_profit * (ref_percent / Decimal('100.0'))).quantize(Decimal('0.0001'))
-                        if bonus > Decimal('0'):
-                            ref_tx = Transaction(
-                                user_id=locked_inv.user.referrer_id,
-                                type='referral_bonus',
-                                amount=bonus,
-                                description=f"Referral bonus recovery {current_date}",
-                                status='completed',
-                                timestamp=payout_timestamp
-                            )
-                            db.session.add(ref_tx)
-                    
-                    # آپدیت آخرین تاریخ سود
-                    if not locked_inv.last_profit_date or current_date > locked_inv.last_profit_date:
-                        locked_inv.last_profit_date = current_date
-                        
+                    run.investments_processed += len(chunk)
+                    run.payouts += len(profit_rows)
+                    run.referral_rows += referral_ledger_rows
+                    if not checkpoint_frozen:
+                        run.last_investment_id = last_id
+                    run.heartbeat_at = datetime.utcnow()
                     db.session.commit()
-                    app.logger.info(f"Recovered profit for Investment {locked_inv.id} on {current_date}")
-                    total_recovered += 1
-                    
-                    current_date += timedelta(days=1)
-                    
+                timings['write'] += time.perf_counter() - phase_started
+
+                _tally_chunk(report, chunk, profit_rows, referral_rows, referral_ledger_rows)
             except Exception as e:
-                app.logger.error(f"Error recovering investment {inv.id}: {e}")
                 db.session.rollback()
-                
-        app.logger.info(f"--- Backfill Completed. Total recovered payouts: {total_recovered} ---")
-        return total_recovered
\ No newline at end of file
+                message = f"Error recovering investments {chunk[0].id}-{last_id}: {e}"
+                app.logger.error(message)
+                report['errors'].append(message)
+                if run is not None:
+                    checkpoint_frozen = True
+                    run.error_count += 1
+                    run.last_error = message
+                    run.heartbeat_at = datetime.utcnow()
+                    db.session.commit()
+
+        if run is not None:
+            run.status = 'failed' if report['errors'] else 'completed'
+            run.finished_at = datetime.utcnow()
+            db.session.commit()
+
+        report['elapsed'] = time.perf_counter() - started
+        rows = report['payouts'] + report['referral_rows']
+        report['rows_per_second'] = rows / report['elapsed'] if report['elapsed'] else 0.0
+
+        app.logger.info(
+            f"--- {mode} Completed{f' (run #{run.id})' if run else ''}. "
+            f"Total {'simulated' if simulate else 'recovered'} payouts: {report['payouts']} "
+            f"({report['referral_rows']} referral rows, {report['rows_per_second']:.0f} rows/s; "
+            f"load {timings['load']:.2f}s, compute {timings['compute']:.2f}s, write {timings['write']:.2f}s) ---"
+        )
+        return report
+
+def _new_report(min_id=None, max_id=None, simulate=False):
+    """ساختار خالی گزارش اجرای موتور سود."""
+    return {
+        'simulated': simulate,
+        'run_id': None,
+        'resumed_from': None,
+        'min_id': min_id,
+        'max_id': max_id,
+        'investments': 0,
+        'payouts': 0,
+        'referral_rows': 0,
+        'referral_bonuses': 0,
+        'profit_amount': Decimal('0'),
+        'referral_amount': Decimal('0'),
+        'plans': {},
+        'timings': {'load': 0.0, 'compute': 0.0, 'write': 0.0},
+        'errors': [],
+        'elapsed': 0.0,
+        'rows_per_second': 0.0,
+    }
+
+def _write_chunk_payouts(profit_rows, referral_rows, aggregate_referrals=False):
+    """
+    ثبت ردیف‌های محاسبه شده یک دسته در دیتابیس (بدون commit).
+    خروجی: (ردیف‌های سود درج شده، پاداش‌های معرف اعمال شده، تعداد ردیف‌های پاداش درج شده در دفتر کل)
+    """
+    from models import Investment, Transaction
+    from ledger import apply_balance_deltas, apply_rollup_deltas, rollup_deltas
+
+    written = set()
+    if profit_rows:
+        # ایندکس یکتای (investment_id, profit_date) مانع ثبت تکراری در اجراهای همزمان می‌شود؛
+        # فقط ردیف‌هایی که واقعاً درج شده‌اند پاداش معرف و آپدیت last_profit_date می‌گیرند.
+        result = db.session.execute(
+            _insert_ignoring_duplicates(Transaction).returning(
+                Transaction.investment_id, Transaction.profit_date
+            ),
+            profit_rows
+        )
+        written = {(row.investment_id, row.profit_date) for row in result}
+        profit_rows = [r for r in profit_rows if (r['investment_id'], r['profit_date']) in written]
+
+    referral_rows = [r for r in referral_rows if (r['source_investment_id'], r['profit_date']) in written]
+
+    profit_dates = {}
+    for inv_id, day in written:
+        if inv_id not in profit_dates or day > profit_dates[inv_id]:
+            profit_dates[inv_id] = day
+
+    rollup = rollup_deltas(profit_rows + referral_rows)
+    if not referral_rows:
+        referral_ledger_rows = 0
+    elif aggregate_referrals:
+        new_referral_days = _write_aggregated_referrals(referral_rows)
+        referral_ledger_rows = len(new_referral_days)
+        # در حالت تجمیعی فقط تراکنش‌های تازه درج شده به تعداد ردیف‌های روز اضافه می‌شوند
+        for day in {row['profit_date'] for row in referral_rows}:
+            rollup[(day, 'referral_bonus')][0] = new_referral_days.count(day)
+    else:
+        db.session.execute(insert(Transaction), [
+            {k: v for k, v in r.items() if k not in _REFERRAL_SOURCE_KEYS} for r in referral_rows
+        ])
+        referral_ledger_rows = len(referral_rows)
+
+    if profit_dates:
+        db.session.execute(update(Investment), [
+            {'id': inv_id, 'last_profit_date': last_date}
+            for inv_id, last_date in profit_dates.items()
+        ])
+
+    # به‌روزرسانی موجودی‌های تجمیعی در همان تراکنش دسته
+    earnings = {}
+    for row in profit_rows + referral_rows:
+        earnings[row['user_id']] = earnings.get(row['user_id'], Decimal('0')) + row['amount']
+    apply_balance_deltas({user_id: {'earnings': amount} for user_id, amount in earnings.items()})
+    apply_rollup_deltas(rollup)
+
+    return profit_rows, referral_rows, referral_ledger_rows
+
+def _write_aggregated_referrals(referral_rows):
+    """
+    ثبت پاداش‌های معرف به صورت تجمیعی: یک تراکنش برای هر (معرف، روز) که در صورت وجود
+    (از دسته‌ها یا اجراهای دیگر) مبلغش افزایش می‌یابد، به همراه یک ردیف ریز پاداش برای هر سرمایه‌گذاری منبع.
+    خروجی: لیست profit_date تراکنش‌های جدید درج شده در دفتر کل (یک عضو برای هر تراکنش).
+    """
+    from models import Transaction, ReferralBonusDetail
+
+    totals = {}
+    for row in referral_rows:
+        key = (row['user_id'], row['profit_date'])
+        totals[key] = totals.get(key, Decimal('0')) + row['amount']
+
+    # درج یا افزایش مبلغ در یک دستور روی ایندکس یکتای uq_transactions_aggregated_referral،
+    # تا دو اجرای همزمان برای یک (معرف، روز) دو ردیف نسازند
+    result = db.session.execute(
+        _upsert_aggregated_referrals().returning(
+            Transaction.id, Transaction.user_id, Transaction.profit_date, Transaction.amount
+        ),
+        [
+            {
+                'user_id': user_id,
+                'investment_id': None,
+                'type': 'referral_bonus',
+                'amount': amount,
+                'description': AGGREGATED_REFERRAL_DESCRIPTION.format(day=day),
+                'status': 'completed',
+                'timestamp': datetime.combine(day, datetime.min.time()) + timedelta(hours=12),
+                'tx_hash': None,
+                'profit_date': day,
+                'aggregated': True,
+            }
+            for (user_id, day), amount in totals.items()
+        ]
+    )
+    tx_ids = {}
+    new_days = []
+    for row in result:
+        key = (row.user_id, row.profit_date)
+        tx_ids[key] = row.id
+        # مبلغ ردیف موجود همیشه مثبت است؛ پس مبلغ برگشتی فقط برای ردیف تازه درج شده برابر سهم همین دسته است
+        if row.amount == totals[key]:
+            new_days.append(row.profit_date)
+
+    db.session.execute(insert(ReferralBonusDetail), [
+        {
+            'transaction_id': tx_ids[(row['user_id'], row['profit_date'])],
+            'source_investment_id': row['source_investment_id'],
+            'referee_id': row['referee_id'],
+            'profit_date': row['profit_date'],
+            'amount': row['amount'],
+        }
+        for row in referral_rows
+    ])
+    return new_days
+
+def _count_referral_ledger_rows(referral_rows, aggregate_referrals):
+    """تعداد ردیف‌های پاداشی که یک دسته در دفتر کل ایجاد می‌کرد (برای حالت شبیه‌سازی)."""
+    if aggregate_referrals:
+        return len({(r['user_id'], r['profit_date']) for r in referral_rows})
+    return len(referral_rows)
+
+def _tally_chunk(report, chunk, profit_rows, referral_rows, referral_ledger_rows):
+    """افزودن تعداد و مبالغ یک دسته به گزارش اجرا (به تفکیک پلن)."""
+    plan_of = {inv.id: inv.plan_name for inv in chunk}
+    for row in profit_rows:
+        plan = report['plans'].setdefault(plan_of[row['investment_id']], {'payouts': 0, 'amount': Decimal('0')})
+        plan['payouts'] += 1
+        plan['amount'] += row['amount']
+        report['profit_amount'] += row['amount']
+    for row in referral_rows:
+        report['referral_amount'] += row['amount']
+
+    report['investments'] += len(chunk)
+    report['payouts'] += len(profit_rows)
+    report['referral_rows'] += referral_ledger_rows
+    report['referral_bonuses'] += len(referral_rows)
+
+def _stale_before(app):
+    return datetime.utcnow() - timedelta(minutes=app.config.get('PROFIT_RUN_STALE_MINUTES', DEFAULT_RUN_STALE_MINUTES))
+
+def find_resumable_run(run_date, min_id=None, max_id=None, stale_before=None):
+    """
+    آخرین اجرای ناتمام برای همین روز و همین بازه id، در صورت وجود: اجرای failed، یا اجرای running
+    که heartbeat آن (یا started_at) قدیمی‌تر از stale_before است (پروسس از کار افتاده).
+    """
+    from models import ProfitRun
+
+    last_seen = func.coalesce(ProfitRun.heartbeat_at, ProfitRun.started_at)
+    return ProfitRun.query.filter(
+        ProfitRun.run_date == run_date,
+        ProfitRun.min_investment_id.is_(None) if min_id is None else ProfitRun.min_investment_id == min_id,
+        ProfitRun.max_investment_id.is_(None) if max_id is None else ProfitRun.max_investment_id == max_id,
+        or_(
+            ProfitRun.status == 'failed',
+            and_(ProfitRun.status == 'running', last_seen < stale_before) if stale_before else false()
+        )
+    ).order_by(ProfitRun.id.desc()).first()
+
+def find_live_run(run_date, min_id=None, max_id=None, stale_before=None):
+    """اجرای running با heartbeat تازه که بازه id آن با بازه داده شده همپوشانی دارد."""
+    from models import ProfitRun
+
+    conditions = [
+        ProfitRun.run_date == run_date,
+        ProfitRun.status == 'running',
+        func.coalesce(ProfitRun.heartbeat_at, ProfitRun.started_at) >= stale_before,
+    ]
+    if max_id is not None:
+        conditions.append(or_(ProfitRun.min_investment_id.is_(None), ProfitRun.min_investment_id <= max_id))
+    if min_id is not None:
+        conditions.append(or_(ProfitRun.max_investment_id.is_(None), ProfitRun.max_investment_id >= min_id))
+    return ProfitRun.query.filter(*conditions).order_by(ProfitRun.id.desc()).first()
+
+def backfill_profits_parallel(app, workers, batch_size=None, resume=True, simulate=False):
+    """
+    اجرای موازی موتور سود در چند پروسس مجزا.
+
+    سرمایه‌گذاری‌های فعال به بازه‌های پیوسته و مجزای id تقسیم می‌شوند و هر shard در پروسس
+    خودش (با اپلیکیشن و اتصال دیتابیس مستقل) اجرا می‌شود. چون موتور idempotent است،
+    هر shard ناموفق را می‌توان به تنهایی با --min-id/--max-id دوباره اجرا کرد.
+
+    اگر shardهای ناتمامی از اجرای امروز وجود داشته باشد (و resume=True)، فقط همان بازه‌ها
+    از checkpoint خودشان ادامه داده می‌شوند و shardهای کامل شده دوباره اجرا نمی‌شوند.
+
+    خروجی: گزارش ادغام شده به همراه گزارش هر shard در کلید 'shards'.
+    """
+    shards = _unfinished_shards(app) if resume and not simulate else []
+    if shards:
+        app.logger.info(f"Resuming {len(shards)} unfinished shards from today's run")
+    else:
+        shards = plan_profit_shards(app, workers)
+    started = time.perf_counter()
+    results = []
+
+    if shards:
+        config_name = app.config.get('CONFIG_NAME', 'default')
+        # spawn: هر پروسس اپلیکیشن و pool اتصال خودش را می‌سازد (fork اتصال‌های والد را به اشتراک می‌گذارد)
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=context) as pool:
+            futures = {
+                pool.submit(_run_profit_shard, config_name, min_id, max_id, batch_size, index, resume, simulate): (index, min_id, max_id)
+                for index, (min_id, max_id) in enumerate(shards)
+            }
+            for future in as_completed(futures):
+                index, min_id, max_id = futures[future]
+                try:
+                    shard_report = future.result()
+                except Exception as e:
+                    shard_report = _new_report(min_id, max_id, simulate)
+                    shard_report['errors'].append(f"Shard crashed: {e}")
+                shard_report['shard'] = index
+                results.append(shard_report)
+
+    results.sort(key=lambda r: r['shard'])
+    report = _new_report(simulate=simulate)
+    report['shards'] = results
+    for result in results:
+        for key in ('investments', 'payouts', 'referral_rows', 'referral_bonuses', 'profit_amount', 'referral_amount'):
+            report[key] += result[key]
+        for phase, seconds in result['timings'].items():
+            report['timings'][phase] += seconds
+        for name, totals in result['plans'].items():
+            plan = report['plans'].setdefault(name, {'payouts': 0, 'amount': Decimal('0')})
+            plan['payouts'] += totals['payouts']
+            plan['amount'] += totals['amount']
+        report['errors'].extend(f"[shard {result['shard']}] {e}" for e in result['errors'])
+
+    report['elapsed'] = time.perf_counter() - started
+    rows = report['payouts'] + report['referral_rows']
+    report['rows_per_second'] = rows / report['elapsed'] if report['elapsed'] else 0.0
+
+    app.logger.info(
+        f"--- Parallel Backfill Completed ({len(results)} shards). Total payouts: {report['payouts']}, "
+        f"errors: {len(report['errors'])}, {report['rows_per_second']:.0f} rows/s ---"
+    )
+    return report
+
+def plan_profit_shards(app, workers):
+    """
+    تقسیم سرمایه‌گذاری‌های فعال به حداکثر `workers` بازه پیوسته id با تعداد تقریباً برابر (NTILE).
+    بازه اول از ابتدا و بازه آخر تا انتها باز است تا رکوردهای فعال شده در حین اجرا از قلم نیفتند.
+    خروجی: لیست (min_id, max_id) که None یعنی بدون محدودیت.
+    """
+    with app.app_context():
+        from models import Investment
+
+        ranked = db.session.query(
+            Investment.id.label('id'),
+            func.ntile(workers).over(order_by=Investment.id).label('shard')
+        ).filter(Investment.status == 'active').subquery()
+
+        bounds = db.session.query(func.max(ranked.c.id))\
+            .group_by(ranked.c.shard)\
+            .order_by(ranked.c.shard)\
+            .all()
+
+    shards = []
+    previous_max = None
+    for (upper,) in bounds:
+        shards.append((previous_max + 1 if previous_max is not None else None, upper))
+        previous_max = upper
+    if shards:
+        shards[-1] = (shards[-1][0], None)
+    return shards
+
+def _unfinished_shards(app):
+    """بازه‌های shardهای امروز که آخرین اجرایشان کامل نشده است."""
+    with app.app_context():
+        from models import ProfitRun
+
+        runs = ProfitRun.query.filter(
+            ProfitRun.run_date == datetime.utcnow().date(),
+            ProfitRun.shard.isnot(None)
+        ).order_by(ProfitRun.id).all()
+
+        latest = {}
+        for run in runs:
+            latest[(run.min_investment_id, run.max_investment_id)] = run.status
+        return sorted(
+            (bounds for bounds, status in latest.items() if status != 'completed'),
+            key=lambda bounds: bounds[0] or 0
+        )
+
+def _run_profit_shard(config_name, min_id, max_id, batch_size, shard, resume, simulate):
+    """نقطه ورود پروسس worker: ساخت اپلیکیشن مستقل و اجرای موتور روی یک بازه id."""
+    from factory import create_app
+
+    shard_app = create_app(config_name)
+    return backfill_profits(shard_app, batch_size=batch_size, min_id=min_id, max_id=max_id,
+                            shard=shard, resume=resume, simulate=simulate)
+
+def _compute_chunk_payouts(chunk, today, ref_percent):
+    """
+    محاسبه تمام ردیف‌های سود و پاداش معرف برای یک دسته از سرمایه‌گذاری‌ها در حافظه.
+    خروجی: (ردیف‌های سود، ردیف‌های پاداش معرف)
+    """
+    windows = {}
+    for inv in chunk:
+        if inv.start_date is None:
+            continue
+        # تعیین تاریخ شروع بررسی: یک روز بعد از آخرین سود، یا تاریخ شروع سرمایه‌گذاری
+        if inv.last_profit_date:
+            first_day = inv.last_profit_date + timedelta(days=1)
+        else:
+            first_day = inv.start_date.date()
+        if first_day <= today:
+            windows[inv.id] = first_day
+
+    if not windows:
+        return [], []
+
+    paid_days = _load_paid_days(list(windows), min(windows.values()))
+
+    profit_rows = []
+    referral_rows = []
+    for inv in chunk:
+        first_day = windows.get(inv.id)
+        if first_day is None:
+            continue
+
+        daily_profit = (inv.amount * (inv.annual_return_rate / Decimal('100.0'))) / Decimal('365.0')
+        daily_profit = daily_profit.quantize(Decimal('0.0001'))
+        bonus = None
+        if inv.referrer_id:
+            bonus = (daily_profit * (ref_percent / Decimal('100.0'))).quantize(Decimal('0.0001'))
+
+        already_paid = paid_days.get(inv.id, ())
+        current_date = first_day
+        while current_date <= today:
+            if current_date not in already_paid:
+                # تنظیم ساعت واریز به ۱۲ ظهر همان روز تاریخی
+                payout_timestamp = datetime.combine(current_date, datetime.min.time()) + timedelta(hours=12)
+                profit_rows.append({
+                    'user_id': inv.user_id,
+                    'investment_id': inv.id,
+                    'type': 'profit',
+                    'amount': daily_profit,
+                    'description': f"Recovered profit for {current_date}",
+                    'status': 'completed',
+                    'timestamp': payout_timestamp,
+                    'tx_hash': None,
+                    'profit_date': current_date,
+                })
+                if bonus is not None and bonus > Decimal('0'):
+                    referral_rows.append({
+                        'user_id': inv.referrer_id,
+                        'investment_id': None,
+                        'type': 'referral_bonus',
+                        'amount': bonus,
+                        'description': f"Referral bonus recovery {current_date}",
+                        'status': 'completed',
+                        'timestamp': payout_timestamp,
+                        'tx_hash': None,
+                        'profit_date': current_date,
+                        'source_investment_id': inv.id,
+                        'referee_id': inv.user_id,
+                    })
+            current_date += timedelta(days=1)
+
+    return profit_rows, referral_rows
+
+def _active_chunk_query(last_id, max_id, batch_size, lock=True):
+    """دسته بعدی سرمایه‌گذاری‌های فعال بعد از last_id (به همراه نرخ پلن و معرف کاربر)، به ترتیب id."""
+    from models import Investment, InvestmentPlan, User
+
+    query = db.session.query(
+        Investment.id,
+        Investment.user_id,
+        Investment.amount,
+        Investment.start_date,
+        Investment.last_profit_date,
+        InvestmentPlan.id.label('plan_id'),
+        InvestmentPlan.name.label('plan_name'),
+        InvestmentPlan.annual_return_rate,
+        User.referrer_id
+    ).join(InvestmentPlan, Investment.plan_id == InvestmentPlan.id)\
+     .join(User, Investment.user_id == User.id)\
+     .filter(Investment.status == 'active', Investment.id > last_id)
+    if max_id is not None:
+        query = query.filter(Investment.id <= max_id)
+    query = query.order_by(Investment.id).limit(batch_size)
+    if lock:
+        query = query.with_for_update(of=Investment)
+    return query
+
+def _paid_days_query(investment_ids, since):
+    """(investment_id, profit_date) سودهای ثبت شده یک دسته از سرمایه‌گذاری‌ها از تاریخ since به بعد."""
+    from models import Transaction
+
+    # فقط ردیف‌های سود هم investment_id و هم profit_date دارند؛ فیلتر type عمداً حذف شده
+    # تا planner به جای ix_transactions_type_profit_date از ایندکس یکتا استفاده کند
+    return db.session.query(Transaction.investment_id, Transaction.profit_date).filter(
+        Transaction.investment_id.in_(investment_ids),
+        Transaction.profit_date >= since
+    )
+
+def _load_paid_days(investment_ids, since):
+    """استخراج روزهایی که قبلاً برای هر سرمایه‌گذاری سود ثبت شده است (یک کوئری ایندکس‌دار برای کل دسته)."""
+    rows = _paid_days_query(investment_ids, since).all()
+
+    paid = {}
+    for inv_id, day in rows:
+        paid.setdefault(inv_id, set()).add(day)
+    return paid
+
+def _dialect_insert(model):
+    """دستور INSERT دیالکت دیتابیس فعلی (با پشتیبانی ON CONFLICT)، یا None برای سایر دیتابیس‌ها."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert(model)
+
+def _insert_ignoring_duplicates(model):
+    """دستور INSERT ... ON CONFLICT DO NOTHING بر اساس دیالکت دیتابیس فعلی."""
+    stmt = _dialect_insert(model)
+    if stmt is None:
+        # سایر دیتابیس‌ها: بررسی روزهای پرداخت شده در _load_paid_days تکرار را حذف می‌کند
+        return insert(model)
+    return stmt.on_conflict_do_nothing()
+
+def _upsert_aggregated_referrals():
+    """INSERT ردیف تجمیعی پاداش معرف که در صورت وجود ردیف (معرف، روز) مبلغ آن را افزایش می‌دهد."""
+    from models import Transaction, AGGREGATED_REFERRAL_WHERE
+
+    stmt = _dialect_insert(Transaction)
+    if stmt is None:
+        # سایر دیتابیس‌ها: ایندکس یکتا ردیف تکراری را رد می‌کند و دسته با خطا ثبت می‌شود
+        return insert(Transaction)
+    return stmt.on_conflict_do_update(
+        index_elements=['user_id', 'profit_date'],
+        index_where=text(AGGREGATED_REFERRAL_WHERE),
+        set_={'amount': Transaction.amount + stmt.excluded.amount}
+    )
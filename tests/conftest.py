@@ -0,0 +1,146 @@
+import os
+import random
+import sys
+import tempfile
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+# ماژول‌های پروژه در ریشه مخزن هستند
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# دیتابیس فایل (نه حافظه) تا پروسس‌های shard در تست --workers هم به آن دسترسی داشته باشند؛
+# قبل از import شدن config تنظیم می‌شود و پروسس‌های spawn شده آن را از محیط به ارث می‌برند
+TEST_DB_PATH = os.path.join(tempfile.gettempdir(), f'vesthub-test-{os.getpid()}.db')
+os.environ.setdefault('TEST_DATABASE_URL', 'sqlite:///' + TEST_DB_PATH)
+
+def _remove_test_db():
+    for suffix in ('', '-journal', '-wal', '-shm'):
+        if os.path.exists(TEST_DB_PATH + suffix):
+            os.remove(TEST_DB_PATH + suffix)
+
+@pytest.fixture
+def app():
+    """اپلیکیشن testing روی یک دیتابیس تازه با همه مهاجرت‌ها."""
+    from factory import create_app
+    from extensions import db
+    from migrations import upgrade_database
+    from utils import invalidate_role_permissions
+
+    _remove_test_db()
+    app = create_app('testing')
+    upgrade_database(app)
+    with app.app_context():
+        # کش دسترسی نقش‌ها در سطح پروسس است؛ شناسه نقش‌ها در دیتابیس تازه دوباره استفاده می‌شوند
+        invalidate_role_permissions()
+        db.session.commit()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    _remove_test_db()
+
+@pytest.fixture
+def ledger_data(app):
+    """
+    داده نمونه قطعی: کاربران با زنجیره معرف، پلن‌ها، سرمایه‌گذاری‌های فعال و در انتظار (بخشی با
+    last_profit_date یا سود از قبل ثبت شده) و برداشت‌ها. خروجی: {'users', 'investments'} (شناسه‌ها).
+    """
+    from extensions import db
+    from models import User, InvestmentPlan, Investment, SystemSetting, Transaction
+    from ledger import verify_balances, rebuild_daily_rollup
+
+    rnd = random.Random(7)
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.add(SystemSetting(key='referral_percentage', value='3.5'))
+        plans = [
+            InvestmentPlan(name=f'Plan {i}', duration_months=12, annual_return_rate=Decimal(rate))
+            for i, rate in enumerate(['12.50', '20.00', '7.25'])
+        ]
+        db.session.add_all(plans)
+        db.session.flush()
+
+        users = []
+        for i in range(30):
+            user = User(email=f'user{i}@example.com', password='x', first_name='User', last_name=str(i),
+                        phone=f'+90555{i:04d}', referral_code=f'REF{i:04d}')
+            if users and rnd.random() < 0.6:
+                user.referrer_id = rnd.choice(users).id
+            db.session.add(user)
+            db.session.flush()
+            users.append(user)
+
+        investments = []
+        for _ in range(60):
+            investment = Investment(
+                user_id=rnd.choice(users).id, plan_id=rnd.choice(plans).id,
+                amount=Decimal(rnd.randint(100, 100000)) / Decimal('7'),
+                status=rnd.choice(['active'] * 4 + ['pending_payment']),
+                start_date=now - timedelta(days=rnd.randint(0, 20), hours=rnd.randint(0, 23))
+            )
+            if rnd.random() < 0.3:
+                investment.last_profit_date = (now - timedelta(days=rnd.randint(1, 10))).date()
+            db.session.add(investment)
+            db.session.flush()
+            investments.append(investment)
+            if rnd.random() < 0.2:
+                paid = now - timedelta(days=rnd.randint(0, 5))
+                db.session.add(Transaction(
+                    user_id=investment.user_id, investment_id=investment.id, type='profit', amount=Decimal('1'),
+                    status='completed', timestamp=paid.replace(hour=12), description='Daily profit',
+                    profit_date=paid.date()
+                ))
+
+        for user in users[:10]:
+            db.session.add(Transaction(user_id=user.id, type='withdrawal', amount=Decimal('3'),
+                                       status=rnd.choice(['pending', 'completed', 'rejected'])))
+        db.session.commit()
+        # ردیف‌ها مستقیم درج شده‌اند؛ موجودی‌ها و جمع روزانه مثل مهاجرت‌های ۲ و ۶ از دفتر کل ساخته می‌شوند
+        verify_balances(fix=True)
+        rebuild_daily_rollup()
+        db.session.commit()
+        return {'users': [u.id for u in users], 'investments': [i.id for i in investments]}
+
+@pytest.fixture
+def admin_client(app, ledger_data):
+    """کلاینت وارد شده با نقش Admin (کاربر اول داده نمونه)."""
+    grant_role(app, ledger_data['users'][0], 'Admin')
+    return login_client(app, ledger_data['users'][0])
+
+def grant_role(app, user_id, name, permissions=''):
+    """ساخت نقش (در صورت نبود) با دسترسی‌های جدا شده با کاما و اختصاص آن به کاربر."""
+    from extensions import db
+    from models import Role, User
+
+    with app.app_context():
+        role = Role.query.filter_by(name=name).first()
+        if role is None:
+            role = Role(name=name, permissions=permissions)
+            db.session.add(role)
+            db.session.flush()
+        user = db.session.get(User, user_id)
+        user.role_id = role.id
+        user.is_email_verified = True
+        db.session.commit()
+
+def login_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+        session['lang'] = 'en'
+    return client
+
+def ledger_snapshot(app, after_id=0):
+    """ردیف‌های دفتر کل بعد از after_id (بدون id و profit_date) و last_profit_date سرمایه‌گذاری‌ها، مرتب شده."""
+    from models import Transaction, Investment
+
+    with app.app_context():
+        transactions = sorted(
+            (t.user_id, t.investment_id or 0, t.type, str(t.amount), t.description, t.status, str(t.timestamp))
+            for t in Transaction.query.filter(Transaction.id > after_id)
+        )
+        investments = sorted((i.id, i.last_profit_date) for i in Investment.query.all())
+        return transactions, investments
@@ -0,0 +1,27 @@
+"""تست‌های داشبورد ادمین: شاخص‌ها فقط برای نقش‌های دارای view_ledger."""
+
+from conftest import grant_role, login_client
+
+def _support_client(app, ledger_data):
+    user_id = ledger_data['users'][1]
+    grant_role(app, user_id, 'Support', 'manage_tickets')
+    return login_client(app, user_id)
+
+def test_admin_stats_for_ledger_viewers(app, admin_client):
+    response = admin_client.get('/admin/api/chart/admin-stats')
+    assert response.status_code == 200
+    assert {'registrations', 'payouts', 'allocation', 'pending', 'totals'} <= set(response.get_json())
+    assert b'kpiAum' in admin_client.get('/admin/dashboard').data
+
+def test_admin_stats_without_view_ledger_is_a_json_403(app, ledger_data):
+    client = _support_client(app, ledger_data)
+    response = client.get('/admin/api/chart/admin-stats')
+    assert response.status_code == 403
+    assert 'error' in response.get_json()
+
+    # صفحه داشبورد بدون ویجت‌ها و بدون درخواست API شاخص‌ها نمایش داده می‌شود
+    page = client.get('/admin/dashboard')
+    assert page.status_code == 200
+    assert b'kpiAum' not in page.data and b'admin-stats' not in page.data
+    # صفحه‌های عادی همچنان پیام و redirect می‌گیرند
+    assert client.get('/admin/accounting').status_code == 302
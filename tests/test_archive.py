@@ -0,0 +1,82 @@
+"""تست‌های بایگانی دفتر کل: موجودی‌ها، جمع‌های روزانه و خلاصه‌ها قبل و بعد از بایگانی یکسان می‌مانند."""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import func
+
+from conftest import ledger_snapshot
+
+def _totals(app, user_ids):
+    from ledger import compute_balances, compute_daily_rollup
+    from dashboard import dashboard_summary, compute_admin_kpis
+
+    with app.app_context():
+        kpis = compute_admin_kpis()
+        kpis.pop('generated_at')
+        return {
+            'balances': compute_balances(),
+            'rollup': compute_daily_rollup(),
+            'dashboards': {user_id: dashboard_summary(user_id) for user_id in user_ids},
+            'kpis': kpis,
+        }
+
+def _archive_everything(monkeypatch):
+    import archive
+
+    # همه روزهای داده نمونه (حداکثر ۲۰ روز پیش) قبل از cutoff قرار می‌گیرند، مستقل از روز اجرای تست
+    monkeypatch.setattr(archive, 'archive_cutoff', lambda horizon_days: datetime.utcnow().date() + timedelta(days=1))
+
+def test_archive_keeps_balances_and_totals(app, ledger_data, monkeypatch):
+    import tasks
+    from archive import archive_ledger
+    from ledger import verify_balances
+
+    tasks.backfill_profits(app, batch_size=7)
+    before = _totals(app, ledger_data['users'])
+    _archive_everything(monkeypatch)
+
+    dry = archive_ledger(app, batch_size=13, dry_run=True)
+    assert dry['rows'] > 0
+    assert _totals(app, ledger_data['users']) == before
+
+    report = archive_ledger(app, batch_size=13)
+    assert (report['rows'], report['amount']) == (dry['rows'], dry['amount'])
+    assert _totals(app, ledger_data['users']) == before
+    with app.app_context():
+        assert verify_balances() == []
+
+    # روزهای بایگانی شده دوباره پرداخت نمی‌شوند و اجرای دوم چیزی بایگانی نمی‌کند
+    snapshot = ledger_snapshot(app)
+    assert tasks.backfill_profits(app, batch_size=7)['payouts'] == 0
+    assert archive_ledger(app, batch_size=13)['rows'] == 0
+    assert ledger_snapshot(app) == snapshot
+
+def test_summaries_match_archived_rows(app, ledger_data, monkeypatch):
+    import tasks
+    from extensions import db
+    from archive import archive_ledger
+    from models import ArchivedTransaction, LedgerSummary, Transaction
+
+    tasks.backfill_profits(app, batch_size=7)
+    _archive_everything(monkeypatch)
+    report = archive_ledger(app, batch_size=13)
+
+    with app.app_context():
+        archived = {}
+        for row in ArchivedTransaction.query.all():
+            key = (row.user_id, row.investment_id, row.type, row.profit_date.replace(day=1))
+            group = archived.setdefault(key, [0, Decimal('0'), row.profit_date, row.profit_date])
+            group[0] += 1
+            group[1] += row.amount
+            group[2] = min(group[2], row.profit_date)
+            group[3] = max(group[3], row.profit_date)
+        summaries = {
+            (s.user_id, s.investment_id, s.type, s.month): [s.row_count, s.amount, s.first_day, s.last_day]
+            for s in LedgerSummary.query.all()
+        }
+        assert summaries == archived
+        assert sum(group[0] for group in archived.values()) == report['rows']
+        # ردیف‌های بایگانی شده از دفتر کل زنده حذف شده‌اند
+        archived_ids = [row_id for (row_id,) in db.session.query(ArchivedTransaction.id)]
+        assert db.session.query(func.count(Transaction.id)).filter(Transaction.id.in_(archived_ids)).scalar() == 0
@@ -0,0 +1,110 @@
+"""تست‌های تایید/رد دسته‌ای واریزها و برداشت‌ها (/admin/payments/bulk و /admin/withdrawals/bulk)."""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+
+@pytest.fixture
+def deposits(app, ledger_data):
+    """واریزهای در انتظار: لینک شده، لینک نشده با TxID، تسویه شده، و یک برداشت در انتظار."""
+    from extensions import db
+    from models import Investment, Transaction
+    from ledger import verify_balances
+
+    with app.app_context():
+        user_id = ledger_data['users'][2]
+        plan_id = db.session.get(Investment, ledger_data['investments'][0]).plan_id
+        linked_inv = Investment(user_id=user_id, plan_id=plan_id, amount=Decimal('100'), status='pending_payment')
+        unlinked_inv = Investment(user_id=user_id, plan_id=plan_id, amount=Decimal('50'), status='pending_payment',
+                                  payment_tx_id='TX-UNLINKED')
+        db.session.add_all([linked_inv, unlinked_inv])
+        db.session.flush()
+        rows = {
+            'linked': Transaction(user_id=user_id, investment=linked_inv, type='deposit', amount=Decimal('100'),
+                                  status='pending', tx_hash='TX-LINKED'),
+            'unlinked': Transaction(user_id=user_id, type='deposit', amount=Decimal('50'), status='pending',
+                                    tx_hash='TX-UNLINKED'),
+            'done': Transaction(user_id=user_id, type='deposit', amount=Decimal('10'), status='completed'),
+            'withdrawal': Transaction(user_id=user_id, type='withdrawal', amount=Decimal('1'), status='pending'),
+        }
+        db.session.add_all(rows.values())
+        db.session.commit()
+        verify_balances(fix=True)
+        db.session.commit()
+        ids = {name: tx.id for name, tx in rows.items()}
+        ids.update(linked_inv=linked_inv.id, unlinked_inv=unlinked_inv.id)
+        return ids
+
+def test_bulk_approve_reports_each_outcome(app, admin_client, deposits):
+    from extensions import db
+    from models import Investment, Transaction
+    from ledger import verify_balances
+
+    ids = [deposits['linked'], deposits['unlinked'], deposits['done'], deposits['withdrawal'], 999999,
+           deposits['linked']]
+    response = admin_client.post('/admin/payments/bulk', json={'action': 'approve', 'ids': ids})
+    body = response.get_json()
+
+    assert response.status_code == 200
+    assert body['summary'] == {'approved': 2, 'rejected': 0, 'skipped': 1, 'not_found': 2}
+    # شناسه تکراری یک بار گزارش می‌شود و ترتیب ورودی حفظ می‌شود
+    assert [(r['id'], r['outcome']) for r in body['results']] == [
+        (deposits['linked'], 'approved'), (deposits['unlinked'], 'approved'), (deposits['done'], 'skipped'),
+        (deposits['withdrawal'], 'not_found'), (999999, 'not_found'),
+    ]
+    assert body['results'][1]['investment_id'] == deposits['unlinked_inv']
+
+    with app.app_context():
+        for inv_id in (deposits['linked_inv'], deposits['unlinked_inv']):
+            inv = db.session.get(Investment, inv_id)
+            assert inv.status == 'active' and inv.start_date > datetime.utcnow() - timedelta(minutes=1)
+        # واریز لینک نشده برای دفعات بعد به سرمایه‌گذاری لینک می‌شود
+        assert db.session.get(Transaction, deposits['unlinked']).investment_id == deposits['unlinked_inv']
+        assert db.session.get(Transaction, deposits['withdrawal']).status == 'pending'
+        assert verify_balances() == []
+
+    # اجرای دوباره همان درخواست چیزی را تغییر نمی‌دهد
+    again = admin_client.post('/admin/payments/bulk', json={'action': 'reject', 'ids': ids[:2]}).get_json()
+    assert again['summary'] == {'approved': 0, 'rejected': 0, 'skipped': 2, 'not_found': 0}
+
+def test_bulk_reject_from_the_form(app, admin_client, deposits):
+    from extensions import db
+    from models import Investment, Transaction
+
+    response = admin_client.post('/admin/payments/bulk', data={
+        'action': 'reject', 'tx_ids': [str(deposits['linked']), str(deposits['unlinked']), 'abc']
+    })
+    assert response.status_code == 302 and response.location.endswith('/admin/payments')
+    with app.app_context():
+        assert db.session.get(Transaction, deposits['linked']).status == 'rejected'
+        assert db.session.get(Investment, deposits['linked_inv']).status == 'rejected'
+        assert db.session.get(Investment, deposits['unlinked_inv']).status == 'rejected'
+        # رد واریز لینک نشده، آن را به سرمایه‌گذاری لینک نمی‌کند
+        assert db.session.get(Transaction, deposits['unlinked']).investment_id is None
+
+def test_bulk_withdrawals_update_balances(app, admin_client, deposits, ledger_data):
+    from extensions import db
+    from models import Transaction
+    from ledger import verify_balances
+
+    with app.app_context():
+        pending = [tx.id for tx in Transaction.query.filter_by(type='withdrawal', status='pending')]
+    assert len(pending) > 1
+    body = admin_client.post('/admin/withdrawals/bulk', json={'action': 'approve', 'ids': pending}).get_json()
+    assert body['summary']['approved'] == len(pending)
+    with app.app_context():
+        assert {db.session.get(Transaction, tx_id).status for tx_id in pending} == {'completed'}
+        assert verify_balances() == []
+
+@pytest.mark.parametrize('payload', [{'action': 'approve', 'ids': []}, {'action': 'delete', 'ids': [1]}])
+def test_bulk_rejects_invalid_requests(app, admin_client, deposits, payload):
+    response = admin_client.post('/admin/payments/bulk', json=payload)
+    assert response.status_code == 400 and 'error' in response.get_json()
+
+def test_bulk_rejects_too_many_ids(app, admin_client, deposits):
+    from routes.admin import BULK_REVIEW_LIMIT
+
+    response = admin_client.post('/admin/payments/bulk',
+                                 json={'action': 'approve', 'ids': list(range(1, BULK_REVIEW_LIMIT + 2))})
+    assert response.status_code == 400
@@ -0,0 +1,108 @@
+"""تست‌های کش هویت (identity.identity_cache): بارگذاری بدون کوئری و ابطال بعد از هر تغییر."""
+
+import pytest
+from sqlalchemy import event
+
+from conftest import grant_role, login_client
+
+@pytest.fixture
+def cache(app, ledger_data, monkeypatch):
+    from identity import identity_cache
+
+    monkeypatch.setattr(identity_cache, 'enabled', True)
+    identity_cache.clear()
+    yield identity_cache
+    identity_cache.clear()
+
+class _QueryCounter:
+    def __init__(self, engine):
+        self.engine = engine
+        self.statements = []
+
+    def _count(self, conn, cursor, statement, *args):
+        self.statements.append(statement)
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self._count)
+
+def test_cached_identity_loads_without_queries(app, cache, ledger_data):
+    from extensions import db
+
+    user_id = ledger_data['users'][3]
+    with app.app_context():
+        first = cache.load(user_id)
+        email = first.email
+        db.session.remove()
+        with _QueryCounter(db.engine) as counter:
+            user = cache.load(user_id)
+            assert (user.id, user.email, user.role) == (user_id, email, None)
+        assert counter.statements == []
+        # ستون‌های خارج از snapshot از دیتابیس خوانده می‌شوند
+        assert user.password == 'x'
+
+def test_orm_change_invalidates_the_user(app, cache, ledger_data):
+    from extensions import db
+    from models import User
+
+    user_id, other_id = ledger_data['users'][3], ledger_data['users'][4]
+    with app.app_context():
+        cache.load(user_id)
+        cache.load(other_id)
+        db.session.remove()
+
+        db.session.get(User, user_id).kyc_status = 'verified'
+        db.session.commit()
+        db.session.remove()
+        assert cache.backend.get(f'identity:{user_id}') is None
+        assert cache.backend.get(f'identity:{other_id}') is not None
+        assert cache.load(user_id).kyc_status == 'verified'
+
+def test_role_change_clears_every_snapshot(app, cache, ledger_data):
+    from extensions import db
+    from models import Role
+
+    user_id = ledger_data['users'][5]
+    grant_role(app, user_id, 'Support', 'manage_tickets')
+    with app.app_context():
+        assert cache.load(user_id).role.permissions == 'manage_tickets'
+        db.session.remove()
+        Role.query.filter_by(name='Support').one().permissions = 'manage_tickets,view_ledger'
+        db.session.commit()
+        db.session.remove()
+        assert cache.load(user_id).role.permissions == 'manage_tickets,view_ledger'
+
+def test_bulk_updates_invalidate_referees(app, cache, ledger_data):
+    from extensions import db
+    from models import User
+    from deletion import request_user_deletion
+
+    with app.app_context():
+        referrer = next(user for user in User.query.order_by(User.id)
+                        if user.id != ledger_data['users'][0] and User.query.filter_by(referrer_id=user.id).count())
+        referrer_id = referrer.id
+        referee_ids = [user.id for user in User.query.filter_by(referrer_id=referrer_id)]
+        for user_id in referee_ids:
+            assert cache.load(user_id).referrer_id == referrer_id
+        db.session.remove()
+
+        request_user_deletion(db.session.get(User, referrer_id))
+        db.session.commit()
+        db.session.remove()
+        assert [cache.load(user_id).referrer_id for user_id in referee_ids] == [None] * len(referee_ids)
+
+def test_role_change_applies_to_the_next_request(app, cache, admin_client, ledger_data):
+    from models import Role
+
+    user_id = ledger_data['users'][6]
+    grant_role(app, user_id, 'Support', 'manage_tickets')
+    staff = login_client(app, user_id)
+    assert staff.get('/admin/accounting').status_code == 302
+
+    with app.app_context():
+        admin_role_id = Role.query.filter_by(name='Admin').one().id
+    admin_client.post(f'/admin/users/change-role/{user_id}', data={'new_role_id': admin_role_id})
+    assert staff.get('/admin/accounting').status_code == 200
@@ -0,0 +1,58 @@
+"""تست‌های موجودی‌های تجمیعی (ledger) در برابر محاسبه مستقیم از دفتر کل."""
+
+from decimal import Decimal
+
+def _new_withdrawals(app, user_ids, amount):
+    from extensions import db
+    from models import Transaction
+    from ledger import record_new_transaction
+
+    with app.app_context():
+        ids = []
+        for user_id in user_ids:
+            tx = Transaction(user_id=user_id, type='withdrawal', amount=amount, status='pending',
+                             description='User withdrawal request')
+            db.session.add(tx)
+            record_new_transaction(tx)
+            ids.append(tx.id)
+        db.session.commit()
+        return ids
+
+def test_balances_have_zero_drift_after_engine_and_withdrawals(app, admin_client, ledger_data):
+    import tasks
+    from ledger import compute_balances, get_user_balance, verify_balances
+
+    assert tasks.backfill_profits(app, batch_size=7)['payouts'] > 0
+    users = ledger_data['users']
+    fresh = _new_withdrawals(app, users[10:15], Decimal('0.5'))
+    single = _new_withdrawals(app, users[15:17], Decimal('1.25'))
+
+    assert admin_client.post(f'/admin/withdrawals/approve/{single[0]}').status_code == 302
+    assert admin_client.post(f'/admin/withdrawals/reject/{single[1]}').status_code == 302
+    response = admin_client.post('/admin/withdrawals/bulk', json={'action': 'approve', 'ids': fresh[:3]})
+    assert response.get_json()['summary']['approved'] == 3
+    response = admin_client.post('/admin/withdrawals/bulk', json={'action': 'reject', 'ids': fresh[2:]})
+    assert response.get_json()['summary'] == {'approved': 0, 'rejected': 2, 'skipped': 1, 'not_found': 0}
+    # دور دوم موتور سود بعد از تغییر وضعیت‌ها
+    tasks.backfill_profits(app, batch_size=7)
+
+    with app.app_context():
+        assert verify_balances() == []
+        computed = compute_balances()
+        for user_id in users:
+            expected = computed.get(user_id)
+            withdrawable = (expected['earnings'] - expected['pending_withdrawals'] - expected['completed_withdrawals']
+                            if expected else Decimal('0'))
+            assert get_user_balance(user_id) == withdrawable
+
+def test_missing_balance_row_is_computed_from_the_ledger(app, ledger_data):
+    from extensions import db
+    from models import UserBalance
+    from ledger import get_user_balance
+
+    user_id = ledger_data['users'][3]
+    with app.app_context():
+        stored = get_user_balance(user_id)
+        db.session.query(UserBalance).filter_by(user_id=user_id).delete()
+        db.session.commit()
+        assert get_user_balance(user_id) == stored
@@ -0,0 +1,73 @@
+"""تست‌های صفحه‌بندی keyset (utils.keyset_paginate) در برابر ترتیب کامل کوئری."""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+def _cash_flow_rows(app, ledger_data):
+    """۴۵ واریز و برداشت با timestampهای تکراری تا مرز صفحه‌ها روی ردیف‌های هم‌زمان بیفتد."""
+    from extensions import db
+    from models import Transaction
+
+    with app.app_context():
+        base = datetime(2026, 1, 1, 12)
+        for i in range(45):
+            db.session.add(Transaction(
+                user_id=ledger_data['users'][i % 5], type='deposit' if i % 3 else 'withdrawal',
+                amount=Decimal(i + 1), status='completed', timestamp=base + timedelta(minutes=i // 4)
+            ))
+        db.session.commit()
+
+def _cash_flow_query():
+    from models import Transaction
+
+    return Transaction.query.filter(Transaction.type.in_(['deposit', 'withdrawal']))
+
+def _key(tx):
+    return tx.timestamp, tx.id
+
+def test_pages_walk_forward_and_back_without_gaps(app, ledger_data):
+    from models import Transaction
+    from utils import keyset_paginate
+
+    _cash_flow_rows(app, ledger_data)
+    columns = (Transaction.timestamp, Transaction.id)
+    with app.app_context():
+        expected = [_key(tx) for tx in _cash_flow_query().order_by(Transaction.timestamp.desc(), Transaction.id.desc())]
+
+        pages = [keyset_paginate(_cash_flow_query(), columns, per_page=7)]
+        assert not pages[0].has_prev
+        while pages[-1].has_next:
+            pages.append(keyset_paginate(_cash_flow_query(), columns, cursor=pages[-1].next_cursor, per_page=7))
+        assert [_key(tx) for page in pages for tx in page.items] == expected
+        assert len(pages) == -(-len(expected) // 7)
+        assert all(page.has_prev for page in pages[1:])
+
+        # برگشت از صفحه آخر با cursorهای قبلی همان صفحه‌ها را به ترتیب معکوس می‌دهد
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = keyset_paginate(_cash_flow_query(), columns, cursor=page.prev_cursor, direction='prev', per_page=7)
+            assert [_key(tx) for tx in page.items] == [_key(tx) for tx in previous.items]
+        assert not page.has_prev
+
+def test_malformed_cursor_falls_back_to_first_page(app, ledger_data):
+    from models import Transaction
+    from utils import keyset_paginate
+
+    _cash_flow_rows(app, ledger_data)
+    columns = (Transaction.timestamp, Transaction.id)
+    with app.app_context():
+        first = keyset_paginate(_cash_flow_query(), columns, per_page=7)
+        for cursor in ('garbage', 'not-a-date,1', '2026-01-01T12:00:00'):
+            page = keyset_paginate(_cash_flow_query(), columns, cursor=cursor, per_page=7)
+            assert [_key(tx) for tx in page.items] == [_key(tx) for tx in first.items]
+
+def test_accounting_cash_flow_follows_cursor(app, admin_client, ledger_data):
+    from models import Transaction
+    from utils import keyset_paginate
+
+    _cash_flow_rows(app, ledger_data)
+    with app.app_context():
+        first = keyset_paginate(_cash_flow_query(), (Transaction.timestamp, Transaction.id), per_page=20)
+    response = admin_client.get('/admin/accounting', query_string={'tab': 'cash_flow', 'cursor': first.next_cursor})
+    assert response.status_code == 200
+    assert b'direction=prev' in response.data
@@ -0,0 +1,37 @@
+"""تست‌های سقف همزمانی هش رمز روی میزبان (HostSlots) و رد درخواست با PasswordHasherBusy."""
+
+import pytest
+from flask import Flask
+
+from passwords import HostSlots, PasswordHasher, PasswordHasherBusy
+
+def test_host_slots_are_shared_between_instances(tmp_path):
+    # دو نمونه روی یک پوشه مثل دو worker وب روی یک میزبان رفتار می‌کنند
+    first, second = HostSlots(str(tmp_path), 2), HostSlots(str(tmp_path), 2)
+    a = first.acquire(0)
+    b = second.acquire(0)
+    assert a is not None and b is not None
+    assert first.acquire(0.05) is None
+
+    second.release(b)
+    c = first.acquire(0)
+    assert c is not None
+    first.release(a)
+    first.release(c)
+
+def test_hash_is_rejected_when_host_slots_are_taken(tmp_path):
+    app = Flask(__name__)
+    app.config.update(PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_HOST_CONCURRENCY=1,
+                      PASSWORD_HASH_SLOT_DIR=str(tmp_path), PASSWORD_HASH_QUEUE_TIMEOUT=0.05)
+    hasher = PasswordHasher(app)
+    other_worker = HostSlots(str(tmp_path), 1)
+    held = other_worker.acquire(0)
+    try:
+        with pytest.raises(PasswordHasherBusy):
+            hasher.hash('secret')
+        assert hasher.stats()['busy'] == 1
+    finally:
+        other_worker.release(held)
+    # جای خالی worker هم آزاد شده است
+    assert hasher._slots.acquire(timeout=0)
+    hasher._slots.release()
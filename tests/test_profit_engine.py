@@ -0,0 +1,335 @@
+"""تست‌های موتور دسته‌ای سود (tasks.backfill_profits) در برابر حلقه ردیف به ردیف قبلی."""
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import func
+
+from conftest import ledger_snapshot
+
+def legacy_process_missed_profits(app):
+    """حلقه قبلی process_missed_profits (یک کوئری، یک INSERT و یک commit برای هر روز) به عنوان مرجع."""
+    from extensions import db
+    from models import Investment, Transaction, SystemSetting
+
+    with app.app_context():
+        ref_setting = db.session.get(SystemSetting, 'referral_percentage')
+        ref_percent = Decimal(ref_setting.value) if ref_setting else Decimal('2.0')
+        today = datetime.utcnow().date()
+        total = 0
+        for inv in Investment.query.filter_by(status='active').all():
+            if inv.last_profit_date:
+                current_date = inv.last_profit_date + timedelta(days=1)
+            else:
+                current_date = inv.start_date.date()
+            while current_date <= today:
+                existing = Transaction.query.filter(
+                    Transaction.investment_id == inv.id,
+                    Transaction.type == 'profit',
+                    func.date(Transaction.timestamp) == current_date
+                ).first()
+                if existing:
+                    current_date += timedelta(days=1)
+                    continue
+                daily_profit = (inv.amount * (inv.plan.annual_return_rate / Decimal('100.0'))) / Decimal('365.0')
+                daily_profit = daily_profit.quantize(Decimal('0.0001'))
+                timestamp = datetime.combine(current_date, datetime.min.time()) + timedelta(hours=12)
+                db.session.add(Transaction(
+                    user_id=inv.user_id, investment_id=inv.id, type='profit', amount=daily_profit,
+                    description=f"Recovered profit for {current_date}", status='completed', timestamp=timestamp
+                ))
+                if inv.user.referrer_id:
+                    bonus = (daily_profit * (ref_percent / Decimal('100.0'))).quantize(Decimal('0.0001'))
+                    if bonus > Decimal('0'):
+                        db.session.add(Transaction(
+                            user_id=inv.user.referrer_id, type='referral_bonus', amount=bonus,
+                            description=f"Referral bonus recovery {current_date}", status='completed',
+                            timestamp=timestamp
+                        ))
+                if not inv.last_profit_date or current_date > inv.last_profit_date:
+                    inv.last_profit_date = current_date
+                db.session.commit()
+                total += 1
+                current_date += timedelta(days=1)
+        return total
+
+def _ledger_state(app):
+    """(بزرگ‌ترین id تراکنش، last_profit_date هر سرمایه‌گذاری) برای برگرداندن داده به حالت قبل از اجرا."""
+    from extensions import db
+    from models import Investment, Transaction
+
+    with app.app_context():
+        max_id = db.session.query(func.max(Transaction.id)).scalar() or 0
+        return max_id, {inv.id: inv.last_profit_date for inv in Investment.query.all()}
+
+def _restore(app, state):
+    from extensions import db
+    from models import Investment, Transaction
+
+    max_id, last_dates = state
+    with app.app_context():
+        Transaction.query.filter(Transaction.id > max_id).delete(synchronize_session=False)
+        for inv in Investment.query.all():
+            inv.last_profit_date = last_dates[inv.id]
+        db.session.commit()
+
+def test_engine_matches_legacy_loop(app, ledger_data):
+    import tasks
+
+    state = _ledger_state(app)
+    legacy_payouts = legacy_process_missed_profits(app)
+    legacy = ledger_snapshot(app, after_id=state[0])
+    _restore(app, state)
+
+    report = tasks.backfill_profits(app, batch_size=7)
+
+    assert report['errors'] == []
+    assert report['payouts'] == legacy_payouts > 0
+    assert ledger_snapshot(app, after_id=state[0]) == legacy
+
+def test_rerun_adds_nothing(app, ledger_data):
+    import tasks
+
+    assert tasks.backfill_profits(app, batch_size=7)['payouts'] > 0
+    before = ledger_snapshot(app)
+    report = tasks.backfill_profits(app, batch_size=7)
+    assert (report['payouts'], report['referral_rows']) == (0, 0)
+    assert ledger_snapshot(app) == before
+
+def _active_investment(app, ledger_data):
+    from models import Investment, User
+
+    with app.app_context():
+        inv = Investment.query.join(User, Investment.user_id == User.id).filter(
+            Investment.status == 'active', Investment.last_profit_date.is_(None), User.referrer_id.isnot(None)
+        ).order_by(Investment.start_date).first()
+        return inv.id, inv.user_id, inv.start_date.date()
+
+def test_unique_index_rejects_duplicate_payout(app, ledger_data):
+    from sqlalchemy.exc import IntegrityError
+    from extensions import db
+    from models import Transaction
+
+    inv_id, user_id, day = _active_investment(app, ledger_data)
+    with app.app_context():
+        for hour in (3, 12):
+            db.session.add(Transaction(user_id=user_id, investment_id=inv_id, type='profit', amount=Decimal('1'),
+                                       status='completed', profit_date=day,
+                                       timestamp=datetime.combine(day, datetime.min.time()) + timedelta(hours=hour)))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+
+def test_engine_skips_days_already_paid(app, ledger_data):
+    import tasks
+    from extensions import db
+    from models import Transaction
+
+    inv_id, user_id, day = _active_investment(app, ledger_data)
+    with app.app_context():
+        # پرداخت همان روز با ساعتی غیر از ۱۲ (تشخیص تکرار بر اساس profit_date است نه timestamp)
+        db.session.add(Transaction(user_id=user_id, investment_id=inv_id, type='profit', amount=Decimal('1'),
+                                   status='completed', profit_date=day, description='Manual',
+                                   timestamp=datetime.combine(day, datetime.min.time()) + timedelta(hours=3)))
+        db.session.commit()
+
+    tasks.backfill_profits(app, batch_size=7)
+
+    with app.app_context():
+        rows = Transaction.query.filter_by(investment_id=inv_id, profit_date=day).all()
+        assert [row.description for row in rows] == ['Manual']
+        expected_days = (datetime.utcnow().date() - day).days + 1
+        assert Transaction.query.filter_by(investment_id=inv_id, type='profit').count() == expected_days
+
+def test_concurrently_written_payout_is_skipped_with_its_bonus(app, ledger_data):
+    import tasks
+    from extensions import db
+    from models import Transaction, User
+
+    inv_id, user_id, day = _active_investment(app, ledger_data)
+    timestamp = datetime.combine(day, datetime.min.time()) + timedelta(hours=12)
+    with app.app_context():
+        referrer_id = db.session.get(User, user_id).referrer_id
+        profit = {'user_id': user_id, 'investment_id': inv_id, 'type': 'profit', 'amount': Decimal('5'),
+                  'description': f'Recovered profit for {day}', 'status': 'completed', 'timestamp': timestamp,
+                  'tx_hash': None, 'profit_date': day}
+        bonus = dict(profit, user_id=referrer_id, investment_id=None, type='referral_bonus', amount=Decimal('0.1'),
+                     description=f'Referral bonus recovery {day}', source_investment_id=inv_id, referee_id=user_id)
+        # اجرای دیگری همین روز را بین محاسبه و نوشتن ثبت کرده است
+        db.session.add(Transaction(**dict(profit, description='Other run')))
+        db.session.commit()
+
+        written, bonuses, referral_ledger_rows = tasks._write_chunk_payouts([profit], [bonus])
+        db.session.commit()
+
+        assert (written, bonuses, referral_ledger_rows) == ([], [], 0)
+        assert Transaction.query.filter_by(investment_id=inv_id, profit_date=day).count() == 1
+        assert Transaction.query.filter_by(user_id=referrer_id, type='referral_bonus').count() == 0
+
+def test_parallel_shards_match_serial_run(app, ledger_data):
+    import tasks
+    from extensions import db
+    from ledger import verify_balances
+
+    state = _ledger_state(app)
+    report = tasks.backfill_profits_parallel(app, workers=3, batch_size=7)
+    assert report['errors'] == []
+    assert len(report['shards']) == 3
+    parallel = ledger_snapshot(app, after_id=state[0])
+    with app.app_context():
+        assert verify_balances() == []
+    _restore(app, state)
+    with app.app_context():
+        # _restore دفتر کل را برمی‌گرداند، نه موجودی‌ها و rollup را
+        verify_balances(fix=True)
+        db.session.commit()
+
+    serial = tasks.backfill_profits(app, batch_size=7, resume=False)
+    assert serial['payouts'] == report['payouts']
+    assert ledger_snapshot(app, after_id=state[0]) == parallel
+
+def test_failed_run_resumes_from_checkpoint(app, ledger_data, monkeypatch):
+    import tasks
+    from extensions import db
+    from models import ProfitRun
+
+    state = _ledger_state(app)
+    clean = tasks.backfill_profits(app, batch_size=7)
+    expected = ledger_snapshot(app, after_id=state[0])
+    _restore(app, state)
+
+    real_write = tasks._write_chunk_payouts
+    calls = []
+    def failing_write(*args):
+        calls.append(1)
+        if len(calls) == 3:
+            raise RuntimeError('disk full')
+        return real_write(*args)
+    monkeypatch.setattr(tasks, '_write_chunk_payouts', failing_write)
+    first = tasks.backfill_profits(app, batch_size=7, resume=False)
+    monkeypatch.setattr(tasks, '_write_chunk_payouts', real_write)
+
+    with app.app_context():
+        failed = db.session.get(ProfitRun, first['run_id'])
+        assert (failed.status, failed.error_count) == ('failed', 1)
+        assert failed.last_investment_id is not None
+
+    second = tasks.backfill_profits(app, batch_size=7)
+    assert second['resumed_from'] == first['run_id']
+    assert second['errors'] == []
+    assert first['payouts'] + second['payouts'] == clean['payouts']
+    with app.app_context():
+        assert db.session.get(ProfitRun, first['run_id']).status == 'resumed'
+        assert db.session.get(ProfitRun, second['run_id']).status == 'completed'
+    assert ledger_snapshot(app, after_id=state[0]) == expected
+
+def _journal_run(app, minutes_ago, **kwargs):
+    from extensions import db
+    from models import ProfitRun
+
+    with app.app_context():
+        seen = datetime.utcnow() - timedelta(minutes=minutes_ago)
+        run = ProfitRun(run_date=datetime.utcnow().date(), status='running', started_at=seen, heartbeat_at=seen,
+                        last_investment_id=0, **kwargs)
+        db.session.add(run)
+        db.session.commit()
+        return run.id
+
+def test_live_run_is_never_taken_over(app, ledger_data):
+    import tasks
+
+    _journal_run(app, minutes_ago=1)
+    before = ledger_snapshot(app)
+    report = tasks.backfill_profits(app, batch_size=7)
+    assert report['run_id'] is None and report['payouts'] == 0
+    assert 'still running' in report['errors'][0]
+    # یک shard با بازه همپوشان هم شروع نمی‌شود
+    assert tasks.backfill_profits(app, batch_size=7, min_id=1, max_id=10)['run_id'] is None
+    assert ledger_snapshot(app) == before
+
+def test_stale_running_run_is_resumed(app, ledger_data):
+    import tasks
+    from extensions import db
+    from models import ProfitRun
+
+    stale_id = _journal_run(app, minutes_ago=app.config['PROFIT_RUN_STALE_MINUTES'] + 1)
+    report = tasks.backfill_profits(app, batch_size=7)
+    assert report['resumed_from'] == stale_id
+    assert report['payouts'] > 0
+    with app.app_context():
+        assert db.session.get(ProfitRun, stale_id).status == 'resumed'
+
+def test_simulation_writes_nothing_and_matches_real_run(app, ledger_data):
+    import tasks
+    from extensions import db
+    from models import ProfitRun
+
+    before = ledger_snapshot(app)
+    simulated = tasks.backfill_profits(app, batch_size=7, simulate=True)
+    assert ledger_snapshot(app) == before
+    with app.app_context():
+        assert db.session.query(ProfitRun).count() == 0
+    assert simulated['simulated'] and simulated['run_id'] is None
+
+    real = tasks.backfill_profits(app, batch_size=7)
+    keys = ('investments', 'payouts', 'referral_rows', 'referral_bonuses', 'profit_amount', 'referral_amount', 'plans')
+    assert {k: simulated[k] for k in keys} == {k: real[k] for k in keys}
+    assert real['payouts'] > 0
+
+def _enable_referral_aggregation(app):
+    from extensions import db
+    from models import SystemSetting
+
+    with app.app_context():
+        db.session.add(SystemSetting(key='referral_aggregation', value='1'))
+        db.session.commit()
+
+def _assert_one_aggregated_row_per_referrer_day(app):
+    from extensions import db
+    from models import Transaction, ReferralBonusDetail
+    from ledger import verify_balances
+
+    with app.app_context():
+        rows = Transaction.query.filter_by(type='referral_bonus').all()
+        assert rows and all(row.aggregated for row in rows)
+        keys = [(row.user_id, row.profit_date) for row in rows]
+        assert len(keys) == len(set(keys))
+        breakdown = dict(db.session.query(ReferralBonusDetail.transaction_id, func.sum(ReferralBonusDetail.amount))
+                         .group_by(ReferralBonusDetail.transaction_id).all())
+        assert {row.id: row.amount for row in rows} == {tx_id: Decimal(str(total)).quantize(Decimal('0.0001'))
+                                                        for tx_id, total in breakdown.items()}
+        assert verify_balances() == []
+
+def test_aggregated_referrals_one_row_per_referrer_day(app, ledger_data):
+    import tasks
+
+    _enable_referral_aggregation(app)
+    # دسته‌های کوچک تا ردیف‌های یک (معرف، روز) در چند دسته افزایش یابند
+    report = tasks.backfill_profits(app, batch_size=3)
+    assert report['errors'] == [] and report['referral_rows'] < report['referral_bonuses']
+    _assert_one_aggregated_row_per_referrer_day(app)
+
+def test_aggregated_referrals_with_parallel_shards(app, ledger_data):
+    import tasks
+
+    _enable_referral_aggregation(app)
+    report = tasks.backfill_profits_parallel(app, workers=3, batch_size=3)
+    assert report['errors'] == []
+    _assert_one_aggregated_row_per_referrer_day(app)
+
+def test_aggregated_referral_upsert_adds_to_existing_row(app, ledger_data):
+    import tasks
+    from extensions import db
+    from models import Transaction
+
+    inv_id, user_id, day = _active_investment(app, ledger_data)
+    with app.app_context():
+        bonus = {'user_id': ledger_data['users'][0], 'profit_date': day, 'amount': Decimal('0.25'),
+                 'source_investment_id': inv_id, 'referee_id': user_id}
+        assert tasks._write_aggregated_referrals([bonus]) == [day]
+        # اجرای دیگری پاداش سرمایه‌گذاری دیگری را برای همان (معرف، روز) می‌نویسد
+        other_id = next(i for i in ledger_data['investments'] if i != inv_id)
+        assert tasks._write_aggregated_referrals([dict(bonus, amount=Decimal('0.5'), source_investment_id=other_id)]) == []
+        db.session.commit()
+        rows = Transaction.query.filter_by(user_id=bonus['user_id'], type='referral_bonus').all()
+        assert [(row.profit_date, row.amount) for row in rows] == [(day, Decimal('0.75'))]
@@ -0,0 +1,16 @@
+"""EXPLAIN QUERY PLAN کوئری‌های پرتکرار (همان سازنده‌های کد اصلی) روی طرح کامل دیتابیس."""
+
+from migrations import _hot_queries, check_query_plans
+
+def test_hot_queries_use_their_index(app):
+    results = check_query_plans(app)
+    assert results
+    missing = [(name, index_name, plan) for name, index_name, used, plan in results if not used]
+    assert missing == []
+
+def test_hot_queries_cover_the_ledger_paths(app):
+    with app.app_context():
+        names = {name for name, _, _ in _hot_queries()}
+    for name in ('get_user_balance fallback', 'admin.payments queue', 'admin.withdrawals queue',
+                 'accounting profit logs by user', 'accounting profit logs by day', 'profit engine paid-days check'):
+        assert name in names
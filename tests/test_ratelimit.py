@@ -0,0 +1,89 @@
+"""تست‌های LocalRateLimitBackend، RateLimiter.check و هدر Retry-After با ساعت جعلی."""
+
+import pytest
+from flask import Flask
+
+import ratelimit
+from ratelimit import LocalRateLimitBackend, RateLimiter, too_many_attempts
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(ratelimit.time, 'monotonic', clock)
+    return clock
+
+@pytest.fixture
+def app(tmp_path):
+    (tmp_path / 'limited.html').write_text('limited')
+    app = Flask(__name__, template_folder=str(tmp_path))
+    app.config.update(SECRET_KEY='test', RATE_LIMITS={'login': {'ip': (3, 30), 'account': (2, 60)}})
+    return app
+
+def test_burst_up_to_capacity_then_retry_after(clock):
+    backend = LocalRateLimitBackend()
+    # ظرفیت ۵، پر شدن کامل در ۳۰۰ ثانیه (یک توکن در هر ۶۰ ثانیه)
+    assert [backend.consume('k', 5, 5 / 300) for _ in range(5)] == [0] * 5
+    assert backend.consume('k', 5, 5 / 300) == pytest.approx(60)
+
+    clock.advance(45)
+    assert backend.consume('k', 5, 5 / 300) == pytest.approx(15)
+
+def test_refill_is_linear_and_capped_at_capacity(clock):
+    backend = LocalRateLimitBackend()
+    for _ in range(5):
+        backend.consume('k', 5, 5 / 300)
+
+    clock.advance(120)
+    assert backend.consume('k', 5, 5 / 300) == 0
+    assert backend.consume('k', 5, 5 / 300) == 0
+    assert backend.consume('k', 5, 5 / 300) > 0
+
+    # بیکاری طولانی سطل را فقط تا ظرفیت پر می‌کند
+    clock.advance(10000)
+    assert [backend.consume('k', 5, 5 / 300) for _ in range(6)][-2:] == [0, pytest.approx(60)]
+
+def test_buckets_are_independent_and_reset(clock):
+    backend = LocalRateLimitBackend()
+    assert backend.consume('a', 1, 1 / 60) == 0
+    assert backend.consume('a', 1, 1 / 60) > 0
+    assert backend.consume('b', 1, 1 / 60) == 0
+
+    backend.reset('a')
+    assert backend.consume('a', 1, 1 / 60) == 0
+
+def test_check_blocks_on_ip_before_spending_account_tokens(app, clock):
+    limiter = RateLimiter(app)
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.1'}):
+        assert limiter.check('login', 'User@Example.com') == 0
+        assert limiter.check('login', ' user@example.com') == 0
+        # سطل حساب (ظرفیت ۲، بدون حساس بودن به حروف و فاصله) خالی است
+        assert limiter.check('login', 'user@example.com') == pytest.approx(30)
+        # سطل IP هم خالی است؛ حساب دیگر از همین IP رد می‌شود بدون مصرف توکن حساب
+        assert limiter.check('login', 'other@example.com') == pytest.approx(10)
+
+    with app.test_request_context(environ_base={'REMOTE_ADDR': '10.0.0.2'}):
+        assert limiter.check('login', 'other@example.com') == 0
+        assert limiter.check('unknown_scope', 'other@example.com') == 0
+
+def test_disabled_limiter_allows_everything(app, clock):
+    app.config['RATE_LIMIT_ENABLED'] = False
+    limiter = RateLimiter(app)
+    with app.test_request_context():
+        assert all(limiter.check('login', 'user@example.com') == 0 for _ in range(10))
+
+@pytest.mark.parametrize('retry_after, header', [(59.2, '60'), (60, '60'), (0.01, '1')])
+def test_too_many_attempts_rounds_retry_after_up(app, retry_after, header):
+    with app.test_request_context():
+        body, status, headers = too_many_attempts('limited.html', retry_after)
+    assert (body, status) == ('limited', 429)
+    assert headers == {'Retry-After': header}
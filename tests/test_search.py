@@ -0,0 +1,77 @@
+"""تست‌های جستجوی کاربران و جریان نقدی (FTS5 / ilike) در برابر ilike ساده روی همان ستون‌ها."""
+
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import or_
+
+TERMS = ['user1', 'USER2', 'example.com', '0555001', 'ref002', 'er 1', 'TXHASH-00', 'bank wire', 'us', '7', 'missing']
+
+@pytest.fixture
+def cash_flow(app, ledger_data):
+    from extensions import db
+    from models import Transaction
+
+    with app.app_context():
+        for i, user_id in enumerate(ledger_data['users']):
+            db.session.add(Transaction(user_id=user_id, type='deposit', amount=Decimal('10'), status='completed',
+                                       tx_hash=f'TXHASH-{i:03d}', description=f'Bank wire {i}'))
+            # نوع غیر جریان نقدی با همان متن نباید پیدا شود
+            db.session.add(Transaction(user_id=user_id, type='profit', amount=Decimal('1'), status='completed',
+                                       tx_hash=f'TXHASH-{i:03d}', description=f'Bank wire {i}'))
+        db.session.commit()
+
+def _reference_users(term):
+    from models import User
+
+    pattern = f'%{term}%'
+    return {user.id for user in User.query.filter(or_(
+        User.email.ilike(pattern), (User.first_name + ' ' + User.last_name).ilike(pattern),
+        User.phone.ilike(pattern), User.referral_code.ilike(pattern)
+    ))}
+
+def _reference_transactions(term):
+    from models import Transaction
+
+    pattern = f'%{term}%'
+    matches = or_(Transaction.tx_hash.ilike(pattern), Transaction.description.ilike(pattern),
+                  Transaction.user_id.in_(_reference_users(term)))
+    if term.isdigit():
+        matches = or_(matches, Transaction.id == int(term))
+    return {tx.id for tx in Transaction.query.filter(Transaction.type.in_(['deposit', 'withdrawal']), matches)}
+
+@pytest.mark.parametrize('term', TERMS)
+def test_user_search_matches_ilike(app, cash_flow, term):
+    from extensions import db
+    from models import User
+    from search import search_users
+
+    with app.app_context():
+        ids, has_next = search_users(term, per_page=1000)
+        expected = _reference_users(term)
+        if term.isdigit() and db.session.get(User, int(term)):
+            # شناسه عددی کاربر موجود هم پیدا می‌شود
+            expected.add(int(term))
+        assert (set(ids), has_next) == (expected, False)
+        assert len(ids) == len(set(ids))
+
+@pytest.mark.parametrize('term', TERMS)
+def test_cash_flow_search_matches_ilike(app, cash_flow, term):
+    from models import Transaction
+    from export import cash_flow_conditions
+
+    with app.app_context():
+        found = {tx.id for tx in Transaction.query.filter(*cash_flow_conditions(search=term))}
+        assert found == _reference_transactions(term)
+
+def test_search_index_follows_updates(app, cash_flow, ledger_data):
+    from extensions import db
+    from models import User
+    from search import search_users
+
+    user_id = ledger_data['users'][4]
+    with app.app_context():
+        db.session.get(User, user_id).email = 'renamed-account@example.org'
+        db.session.commit()
+        assert search_users('renamed-account')[0] == [user_id]
+        assert user_id not in search_users('user4@')[0]
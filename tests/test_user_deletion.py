@@ -0,0 +1,105 @@
+"""تست‌های حذف کاربر در پس‌زمینه (deletion.run_user_deletion) با دسته‌های کوچک."""
+
+import pytest
+
+@pytest.fixture
+def victim(app, ledger_data):
+    """کاربری که هم معرف دارد و هم زیرمجموعه، با سودها و پاداش‌های تجمیعی ثبت شده."""
+    import tasks
+    from extensions import db
+    from models import Investment, SystemSetting, User
+
+    app.config['USER_DELETION_BATCH_SIZE'] = 5
+    with app.app_context():
+        db.session.add(SystemSetting(key='referral_aggregation', value='1'))
+        db.session.commit()
+    tasks.backfill_profits(app, batch_size=7)
+    with app.app_context():
+        for user in User.query.filter(User.referrer_id.isnot(None)).order_by(User.id):
+            if user.id != ledger_data['users'][0] and User.query.filter_by(referrer_id=user.id).count() \
+                    and Investment.query.filter_by(user_id=user.id, status='active').count():
+                return user.id
+    pytest.fail('sample data has no referrer with a referrer and active investments')
+
+def _stored_rollup():
+    from models import DailyLedgerRollup
+
+    return {(row.day, row.type): [row.row_count, row.amount] for row in DailyLedgerRollup.query}
+
+def _assert_user_removed(app, user_id):
+    from extensions import db
+    from models import (User, Transaction, ArchivedTransaction, LedgerSummary, UserBalance, Investment,
+                        AuditLog, ReferralBonusDetail)
+    from ledger import compute_daily_rollup, verify_balances
+
+    with app.app_context():
+        assert db.session.get(User, user_id) is None
+        for model in (Transaction, ArchivedTransaction, LedgerSummary, UserBalance, Investment, AuditLog):
+            assert model.query.filter_by(user_id=user_id).count() == 0
+        assert User.query.filter_by(referrer_id=user_id).count() == 0
+        assert ReferralBonusDetail.query.filter_by(referee_id=user_id).count() == 0
+        assert verify_balances() == []
+        # ریز پاداش‌های معرف‌ها (با referee خالی) هنوز با مبلغ تراکنش تجمیعی برابرند
+        for tx in Transaction.query.filter_by(type='referral_bonus', aggregated=True):
+            assert sum(d.amount for d in ReferralBonusDetail.query.filter_by(transaction_id=tx.id)) == tx.amount
+        expected = {key: [count, amount] for key, (count, amount) in compute_daily_rollup().items()}
+        assert _stored_rollup() == expected
+
+def test_admin_delete_removes_every_row(app, admin_client, victim):
+    from extensions import db
+    from models import UserDeletionJob
+
+    response = admin_client.post(f'/admin/users/delete/{victim}')
+    assert response.status_code == 302
+    with app.app_context():
+        job = UserDeletionJob.query.filter_by(user_id=victim).one()
+        assert (job.status, job.step, job.error) == ('completed', 'done', None)
+        assert job.rows_deleted > 5
+    _assert_user_removed(app, victim)
+
+    progress = admin_client.get(f'/admin/api/users/{victim}/deletion').get_json()
+    assert progress['status'] == 'completed' and progress['rows_deleted'] == job.rows_deleted
+
+def test_failed_job_resumes_from_its_step(app, victim, monkeypatch):
+    import deletion
+    from extensions import db
+    from models import User, UserDeletionJob
+
+    with app.app_context():
+        job = deletion.request_user_deletion(db.session.get(User, victim))
+        db.session.commit()
+        job_id = job.id
+
+    real_delete = deletion._delete_chunk
+    def failing_delete(model, condition, batch_size):
+        if model is deletion.Investment:
+            raise RuntimeError('lock timeout')
+        return real_delete(model, condition, batch_size)
+    monkeypatch.setattr(deletion, '_delete_chunk', failing_delete)
+    assert deletion.run_user_deletion(app, job_id) == 'failed'
+    with app.app_context():
+        job = db.session.get(UserDeletionJob, job_id)
+        assert (job.step, job.error) == ('investments', 'lock timeout')
+        # کاربر قفل شده باقی می‌ماند و مراحل قبلی تکرار نمی‌شوند
+        assert db.session.get(User, victim).pending_deletion
+
+    monkeypatch.setattr(deletion, '_delete_chunk', real_delete)
+    assert deletion.process_user_deletions(app) == [(job_id, 'completed')]
+    _assert_user_removed(app, victim)
+
+def test_running_job_is_not_claimed_twice(app, victim):
+    import deletion
+    from extensions import db
+    from models import User, UserDeletionJob
+
+    with app.app_context():
+        job = deletion.request_user_deletion(db.session.get(User, victim))
+        job.status = 'running'
+        db.session.commit()
+        job_id = job.id
+
+    assert deletion.run_user_deletion(app, job_id) is None
+    # کار رها شده (بدون پیشرفت) دوباره گرفته می‌شود
+    assert deletion.run_user_deletion(app, job_id, stale_minutes=-1) == 'completed'
+    with app.app_context():
+        assert db.session.get(UserDeletionJob, job_id).status == 'completed'
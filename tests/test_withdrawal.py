@@ -0,0 +1,48 @@
+"""تست محدودیت تلاش کد برداشت: درخواست رد شده بدون کوئری تاریخچه برداشت‌ها جواب داده می‌شود."""
+
+import pytest
+from sqlalchemy import event
+
+from conftest import login_client
+
+@pytest.fixture
+def limited_client(app, ledger_data, monkeypatch):
+    from extensions import db
+    from models import User
+    from ratelimit import rate_limiter, LocalRateLimitBackend
+
+    monkeypatch.setattr(rate_limiter, 'enabled', True)
+    monkeypatch.setattr(rate_limiter, 'backend', LocalRateLimitBackend())
+    user_id = ledger_data['users'][1]
+    with app.app_context():
+        user = db.session.get(User, user_id)
+        user.kyc_status = 'verified'
+        user.is_2fa_enabled = True
+        user.two_factor_secret = 'JBSWY3DPEHPK3PXP'
+        db.session.commit()
+    client = login_client(app, user_id)
+    with client.session_transaction() as session:
+        session['pending_withdrawal'] = {'amount': '1', 'code': '123456', 'timestamp': 0}
+    return client
+
+def test_throttled_code_attempt_skips_history_query(app, limited_client):
+    from extensions import db
+
+    form = {'verify_withdrawal': '1', 'email_code': '000000', 'ga_code': '000000'}
+    for _ in range(5):
+        assert limited_client.post('/withdrawal', data=form).status_code == 200
+
+    statements = []
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        response = limited_client.post('/withdrawal', data=form)
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+    assert response.status_code == 429
+    assert 'Retry-After' in response.headers
+    assert not [s for s in statements if 'FROM transactions' in s]
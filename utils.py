@@ -3,40 +3,99 @@ import re
 import random
 import string
 import threading
-from decimal import Decimal
+import time
+import uuid
 from datetime import datetime
 from flask import current_app, request, render_template_string
 from flask_login import current_user
 from flask_mail import Message
+from sqlalchemy import tuple_
 from werkzeug.utils import secure_filename
 from extensions import db, mail
-from models import User, Transaction, SystemSetting, AuditLog
+from models import User, Role, SystemSetting
+from ledger import get_user_balance
+from cache import TTLCache
+from audit import audit_writer
+
+# کش شمارش ردیف‌های لیست‌ها (approximate_count)
+count_cache = TTLCache(ttl=300)
 
 # --- Security & Permissions ---
 
+# مهر نسخه دسترسی نقش‌ها در system_settings؛ با هر تغییر نقش عوض می‌شود تا کش همه workerها باطل شود
+PERMISSIONS_VERSION_KEY = 'role_permissions_version'
+
+# دسترسی‌های کامپایل شده هر نقش: (role_id، نسخه) -> (ادمین کل؟، frozenset دسترسی‌ها)
+_role_permissions = {}
+_role_permissions_lock = threading.Lock()
+# نسخه فعلی و زمان بررسی بعدی آن (هر PERMISSIONS_VERSION_CHECK_SECONDS یک بار از دیتابیس خوانده می‌شود)
+_permissions_version = {'value': None, 'check_at': 0.0}
+
+def _current_permissions_version():
+    state = _permissions_version
+    if time.monotonic() < state['check_at']:
+        return state['value']
+    version = get_setting(PERMISSIONS_VERSION_KEY, '0')
+    if version != state['value']:
+        with _role_permissions_lock:
+            _role_permissions.clear()
+    state['value'] = version
+    state['check_at'] = time.monotonic() + current_app.config.get('PERMISSIONS_VERSION_CHECK_SECONDS', 5)
+    return version
+
+def compile_role_permissions(role):
+    """مجموعه تغییرناپذیر دسترسی‌های یک نقش (فقط یک بار برای هر نقش و نسخه)."""
+    perms = frozenset(p.strip() for p in (role.permissions or '').split(',') if p.strip())
+    return role.name == 'Admin', perms
+
+def role_permissions(role_id):
+    """دسترسی‌های کامپایل شده یک نقش از کش پروسس: (ادمین کل؟، frozenset) یا None."""
+    if role_id is None:
+        return None
+    key = (role_id, _current_permissions_version())
+    compiled = _role_permissions.get(key)
+    if compiled is None:
+        role = db.session.get(Role, role_id)
+        if role is None:
+            return None
+        compiled = compile_role_permissions(role)
+        with _role_permissions_lock:
+            _role_permissions[key] = compiled
+    return compiled
+
+def invalidate_role_permissions():
+    """تغییر مهر نسخه بعد از ایجاد/ویرایش/حذف نقش (این پروسس فوراً، بقیه در بررسی بعدی نسخه)."""
+    version = uuid.uuid4().hex[:16]
+    set_setting(PERMISSIONS_VERSION_KEY, version)
+    with _role_permissions_lock:
+        _role_permissions.clear()
+        _permissions_version['value'] = version
+        _permissions_version['check_at'] = time.monotonic() + current_app.config.get('PERMISSIONS_VERSION_CHECK_SECONDS', 5)
+
 def has_permission(perm_name):
-    if not current_user.is_authenticated or not current_user.role:
+    # یک بار باز کردن proxy (هر دسترسی به current_user چند میکروثانیه هزینه دارد)
+    user = current_user._get_current_object()
+    if user is None or not user.is_authenticated:
         return False
-    if current_user.role.name == 'Admin':
-        return True
-    role_perms = current_user.role.permissions.split(',') if current_user.role.permissions else []
-    return perm_name in role_perms
+    # role_id ستون خود کاربر است؛ رابطه role بارگذاری نمی‌شود
+    compiled = role_permissions(user.role_id)
+    if compiled is None:
+        return False
+    is_admin, perms = compiled
+    return is_admin or perm_name in perms
 
 def log_admin_activity(action, details):
-    if current_user.is_authenticated and current_user.role:
-        if current_user.role.name == 'Admin' or current_user.role.permissions:
-            try:
-                log = AuditLog(
-                    user_id=current_user.id,
-                    action=action,
-                    details=details,
-                    ip_address=request.remote_addr
-                )
-                db.session.add(log)
-                db.session.commit()
-            except Exception as e:
-                print(f"Error logging activity: {e}")
-                db.session.rollback()
+    # در صف writer پس‌زمینه لاگ‌ها قرار می‌گیرد: بدون commit (یا flush این session) اضافه برای هر اقدام
+    user = current_user._get_current_object()
+    if user is not None and user.is_authenticated:
+        compiled = role_permissions(user.role_id)
+        if compiled and (compiled[0] or compiled[1]):
+            audit_writer.submit(
+                user_id=user.id,
+                action=action,
+                details=details,
+                ip_address=request.remote_addr
+            )
 
 def is_strong_password(password):
     if len(password) < 8: return False
@@ -66,19 +125,99 @@ def set_setting(key, value):
     db.session.commit()
 
 def get_withdrawable_balance(user_id):
-    earnings = db.session.query(db.func.sum(Transaction.amount)).filter(
-        Transaction.user_id == user_id, 
-        Transaction.type.in_(['profit', 'referral_bonus']), 
-        Transaction.status == 'completed'
-    ).scalar() or Decimal('0.0')
-    
-    withdrawals = db.session.query(db.func.sum(Transaction.amount)).filter(
-        Transaction.user_id == user_id, 
-        Transaction.type == 'withdrawal', 
-        Transaction.status.in_(['pending', 'completed'])
-    ).scalar() or Decimal('0.0')
-    
-    return earnings - withdrawals
+    # خواندن O(1) موجودی ذخیره شده با کلید اصلی (ledger.py)
+    return get_user_balance(user_id)
+
+# --- Keyset Pagination ---
+
+class KeysetPage:
+    """یک صفحه از کوئری صفحه‌بندی شده با keyset، همراه با cursor صفحه‌های قبلی و بعدی."""
+
+    def __init__(self, items, columns, has_next, has_prev):
+        self.items = items
+        self.has_next = has_next
+        self.has_prev = has_prev
+        self.next_cursor = encode_cursor(items[-1], columns) if has_next and items else None
+        self.prev_cursor = encode_cursor(items[0], columns) if has_prev and items else None
+
+def encode_cursor(item, columns):
+    values = []
+    for column in columns:
+        value = getattr(item, column.key)
+        values.append(value.isoformat() if isinstance(value, datetime) else str(value))
+    return ','.join(values)
+
+def decode_cursor(cursor, columns):
+    parts = cursor.split(',')
+    if len(parts) != len(columns):
+        raise ValueError('Malformed cursor')
+    values = []
+    for part, column in zip(parts, columns):
+        python_type = column.type.python_type
+        values.append(datetime.fromisoformat(part) if python_type is datetime else python_type(part))
+    return values
+
+def keyset_paginate(query, columns, cursor=None, direction='next', per_page=20):
+    """
+    صفحه‌بندی query به ترتیب نزولی (columns...) بدون OFFSET و COUNT(*).
+    آخرین ستون columns باید یکتا باشد (مثلاً (Transaction.timestamp, Transaction.id)).
+    cursor نامعتبر به صفحه اول برمی‌گردد.
+    """
+    columns = tuple(columns)
+    values = None
+    if cursor:
+        try:
+            values = decode_cursor(cursor, columns)
+        except ValueError:
+            values = None
+    backwards = values is not None and direction == 'prev'
+
+    rows = keyset_page_query(query, columns, values, backwards, per_page).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if backwards:
+        rows.reverse()
+        return KeysetPage(rows, columns, has_next=True, has_prev=has_more)
+    return KeysetPage(rows, columns, has_next=has_more, has_prev=values is not None)
+
+def keyset_page_query(query, columns, values=None, backwards=False, per_page=20):
+    """کوئری یک صفحه keyset: ردیف‌های بعد (یا با backwards قبل) از values، به علاوه یک ردیف برای تشخیص صفحه بعد."""
+    columns = tuple(columns)
+    key = tuple_(*columns) if len(columns) > 1 else columns[0]
+    bound = (tuple_(*values) if len(values) > 1 else values[0]) if values else None
+
+    if backwards:
+        query = query.filter(key > bound).order_by(*[column.asc() for column in columns])
+    else:
+        if bound is not None:
+            query = query.filter(key < bound)
+        query = query.order_by(*[column.desc() for column in columns])
+    return query.limit(per_page + 1)
+
+def approximate_count(query, cache_key, ttl):
+    """
+    تعداد ردیف‌ها برای سربرگ لیست‌های صفحه‌بندی شده، برای هر مجموعه فیلتر به مدت ttl ثانیه در کش.
+    PostgreSQL: تخمین ردیف‌های planner (بدون اسکن)؛ بقیه دیتابیس‌ها: یک COUNT(*) در هر ttl.
+    """
+    def count():
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            # پارامترهای expanding در IN (...) مثل migrations.explain در متن کوئری نوشته می‌شوند
+            compiled = query.statement.compile(dialect=connection.dialect, compile_kwargs={'render_postcompile': True})
+            params = compiled.construct_params()
+            if compiled.positional:
+                params = tuple(params[name] for name in compiled.positiontup)
+            try:
+                # savepoint: خطای EXPLAIN نباید تراکنش درخواست را از کار بیندازد
+                with connection.begin_nested():
+                    plan = connection.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {compiled}', params).scalar()
+                return int(plan[0]['Plan']['Plan Rows'])
+            except Exception as e:
+                current_app.logger.warning(f'Approximate count failed, falling back to COUNT(*): {e}')
+        return query.order_by(None).count()
+
+    return count_cache.get_or_set(('approximate_count',) + tuple(cache_key), count, ttl)
 
 # --- File Utilities ---
 